@@ -0,0 +1,98 @@
+#!/usr/bin/env python2.7
+'''
+Compare running a plugin through the fork server with executing it.
+
+The plugin run both ways reports its own memory: its resident size and the part of
+it that is private to it (not shared with the fork server, or with other processes
+mapping the same files). The time is from starting the process nagios would start
+(the plugin, or fork_client) until it exited, and the client RSS is the peak
+resident size of that process.
+
+This source is provided under the MIT License (see LICENSE.txt)
+Copyright (c) 2014 Ryan C. Catherman
+'''
+
+import optparse
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+import nagios.forkserver as forkserver
+import nagios.plugins as plugins
+
+FORK_CLIENT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'src', 'fork_client.py')
+
+class MemoryPlugin(plugins.PluginBase):
+    '''
+    Reports its resident and private memory in kB
+    '''
+
+    def _run(self, opts):
+        fields = {}
+        with open('/proc/self/smaps_rollup') as f:
+            for line in f:
+                tokens = line.split()
+                if len(tokens) == 3 and tokens[2] == 'kB':
+                    fields[tokens[0].rstrip(':')] = int(tokens[1])
+        private = fields['Private_Clean'] + fields['Private_Dirty']
+        self._output.set_simple_result("%d %d" % (fields['Rss'], private))
+
+def run(argv):
+    start = time.time()
+    p = subprocess.Popen(argv, stdout=subprocess.PIPE)
+    out = p.stdout.read()
+    _, status, usage = os.wait4(p.pid, 0)
+    elapsed = time.time() - start
+    assert status == 0, out
+    rss, private = [int(v) for v in out.split()]
+    return elapsed, rss, private, usage.ru_maxrss
+
+def report(name, runs):
+    times = sorted(r[0] for r in runs)
+    count = len(runs)
+    print "%-10s %9.2f %9.2f %10d %12d %12d" % (
+        name,
+        1000 * sum(times) / count,
+        1000 * times[int(0.95 * (count - 1))],
+        sum(r[1] for r in runs) / count,
+        sum(r[2] for r in runs) / count,
+        sum(r[3] for r in runs) / count)
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser(usage="%prog [options]")
+    parser.add_option('-n', '--runs', dest="runs", type="int", default=200)
+    parser.add_option('--plugin', dest="plugin", action="store_true", default=False,
+        help="Be the plugin (what the exec runs)")
+    opts, args = parser.parse_args()
+
+    if opts.plugin:
+        MemoryPlugin()([sys.argv[0]])
+
+    workdir = tempfile.mkdtemp()
+    path = os.path.join(workdir, 'socket')
+    server = forkserver.ForkServer(path, {'memory': MemoryPlugin})
+    server.listen()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            signal.signal(signal.SIGTERM, lambda signum, frame: server.stop())
+            server.serve_forever()
+        finally:
+            os._exit(0)
+
+    try:
+        execs = [run([sys.executable, os.path.abspath(__file__), '--plugin']) for _ in range(opts.runs)]
+        forks = [run([sys.executable, FORK_CLIENT, path, 'memory']) for _ in range(opts.runs)]
+    finally:
+        os.kill(pid, signal.SIGTERM)
+        os.waitpid(pid, 0)
+        shutil.rmtree(workdir)
+
+    print "%d runs of each" % opts.runs
+    print "%-10s %9s %9s %10s %12s %12s" % ("", "mean ms", "p95 ms", "rss kB", "private kB", "client kB")
+    report('exec', execs)
+    report('fork', forks)
@@ -0,0 +1,56 @@
+#!/usr/bin/env python2.7
+'''
+Time nagios.metrics with a large number of checks: updating every check, a scrape
+after all of them changed, a scrape after only a few did and a scrape with nothing
+new (the usual case when scrapes come more often than checks).
+
+This source is provided under the MIT License (see LICENSE.txt)
+Copyright (c) 2014 Ryan C. Catherman
+'''
+
+import optparse
+import time
+
+import nagios.metrics as metrics
+import nagios.plugins as plugins
+import nagios.runner as runner
+
+def make_result(i):
+    return runner.PluginResult(i % 4, perf_data=[
+        plugins.PerfData('value', i, 'B', warning="1000", critical="2000", minimum=0),
+    ], seconds=0.01)
+
+def timed(func, *args):
+    start = time.time()
+    out = func(*args)
+    return time.time() - start, out
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser(usage="%prog [options]")
+    parser.add_option('-n', '--checks', dest="count", type="int", default=100000)
+    parser.add_option('-c', '--changed', dest="changed", type="int", default=1000)
+    opts, args = parser.parse_args()
+
+    checks = [('host%d' % (i / 10), 'svc%d' % (i % 10)) for i in range(opts.count)]
+    results = [make_result(i) for i in range(opts.count)]
+    exporter = metrics.MetricsExporter(max_checks=opts.count)
+
+    def update_all():
+        for (host, service), result in zip(checks, results):
+            exporter.update(host, service, result)
+
+    def update_some():
+        for i in range(opts.changed):
+            exporter.update(checks[i][0], checks[i][1], results[-1 - i])
+
+    update_seconds, _ = timed(update_all)
+    full_seconds, text = timed(exporter.render)
+    update_some()
+    changed_seconds, _ = timed(exporter.render)
+    cached_seconds, _ = timed(exporter.render)
+
+    print "%d checks, %d lines, %d bytes" % (opts.count, text.count('\n'), len(text))
+    print "%-30s %9.3fs" % ("update every check", update_seconds)
+    print "%-30s %9.3fs" % ("scrape, everything changed", full_seconds)
+    print "%-30s %9.3fs" % ("scrape, %d changed" % opts.changed, changed_seconds)
+    print "%-30s %9.6fs" % ("scrape, nothing changed", cached_seconds)
@@ -0,0 +1,67 @@
+#!/usr/bin/env python2.7
+'''
+Time nagios.objects on a generated config: a host per ten services, every service
+running check_random through one of a few commands with its own arguments, the
+way a large objects.cache looks.
+
+The memory reported is the peak resident size of the process, before and after
+going through the services.
+
+This source is provided under the MIT License (see LICENSE.txt)
+Copyright (c) 2014 Ryan C. Catherman
+'''
+
+import optparse
+import os
+import resource
+import tempfile
+import time
+
+import check_random
+import nagios.objects as objects
+
+def write_config(f, count):
+    for c in range(10):
+        f.write("define command {\n\tcommand_name\tcheck-random-%d\n"
+            "\tcommand_line\t$USER1$/check_random --min $ARG1$ --max $ARG2$ -w $ARG3$\n\t}\n\n" % c)
+    for i in range(count / 11):
+        f.write("define host {\n\thost_name\thost%d\n\taddress\t10.%d.%d.%d\n\t}\n\n" % (
+            i, i / 65536, (i / 256) % 256, i % 256))
+        for s in range(10):
+            f.write("define service {\n\thost_name\thost%d\n\tservice_description\tsvc%d\n"
+                "\tcheck_command\tcheck-random-%d!%d!100!0:%d\n\tcheck_interval\t5\n\t}\n\n" % (
+                i, s, s, i % 10, 50 + s))
+
+def max_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser(usage="%prog [options]")
+    parser.add_option('-n', '--objects', dest="count", type="int", default=110000)
+    opts, args = parser.parse_args()
+
+    objects.register_plugin('check_random', check_random.CheckRandom)
+    f = tempfile.NamedTemporaryFile(suffix='.cfg')
+    try:
+        write_config(f, opts.count)
+        f.flush()
+        size = os.path.getsize(f.name)
+        rss = max_rss_mb()
+
+        start = time.time()
+        config = objects.ObjectConfig([f.name], {'USER1': '/usr/lib/nagios/plugins'})
+        loaded = time.time()
+        mapped = 0
+        services = 0
+        for check in config.services():
+            services += 1
+            if check.error is None:
+                mapped += 1
+        done = time.time()
+
+        print "%d objects, %.1fMB of config" % (opts.count, size / 1048576.0)
+        print "%-24s %8.3fs" % ("first pass", loaded - start)
+        print "%-24s %8.3fs (%d services, %d mapped)" % ("services", done - loaded, services, mapped)
+        print "%-24s %8.1fMB -> %.1fMB" % ("peak rss", rss, max_rss_mb())
+    finally:
+        f.close()
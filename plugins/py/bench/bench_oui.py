@@ -0,0 +1,57 @@
+#!/usr/bin/env python2.7
+'''
+Time the oui vendor index at the size of the IEEE registries: building it, a fresh
+process's first lookup (mapping the index included) and the lookups after that,
+against parsing the registry itself, which is what every run would pay without it.
+
+This source is provided under the MIT License (see LICENSE.txt)
+Copyright (c) 2014 Ryan C. Catherman
+'''
+
+import optparse
+import os
+import random
+import shutil
+import tempfile
+import time
+
+import nagios.oui as oui
+
+def timed(func, *args):
+    start = time.time()
+    out = func(*args)
+    return time.time() - start, out
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser(usage="%prog [options]")
+    parser.add_option('-n', '--lookups', dest="lookups", type="int", default=100000)
+    opts, args = parser.parse_args()
+
+    rand = random.Random(41)
+    entries = (
+        [("%06X" % rand.getrandbits(24), "Vendor %d of MA-L" % i) for i in range(38000)] +
+        [("%07X" % rand.getrandbits(28), "Vendor %d of MA-M" % i) for i in range(5000)] +
+        [("%09X" % rand.getrandbits(36), "Vendor %d of MA-S" % i) for i in range(7000)])
+    macs = [rand.getrandbits(48) for _ in range(opts.lookups)]
+
+    workdir = tempfile.mkdtemp()
+    try:
+        registry = os.path.join(workdir, 'oui.csv')
+        with open(registry, 'w') as f:
+            f.write("Registry,Assignment,Organization Name,Organization Address\n")
+            for prefix, name in entries:
+                f.write("MA-X,%s,%s,Somewhere\n" % (prefix, name))
+        fname = os.path.join(workdir, 'oui.index')
+
+        build_seconds, _ = timed(oui.compile_index, entries, fname)
+        parse_seconds, _ = timed(lambda: dict(oui.read_registry(open(registry))))
+        first_seconds, _ = timed(oui.vendor, macs[0], fname)
+        lookup_seconds, _ = timed(lambda: [oui.vendor(m, fname) for m in macs])
+
+        print "%d prefixes, %d bytes" % (len(entries), os.path.getsize(fname))
+        print "%-30s %9.3fs" % ("build the index", build_seconds)
+        print "%-30s %9.3fs" % ("parse the registry", parse_seconds)
+        print "%-30s %9.1fus" % ("first lookup", first_seconds * 1e6)
+        print "%-30s %9.1fus" % ("lookup", lookup_seconds * 1e6 / len(macs))
+    finally:
+        shutil.rmtree(workdir)
@@ -0,0 +1,101 @@
+#!/usr/bin/env python2.7
+'''
+Compare handing passive results to nagios through the command pipe and through the
+check result spool directory (nagios.spool).
+
+A child process stands in for nagios on each path: it reads the FIFO line by line,
+or picks up every spool file that has its .ok marker. The time reported is from the
+first result written until the writer is done (what a submitter waits for) and until
+the reader has seen all of them.
+
+This source is provided under the MIT License (see LICENSE.txt)
+Copyright (c) 2014 Ryan C. Catherman
+'''
+
+import optparse
+import os
+import shutil
+import tempfile
+import time
+
+import nagios.spool as spool
+
+def read_fifo(path, count):
+    seen = 0
+    with open(path) as f:
+        for line in f:
+            if line.startswith('['):
+                seen += 1
+                if seen == count:
+                    break
+
+def read_spool(directory, count):
+    seen = 0
+    while seen < count:
+        names = [n for n in os.listdir(directory) if n.endswith('.ok')]
+        if not names:
+            time.sleep(0.001)
+        for name in names:
+            fname = os.path.join(directory, name[:-3])
+            with open(fname) as f:
+                seen += sum(1 for l in f if l.startswith('host_name='))
+            os.unlink(fname)
+            os.unlink(fname + '.ok')
+
+def run_reader(func, *args):
+    pid = os.fork()
+    if pid == 0:
+        try:
+            func(*args)
+        finally:
+            os._exit(0)
+    return pid
+
+def bench_fifo(results, workdir):
+    path = os.path.join(workdir, 'nagios.cmd')
+    os.mkfifo(path)
+    pid = run_reader(read_fifo, path, len(results))
+
+    start = time.time()
+    fd = os.open(path, os.O_WRONLY)
+    for result in results:
+        # One write per command, as every submitter of the pipe does
+        os.write(fd, result.command())
+    os.close(fd)
+    written = time.time()
+    os.waitpid(pid, 0)
+    return written - start, time.time() - start
+
+def bench_spool(results, workdir, batch_size):
+    directory = os.path.join(workdir, 'checkresults')
+    os.mkdir(directory)
+    pid = run_reader(read_spool, directory, len(results))
+
+    start = time.time()
+    with spool.SpoolWriter(directory, batch_size=batch_size) as writer:
+        writer.extend(results)
+    written = time.time()
+    os.waitpid(pid, 0)
+    return written - start, time.time() - start
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser(usage="%prog [options]")
+    parser.add_option('-n', '--results', dest="count", type="int", default=100000)
+    parser.add_option('-b', '--batch-size', dest="batch_size", type="int", default=500)
+    opts, args = parser.parse_args()
+
+    results = [
+        spool.CheckResult('host%d' % (i / 10), 'svc%d' % (i % 10), i % 4, 'value is %d|value=%d' % (i, i))
+        for i in range(opts.count)
+    ]
+
+    workdir = tempfile.mkdtemp()
+    try:
+        print "%-20s %10s %10s %12s" % ("", "written", "read", "results/s")
+        for name, (written, read) in [
+            ('fifo', bench_fifo(results, workdir)),
+            ('spool (batch %d)' % opts.batch_size, bench_spool(results, workdir, opts.batch_size)),
+        ]:
+            print "%-20s %9.3fs %9.3fs %12.0f" % (name, written, read, opts.count / read)
+    finally:
+        shutil.rmtree(workdir)
@@ -0,0 +1,46 @@
+#!/usr/bin/env python2.7
+'''
+Time the perf data history (nagios.tsdb): an append, which is what every plugin run
+with --history pays, and the queries a trend threshold makes, over series of a day
+of points a minute and of two days of points a second, to show that a query costs
+what its range does and not what the series does.
+
+This source is provided under the MIT License (see LICENSE.txt)
+Copyright (c) 2014 Ryan C. Catherman
+'''
+
+import optparse
+import shutil
+import tempfile
+import time
+
+import nagios.tsdb as tsdb
+
+def timed(func, count):
+    start = time.time()
+    for _ in xrange(count):
+        func()
+    return (time.time() - start) / count
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser(usage="%prog [options]")
+    parser.add_option('-n', '--queries', dest="queries", type="int", default=1000)
+    opts, args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    try:
+        store = tsdb.TimeSeriesStore(workdir)
+        end = time.time()
+        for name, points, step in [('minutely', 1440, 60), ('secondly', 172800, 1)]:
+            start = time.time()
+            for i in xrange(points):
+                store.append(name, i % 100, end - (points - i) * step)
+            append_seconds = (time.time() - start) / points
+
+            print "%s: %d points" % (name, points)
+            print "  %-28s %9.1fus" % ("append", append_seconds * 1e6)
+            for aggregate, window in [('last', 60), ('mean', 3600), ('slope', 3600), ('time_to:100', 86400 * 7)]:
+                seconds = timed(lambda: store.aggregate(name, aggregate, window, end), opts.queries)
+                print "  %-28s %9.1fus" % ("%s over %ds" % (aggregate, window), seconds * 1e6)
+    finally:
+        shutil.rmtree(workdir)
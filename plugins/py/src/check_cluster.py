@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+'''
+Check many groups of child results in one run, like check_cluster does for one group.
+
+The children are the latest service (or host) states, read from either a nagios
+status file (status.dat) or a stream of passive results in the external command
+format:
+
+[1412345678] PROCESS_SERVICE_CHECK_RESULT;host;service;code;output
+[1412345678] PROCESS_HOST_CHECK_RESULT;host;code;output
+
+A host that is DOWN (1) or UNREACHABLE (2) counts as a CRITICAL child, not as the
+service states of the same numbers. Children are grouped by host (default) or by
+service description and every group is judged with one of the rules given by --mode:
+
+worst:   the group takes the worst state of its children (-w and -c are not used)
+count:   the number of non-OK children is checked against -w and -c
+percent: the percentage (rounded up) of non-OK children is checked against -w and -c
+
+The plugin result is the worst group result. Every group that is not OK is listed in
+the multiline output (-vv).
+
+For example, warn when any of a host's services is not OK and go critical at 25%:
+
+define command {
+    command_name    check-cluster-hosts
+    command_line    /usr/lib/nagios/plugins/check_cluster -f /var/cache/nagios3/status.dat --mode percent -w 0 -c 0:24
+}
+
+This source is provided under the MIT License (see LICENSE.txt)
+Copyright (c) 2014 Ryan C. Catherman
+'''
+
+import array
+import sys
+
+import nagios.plugins as plugins
+
+# The RESULT_ a host state counts as: UP, DOWN and UNREACHABLE
+HOST_RESULTS = [plugins.RESULT_OK, plugins.RESULT_CRITICAL, plugins.RESULT_CRITICAL]
+
+def read_status_file(f):
+    '''
+    Yield (host, service, state) for every servicestatus and hoststatus block
+    of a nagios status file. service is None for hosts.
+    '''
+    fields = None
+    for line in f:
+        line = line.strip()
+        if line.endswith('{'):
+            kind = line[:-1].strip()
+            fields = {} if kind in ('servicestatus', 'hoststatus') else None
+        elif line == '}':
+            if fields is not None and 'current_state' in fields:
+                yield (fields.get('host_name'), fields.get('service_description'),
+                    int(fields['current_state']))
+            fields = None
+        elif fields is not None:
+            key, _, value = line.partition('=')
+            if key in ('host_name', 'service_description', 'current_state'):
+                fields[key] = value
+
+def read_results(f):
+    '''
+    Yield (host, service, state) for every passive check result in the external
+    command format. service is None for host results. Other lines are ignored.
+    '''
+    for line in f:
+        if line.startswith('['):
+            line = line.split(']', 1)[-1]
+        fields = line.strip().split(';')
+        try:
+            if fields[0] == 'PROCESS_SERVICE_CHECK_RESULT' and len(fields) >= 5:
+                yield fields[1], fields[2], int(fields[3])
+            elif fields[0] == 'PROCESS_HOST_CHECK_RESULT' and len(fields) >= 4:
+                yield fields[1], None, int(fields[2])
+        except ValueError:
+            continue
+
+class Aggregate(object):
+    '''
+    State counts of every group, kept in one flat array of 4 counters (one per
+    RESULT_) per group so that all groups are judged together.
+
+    children: iterable of (host, service, state). A child given more than once
+    keeps its last state, as a stream of passive results would. Host states count
+    as HOST_RESULTS has them.
+    group_by: "host" or "service". Host results are left out when grouping by service.
+    '''
+
+    def __init__(self, children, group_by='host'):
+        assert group_by in ('host', 'service')
+        by_host = group_by == 'host'
+
+        latest = {}
+        for host, service, state in children:
+            if service is None:
+                if not by_host:
+                    continue
+                state = HOST_RESULTS[state] if 0 <= state < len(HOST_RESULTS) else plugins.RESULT_UNKNOWN
+            elif not 0 <= state <= plugins.RESULT_UNKNOWN:
+                state = plugins.RESULT_UNKNOWN
+            latest[(host, service)] = state
+
+        self.names = []
+        index = {}
+        self.counts = array.array('l', [0]) * (4 * len(set(
+            (host if by_host else service) for host, service in latest)))
+        for (host, service), state in latest.iteritems():
+            name = host if by_host else service
+            group = index.get(name)
+            if group is None:
+                group = index[name] = len(self.names)
+                self.names.append(name)
+            self.counts[4 * group + state] += 1
+
+    def __len__(self):
+        return len(self.names)
+
+    def evaluate(self, mode, warning=None, critical=None):
+        '''
+        Judge every group by mode ("worst", "count" or "percent"). Return an array of
+        RESULT_ values, one per group, and an array of the values that were judged
+        (the worst RESULT_, the non-OK count or the non-OK percentage).
+        '''
+        assert mode in ('worst', 'count', 'percent')
+        assert mode == 'worst' or (warning is not None and critical is not None)
+
+        counts = self.counts
+        results = array.array('B', [0]) * len(self.names)
+        values = array.array('l', [0]) * len(self.names)
+        for group in xrange(len(self.names)):
+            ok, warn, crit, unknown = counts[4 * group:4 * group + 4]
+            if mode == 'worst':
+                if crit:
+                    value = plugins.RESULT_CRITICAL
+                elif unknown:
+                    value = plugins.RESULT_UNKNOWN
+                elif warn:
+                    value = plugins.RESULT_WARNING
+                else:
+                    value = plugins.RESULT_OK
+                results[group] = value
+            else:
+                value = warn + crit + unknown
+                if mode == 'percent':
+                    total = value + ok
+                    value = (100 * value + total - 1) // total
+                if not critical.is_allowed(value):
+                    results[group] = plugins.RESULT_CRITICAL
+                elif not warning.is_allowed(value):
+                    results[group] = plugins.RESULT_WARNING
+            values[group] = value
+        return results, values
+
+    def describe(self, group):
+        ok, warn, crit, unknown = self.counts[4 * group:4 * group + 4]
+        return "%d ok, %d warning, %d critical, %d unknown" % (ok, warn, crit, unknown)
+
+class CheckCluster(plugins.PluginBase):
+    '''
+    Judge groups of child results read from a status file or passive result stream
+    '''
+
+    VERSION = "1.0"
+    DEFAULT_WARNING = "0"   # Any non-OK child warns
+    DEFAULT_CRITICAL = ""   # Never critical unless -c is given
+
+    def __init__(self, out_file=sys.stdout):
+        super(CheckCluster, self).__init__(out_file)
+
+        self._parser.add_option(
+            '-f', '--status-file', dest="status_file", type="string",
+            help="nagios status file to read the children from")
+        self._parser.add_option(
+            '-r', '--results', dest="results", type="string",
+            help="File of passive check results to read the children from (- for stdin)")
+        self._parser.add_option(
+            '-g', '--group-by', dest="group_by", type="choice", choices=['host', 'service'],
+            default='host', help="Group the children by host or service")
+        self._parser.add_option(
+            '-m', '--mode', dest="mode", type="choice", choices=['worst', 'count', 'percent'],
+            default='count', help="worst, count or percent")
+
+    def _children(self, opts):
+        if bool(opts.status_file) == bool(opts.results):
+            raise Exception("Give exactly one of --status-file or --results")
+
+        if opts.results == '-':
+            return list(read_results(sys.stdin))
+        if opts.results:
+            with open(opts.results) as f:
+                return list(read_results(f))
+        with open(opts.status_file) as f:
+            return list(read_status_file(f))
+
+    def _run(self, opts):
+        aggregate = Aggregate(self._children(opts), group_by=opts.group_by)
+        if not len(aggregate):
+            raise plugins.NagiosWarning("No children found")
+
+        results, values = aggregate.evaluate(opts.mode, self._warning, self._critical)
+
+        tally = [0] * 4
+        for result in results:
+            tally[result] += 1
+        summary = ", ".join(
+            "%d %s" % (tally[r], plugins.RESULT_NAMES[r]) for r in plugins.RESULTS_BY_SEVERITY[::-1] if tally[r])
+        self._output.set_simple_result(
+            "%d groups: %s" % (len(aggregate), summary),
+            "%d %s groups by %s: %s" % (len(aggregate), opts.group_by, opts.mode, summary))
+
+        for group, result in enumerate(results):
+            if result != plugins.RESULT_OK:
+                self._output.add_multiline("%s %s (%s)" % (
+                    aggregate.names[group], plugins.RESULT_NAMES[result], aggregate.describe(group)))
+
+        return plugins.worst_result(results)
+
+if __name__ == "__main__":
+    plugin = CheckCluster()
+    plugin(sys.argv)
+    assert False, "unreachable. plugin should always exit"
@@ -6,20 +6,184 @@ The purpose is to run an existing plugin and translate CRITICAL (2) to SUCCESS (
 versa. One example use case is to consider a 100% ping failure a success (check for unreachable)
 while 100% returns would be CRITICAL. A 50% ping return should remain as-is
 
+Options for this script go before the command line (use -- if the command itself starts
+with a '-'). They turn on hedging, for commands whose latency has a long tail: if the
+command has not finished after a while, another copy of it is started and whichever
+finishes first is used (the others are killed, along with anything they started).
+
+--hedge-after SECONDS   start another copy after this long
+--hedge-percentile P    ...or after the P percentile of this command's recent run times
+                        (--hedge-after is used until enough history is kept)
+--max-hedges N          start at most N more copies (default 1)
+--history FILE          where run times are kept (see nagios.state)
+
+Bad options exit with UNKNOWN (3).
+
+When hedging, the perf data "hedges" (copies started after the first), "latency" (seconds
+until a copy finished) and "hedge_delay" are added to the command's output.
+
 This source is provided under the MIT License (see LICENSE.txt)
 Copyright (c) 2014 Ryan C. Catherman
 '''
 
+import hashlib
+import os
+import Queue
+import signal
 import subprocess
 import sys
+import threading
+import time
+
+import nagios.plugins as plugins
+import nagios.state as state
+
+# Run times kept per command, and how many are needed before trusting a percentile
+HISTORY_SIZE = 50
+MIN_HISTORY = 10
+
+def invert(code):
+    if code == 0:
+        return 2
+    elif code == 2:
+        return 0
+    return code
+
+class LatencyHistory(object):
+    '''
+    The last HISTORY_SIZE run times of a command, as microseconds in a StateStore
+    '''
+
+    def __init__(self, store, command):
+        self.__store = store
+        self.__prefix = "check_critical\0" + hashlib.md5("\0".join(command)).hexdigest() + "\0"
+
+    def add(self, seconds):
+        slot = self.__store.update(self.__prefix + "next", lambda p: (time.time(), (p[1] + 1) if p else 1))
+        self.__store.set(self.__prefix + str(slot[1] % HISTORY_SIZE), int(seconds * 1000000))
+
+    def samples(self):
+        samples = plugins.Samples()
+        for slot in range(HISTORY_SIZE):
+            entry = self.__store.get(self.__prefix + str(slot))
+            if entry is not None:
+                samples.append(entry[1] / 1000000.0)
+        return samples
+
+def hedge_delay(opts, history):
+    '''
+    Seconds to wait before starting another copy, or None to never do so
+    '''
+    if opts.hedge_percentile is not None and history is not None:
+        samples = history.samples()
+        if len(samples) >= MIN_HISTORY:
+            return samples.percentile(opts.hedge_percentile)
+    return opts.hedge_after
+
+def run_hedged(command, delay, max_hedges):
+    '''
+    Run command, starting up to max_hedges more copies delay seconds apart while
+    none has finished. Return (returncode, stdout, stderr, copies started, seconds
+    until the first one finished, the run time of the first copy started).
+
+    The run time of the first copy is what the command takes unhedged, which is what
+    the hedge delay should be a percentile of: the run time of whichever copy won
+    would pull it low. When another copy finished first it is as far as the first
+    copy got before it was killed.
+    '''
+    finished = Queue.Queue()
+    children = []
+
+    def start():
+        # In a process group of its own, so that a copy that lost is killed with its children
+        p = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, preexec_fn=os.setsid)
+        started = time.time()
+        children.append(p)
+        def wait():
+            out, err = p.communicate()
+            finished.put((p, out, err, time.time() - started))
+        t = threading.Thread(target=wait)
+        t.daemon = True
+        t.start()
+
+    begin = time.time()
+    start()
+    while True:
+        try:
+            timeout = delay if len(children) <= max_hedges else None
+            winner, out, err, runtime = finished.get(timeout=timeout)
+            break
+        except Queue.Empty:
+            start()
+    latency = time.time() - begin
+
+    for p in children:
+        if p is not winner and p.poll() is None:
+            try:
+                os.killpg(p.pid, signal.SIGKILL)
+            except OSError:
+                pass # finished in the meantime
+    primary = runtime if winner is children[0] else latency
+    return winner.returncode, out, err, len(children), latency, primary
+
+def add_perf_data(output, perf_data):
+    '''
+    Add perf data items to the first line of a plugin's output
+    '''
+    lines = output.split('\n', 1)
+    separator = ' ' if '|' in lines[0] else ' | '
+    lines[0] = lines[0] + separator + " ".join(str(p) for p in perf_data)
+    return '\n'.join(lines)
+
+if __name__ == "__main__":
+    # Bad options exit UNKNOWN like a plugin's, not 2, which nagios reads as CRITICAL
+    parser = plugins._OptionParser(usage="%prog [options] command [args...]")
+    parser.disable_interspersed_args()
+    parser.add_option(
+        '--hedge-after', dest="hedge_after", type="float", default=None,
+        help="Start another copy of the command after this many seconds")
+    parser.add_option(
+        '--hedge-percentile', dest="hedge_percentile", type="float", default=None,
+        help="Start another copy after this percentile (0 to 100) of the command's recent run times")
+    parser.add_option(
+        '--max-hedges', dest="max_hedges", type="int", default=1,
+        help="Start at most this many more copies")
+    parser.add_option(
+        '--history', dest="history", type="string", default=None,
+        help="The file the run times are kept in (default a per-user file in /tmp)")
+    opts, command = parser.parse_args()
+
+    if opts.hedge_after is not None and opts.hedge_after < 0:
+        parser.error("--hedge-after must not be negative")
+    if opts.hedge_percentile is not None and not 0 < opts.hedge_percentile <= 100:
+        parser.error("--hedge-percentile must be over 0 and at most 100")
+    if opts.max_hedges < 0:
+        parser.error("--max-hedges must not be negative")
+
+    if opts.hedge_after is None and opts.hedge_percentile is None:
+        p = subprocess.Popen(command)
+        p.wait()
+        sys.exit(invert(p.returncode))
+
+    history = None
+    if opts.hedge_percentile is not None:
+        history = LatencyHistory(state.StateStore(opts.history), command)
 
-p = subprocess.Popen(sys.argv[1:])
-p.wait()
+    delay = hedge_delay(opts, history)
+    if delay is None:
+        code, out, err, copies, latency, primary = run_hedged(command, None, 0)
+    else:
+        code, out, err, copies, latency, primary = run_hedged(command, delay, opts.max_hedges)
 
-if p.returncode == 0:
-    sys.exit(2)
-elif p.returncode == 2:
-    sys.exit(0)
-else:
-    sys.exit(p.returncode)
+    if history is not None:
+        history.add(primary)
 
+    perf_data = [
+        plugins.PerfData('hedges', copies - 1),
+        plugins.PerfData('latency', round(latency, 6), 's'),
+    ]
+    if delay is not None:
+        perf_data.append(plugins.PerfData('hedge_delay', round(delay, 6), 's'))
+    sys.stdout.write(add_perf_data(out, perf_data))
+    sys.stderr.write(err)
+    sys.exit(invert(code))
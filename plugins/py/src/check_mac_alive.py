@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+'''
+Check that many hosts, known by their mac address, are up: in one run.
+
+Instead of one mac_to_ip and one check_ping per host, the macs are resolved together
+(one scan at most, see mac_to_ip.MacLookupCache) and every ip found is probed at once:
+
+tcp: connect to --port. An answer either way (accepted or refused) means the host is up.
+udp: send a datagram to --port (7, echo, by default) and wait for the echo. A refusal
+     (ICMP port unreachable) also means the host is up.
+
+A host is down when the probe times out or the host is unreachable, and unknown
+when its mac is not found. -w and -c apply to the number of hosts that are not up.
+
+define command {
+    command_name    check-macs-alive
+    command_line    /usr/lib/nagios/plugins/check_mac_alive -m 00:11:22:33:44:55 -m 00:11:22:33:44:66 -w 0 -c 1
+}
+
+Every host is listed in the multiline output (-vv) and its round trip time is perf data.
+
+This source is provided under the MIT License (see LICENSE.txt)
+Copyright (c) 2014 Ryan C. Catherman
+'''
+
+import errno
+import select
+import socket
+import sys
+import time
+
+import mac_to_ip
+import nagios.plugins as plugins
+
+# Errors meaning the host answered, even if not with what was asked
+ANSWERED = (errno.ECONNREFUSED, errno.ECONNRESET)
+
+UP = 'UP'
+DOWN = 'DOWN'
+NOT_FOUND = 'NOT FOUND'
+
+def probe(ips, port, timeout, protocol='tcp'):
+    '''
+    Probe every ip at once and return a dict of ip: (UP, seconds) or (DOWN, reason)
+    '''
+    results = {}
+    pending = {}
+    poller = select.poll()
+    start = time.time()
+
+    for ip in set(ips):
+        if protocol == 'tcp':
+            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            mask = select.POLLOUT
+        else:
+            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            mask = select.POLLIN
+        s.setblocking(0)
+        sent = time.time()
+        code = s.connect_ex((ip, port))
+        if code == 0 and protocol == 'udp':
+            try:
+                s.send('nagios')
+            except socket.error, e:
+                code = e.args[0]
+        if code not in (0, errno.EINPROGRESS):
+            s.close()
+            if code in ANSWERED:
+                results[ip] = (UP, time.time() - sent)
+            else:
+                results[ip] = (DOWN, errno.errorcode.get(code, str(code)))
+            continue
+        pending[s.fileno()] = (s, ip, sent)
+        poller.register(s, mask | select.POLLERR | select.POLLHUP)
+
+    while pending:
+        left = start + timeout - time.time()
+        if left <= 0:
+            break
+        for fd, event in poller.poll(left * 1000):
+            s, ip, sent = pending.pop(fd)
+            poller.unregister(fd)
+            elapsed = time.time() - sent
+            if protocol == 'tcp':
+                code = s.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            else:
+                try:
+                    s.recv(512)
+                    code = 0
+                except socket.error, e:
+                    code = e.args[0]
+            s.close()
+            if code == 0 or code in ANSWERED:
+                results[ip] = (UP, elapsed)
+            else:
+                results[ip] = (DOWN, errno.errorcode.get(code, str(code)))
+
+    for s, ip, _ in pending.values():
+        s.close()
+        results[ip] = (DOWN, "timed out")
+    return results
+
+class CheckMacAlive(plugins.PluginBase):
+    VERSION = "1.0"
+    DEFAULT_WARNING = "0"
+    DEFAULT_CRITICAL = ""
+
+    def __init__(self, out_file=sys.stdout):
+        super(CheckMacAlive, self).__init__(out_file)
+        self._parser.add_option(
+            '-m', '--mac', dest="macs", action="append", default=[],
+            help="Mac address of a host (may be repeated, or comma separated)")
+        self._parser.add_option(
+            '-P', '--protocol', dest="protocol", type="choice", choices=['tcp', 'udp'], default='tcp',
+            help="Probe with a tcp connection or a udp datagram")
+        self._parser.add_option(
+            '-p', '--port', dest="port", type="int", default=7,
+            help="Port to probe")
+        self._parser.add_option(
+            '-t', '--timeout', dest="timeout", type="float", default=2.0,
+            help="Seconds to wait for the hosts to answer")
+        self._parser.add_option(
+            '-f', '--freshness', dest="freshness", type="int", default=300,
+            help="Seconds a cached ip is trusted for")
+        self._parser.add_option(
+            '--target', dest="targets", action="append", default=[],
+            help="Segment to scan as interface[,cidr[,timeout]] (see mac_to_ip)")
+        self._parser.add_option(
+            '--leases', dest="leases", action="append", default=[],
+            help="A dnsmasq or ISC dhcpd lease file to resolve from (see mac_to_ip)")
+        self._parser.add_option(
+            '--cache', dest="cache", type="string", default=None,
+            help="The mac_to_ip cache file")
+
+    def _cache(self, opts):
+        return mac_to_ip.MacLookupCache(
+            opts.cache or mac_to_ip.default_cache_file(),
+            targets=[mac_to_ip.ScanTarget.from_string(t) for t in opts.targets],
+            lease_files=opts.leases)
+
+    def _run(self, opts):
+        macs = []
+        for value in opts.macs:
+            for m in value.split(','):
+                if m.strip():
+                    macs.append(mac_to_ip.Mac(m.strip()))
+        if not macs:
+            self._parser.error("At least one mac is needed")
+
+        ips = self._cache(opts).lookup_many(macs, freshness=opts.freshness)
+        probes = probe(ips.values(), opts.port, opts.timeout, opts.protocol)
+
+        counts = {UP: 0, DOWN: 0, NOT_FOUND: 0}
+        problems = []
+        for mac in macs:
+            label = mac.display()
+            if mac not in ips:
+                state, detail = NOT_FOUND, None
+            else:
+                state, detail = probes[ips[mac]]
+            counts[state] += 1
+
+            if state == UP:
+                self._output.add_multiline("%s %s UP %.1fms" % (label, ips[mac], detail * 1000))
+                self._output.add_perf_data(label, round(detail, 6), 's', minimum=0)
+            elif state == DOWN:
+                self._output.add_multiline("%s %s DOWN (%s)" % (label, ips[mac], detail))
+                problems.append(label)
+            else:
+                self._output.add_multiline("%s NOT FOUND" % label)
+                problems.append(label)
+
+        self._output.add_perf_data('up', counts[UP], minimum=0, maximum=len(macs))
+        self._output.add_perf_data('down', counts[DOWN], minimum=0, maximum=len(macs))
+        self._output.add_perf_data('not_found', counts[NOT_FOUND], minimum=0, maximum=len(macs))
+
+        msg = "%d of %d hosts up" % (counts[UP], len(macs))
+        if problems:
+            msg += ", not up: %s" % ", ".join(problems)
+        if not self._critical.is_allowed(len(problems)):
+            raise plugins.NagiosCritical(msg)
+        if not self._warning.is_allowed(len(problems)):
+            raise plugins.NagiosWarning(msg)
+        self._output.set_simple_result(msg)
+
+if __name__ == "__main__":
+    plugin = CheckMacAlive()
+    plugin(sys.argv)
+    assert False, "unreachable. plugin should always exit"
@@ -11,6 +11,9 @@ report accordingly.
 
 Obviously, if you run this in your environment, you will see failures! :)
 
+It also shows the sampling mode: with --samples 10 --aggregate p95 the thresholds
+apply to the 95th percentile of 10 random integers.
+
 This source is provided under the MIT License (see LICENSE.txt)
 Copyright (c) 2014 Ryan C. Catherman
 '''
@@ -29,9 +32,10 @@ class CheckRandom(plugins.PluginBase):
     VERSION = "1.0"
     DEFAULT_WARNING = "0:90"    # Allow values between 0 and 90
     DEFAULT_CRITICAL = "0:95"   # Allow vaules between 0 and 95
+    SAMPLING = True
     
-    def __init__(self):
-        super(CheckRandom, self).__init__()
+    def __init__(self, out_file=sys.stdout):
+        super(CheckRandom, self).__init__(out_file)
 
         # This is how additional arguments happen
         self._parser.add_option(
@@ -40,7 +44,7 @@ class CheckRandom(plugins.PluginBase):
             '-x', '--max', type="int", default=100, dest="max", help="Maximum random integer")
 
     def _run(self, opts):
-        value = random.randint(opts.min, opts.max)
+        value = self._sample(opts)
         msg = "value is %(value)s" % {'value': value}
 
         if not self._critical.is_allowed(value):
@@ -51,6 +55,9 @@ class CheckRandom(plugins.PluginBase):
             raise plugins.NagiosWarning(msg)
         
         self._output.set_simple_result(msg)
+
+    def _sample(self, opts):
+        return random.randint(opts.min, opts.max)
     
 if __name__ == "__main__":
     plugin = CheckRandom()
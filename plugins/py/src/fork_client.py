@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+'''
+Run a plugin in a fork server (see fork_server) instead of starting it.
+
+usage: fork_client SOCKET PLUGIN [ARGS...]
+
+For example, with the server started as "fork_server /var/run/nagios/plugins check_random":
+
+define command {
+    command_name    check-random
+    command_line    /usr/lib/nagios/plugins/fork_client /var/run/nagios/plugins check_random --min 0 --max 100 -w 0:90 -c 0:95
+}
+
+The output and exit code are the plugin's. When no server listens on SOCKET, the
+plugin is executed from this script's directory instead, so checks keep working
+while the server is down.
+
+This source is provided under the MIT License (see LICENSE.txt)
+Copyright (c) 2014 Ryan C. Catherman
+'''
+
+import os
+import socket
+import sys
+
+import nagios.forkclient as forkclient
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print "usage: fork_client SOCKET PLUGIN [ARGS...]"
+        sys.exit(3)
+
+    path, argv = sys.argv[1], sys.argv[2:]
+    try:
+        code = forkclient.run(path, argv)
+    except socket.error:
+        plugin = os.path.join(os.path.dirname(os.path.realpath(__file__)), os.path.basename(argv[0]))
+        os.execv(plugin, [plugin] + argv[1:])
+    sys.exit(code)
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+'''
+Serve plugins to fork_client from a process that has already imported them.
+
+usage: fork_server [options] SOCKET MODULE...
+
+Every MODULE (eg check_random) is imported and the PluginBase subclass it defines is
+served under the module's name. Stop it with SIGTERM or SIGINT: it stops accepting
+and exits once the running plugins are done.
+
+This source is provided under the MIT License (see LICENSE.txt)
+Copyright (c) 2014 Ryan C. Catherman
+'''
+
+import importlib
+import inspect
+import optparse
+import signal
+
+import nagios.forkserver as forkserver
+import nagios.plugins as plugins
+
+def load_plugin(module_name):
+    '''
+    The PluginBase subclass defined by module_name
+    '''
+    module = importlib.import_module(module_name)
+    found = [
+        cls for _, cls in inspect.getmembers(module, inspect.isclass)
+        if issubclass(cls, plugins.PluginBase) and cls.__module__ == module.__name__
+    ]
+    if len(found) != 1:
+        raise ValueError("%s defines %d plugins, expected one" % (module_name, len(found)))
+    return found[0]
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser(usage="%prog [options] SOCKET MODULE...")
+    parser.add_option(
+        '-n', '--max-children', dest="max_children", type="int", default=64,
+        help="Maximum number of plugins running at once")
+    opts, args = parser.parse_args()
+    if len(args) < 2:
+        parser.error("A socket and at least one plugin module are needed")
+
+    registry = {}
+    for name in args[1:]:
+        try:
+            registry[name] = load_plugin(name)
+        except (ImportError, ValueError), e:
+            parser.error(str(e))
+
+    server = forkserver.ForkServer(args[0], registry, max_children=opts.max_children)
+    for signum in [signal.SIGTERM, signal.SIGINT]:
+        signal.signal(signum, lambda signum, frame: server.stop())
+    server.serve_forever()
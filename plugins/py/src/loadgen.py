@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+'''
+Find how many checks a second a box sustains, run each way a poller can run them.
+
+usage: loadgen [options] [TARGET...]
+
+Every TARGET (exec, runner and fork, see nagios.loadgen; all three by default) is
+driven in turn with the same mix of checks, at --rate checks a second or, without
+it, as fast as --concurrency checks at once go. The checks are either given with -m
+(repeated, "weight:plugin args", eg "3:check_random -x 50") or drawn to give the
+results of --results (eg "ok:90,warning:8,critical:2") from check_random.
+
+A table is printed and, with -o, every report is appended to a file as a line of
+json: rerun with other rates, or on other boxes, and compare.
+
+    loadgen -r 100 -d 30 -o pollers.json
+    loadgen -m "check_random -x 50" -m "2:check_mac_alive -m 00:11:22:33:44:55" fork
+
+This source is provided under the MIT License (see LICENSE.txt)
+Copyright (c) 2014 Ryan C. Catherman
+'''
+
+import json
+import optparse
+import socket
+import time
+
+import fork_server
+import nagios.loadgen as loadgen
+import nagios.plugins as plugins
+
+TARGETS = ['exec', 'runner', 'fork']
+
+def parse_results(value):
+    '''
+    Parse "name:weight,..." into a dict of RESULT_ value: weight
+    '''
+    distribution = {}
+    for item in value.split(','):
+        name, _, weight = item.partition(':')
+        if name.strip().upper() not in plugins.RESULT_NAMES:
+            raise ValueError("Unknown result '%s'" % name)
+        distribution[plugins.RESULT_NAMES.index(name.strip().upper())] = float(weight or 1)
+    return distribution
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser(usage="%prog [options] [TARGET...]")
+    parser.add_option(
+        '-r', '--rate', dest="rate", type="float", default=None,
+        help="Checks started a second (default as fast as they complete)")
+    parser.add_option(
+        '-d', '--duration', dest="duration", type="float", default=10,
+        help="Seconds each target is driven for")
+    parser.add_option(
+        '-c', '--concurrency', dest="concurrency", type="int", default=8,
+        help="Most checks running at once")
+    parser.add_option(
+        '-m', '--mix', dest="mix", action="append", default=[],
+        help="A check as weight:plugin args (may be repeated)")
+    parser.add_option(
+        '--results', dest="results", type="string", default="ok:90,warning:8,critical:2",
+        help="Results the check_random checks give, as result:weight, when there is no -m")
+    parser.add_option(
+        '-o', '--output', dest="output", type="string", default=None,
+        help="File to append the reports to, as lines of json")
+    parser.add_option(
+        '--seed', dest="seed", type="int", default=None,
+        help="Seed of the choice of checks")
+    opts, args = parser.parse_args()
+
+    targets = args or TARGETS
+    for name in targets:
+        if name not in TARGETS:
+            parser.error("Unknown target %s (one of %s)" % (name, ", ".join(TARGETS)))
+    try:
+        if opts.mix:
+            mix = loadgen.Mix.from_strings(opts.mix)
+        else:
+            mix = loadgen.results_mix(parse_results(opts.results))
+        registry = dict((argv[0], fork_server.load_plugin(argv[0])) for argv in mix.argvs())
+    except (ImportError, ValueError), e:
+        parser.error(str(e))
+
+    reports = []
+    for name in targets:
+        if name == 'exec':
+            target = loadgen.ExecTarget()
+        elif name == 'runner':
+            target = loadgen.RunnerTarget(registry)
+        else:
+            target = loadgen.ForkTarget(registry, max_children=max(64, opts.concurrency))
+        report = loadgen.generate(
+            target, mix, opts.duration, rate=opts.rate, concurrency=opts.concurrency, seed=opts.seed)
+        report.update(host=socket.gethostname(), time=int(time.time()), mix=[" ".join(a) for a in mix.argvs()])
+        reports.append(report)
+        if opts.output:
+            with open(opts.output, 'a') as f:
+                f.write(json.dumps(reports[-1], sort_keys=True) + "\n")
+
+    print loadgen.format_reports(reports)
@@ -15,7 +15,31 @@ define command {
 
 Of course, you could use the $_HOSTMACADDRESS$ macro and set _MACADDRESS instead of using the HOSTADDRESS variable.
 
-The result of the command should always be 0, and the output will be one of:
+To check that many hosts are alive, check_mac_alive resolves and probes all of them
+in one run instead.
+
+To also show what kind of device it is, -V follows the ip with the organization
+the mac is assigned to, from the index oui_index builds.
+
+To monitor a group of hosts, -q prints "mac ip" for every cached mac matching a
+vendor prefix or any mask, one per line:
+    mac_to_ip -q 00:11:22
+    mac_to_ip -q 00:11:22:*:*:01
+
+To sweep more than the local network of the default interface, give one -t per segment:
+    mac_to_ip -t eth0 -t eth1,10.1.0.0/16,30 $HOSTADDRESS$
+
+A mac whose cached ip is stale (or that was last seen a while ago) is first looked
+for at its last known ip and the --probe-radius ips either side of it, and the
+segments are only swept if it is not there.
+
+On the dhcp server itself, give its lease files with -l to answer from the leases
+before scanning at all (see nagios.leases):
+    mac_to_ip -l /var/lib/misc/dnsmasq.leases $HOSTADDRESS$
+    mac_to_ip -l /var/lib/dhcp/dhcpd.leases $HOSTADDRESS$
+
+The result of the command should always be 0, bad arguments included, and the output
+will be one of:
 <the actual ip address>
 "notfound"
 "faileld"
@@ -28,14 +52,23 @@ Copyright (c) 2014 Ryan C. Catherman
 '''
 
 
-import json
+import optparse
 import os
 import pwd
+import Queue
+import socket
+import struct
 import subprocess
 import sys
-import tempfile
+import threading
 import time
 
+import nagios.leases as leases
+import nagios.lookupcache as lookupcache
+
+# The scanner command. Each ScanTarget appends its own arguments to this.
+ARP_SCAN = ['/usr/bin/sudo', '-n', '/usr/bin/arp-scan']
+
 class Mac(object):
     '''
     Wrapper around mac address to parse and normalize mac operations
@@ -59,6 +92,20 @@ class Mac(object):
     def simple(self):
         return self.display(delim='')
 
+    def value(self):
+        '''
+        The mac as a 48 bit integer
+        '''
+        return reduce(lambda value, octet: (value << 8) | octet, self.__address, 0)
+
+    def vendor(self, index_file=None):
+        '''
+        The organization the mac's prefix is assigned to, or None (see nagios.oui)
+        '''
+        # Only callers who ask pay for the import and the index
+        import nagios.oui as oui
+        return oui.vendor(self.value(), index_file)
+
     def __str__(self):
         return self.display()
 
@@ -70,6 +117,72 @@ class Mac(object):
             return -1
         return cmp(self.display(delim=''), other.display(delim=''))
 
+class MacPattern(object):
+    '''
+    The macs whose bits under mask equal value's, eg all the macs of a vendor prefix
+    '''
+
+    ALL = 0xffffffffffff
+
+    def __init__(self, value, mask):
+        self.mask = mask & self.ALL
+        self.value = value & self.mask
+
+    @staticmethod
+    def from_string(pattern):
+        '''
+        Parse one of:
+            a prefix:              00:11:22 (the bits given), 00:11:22:a0/28 (the first 28)
+            octets with wildcards: 00:11:22:*:*:01
+            a value and a mask:    00:11:22:00:00:01/ff:ff:ff:00:00:ff
+        '''
+        if '*' in pattern:
+            octets = pattern.replace('-', ':').split(':')
+            if len(octets) != 6:
+                raise ValueError("Invalid mac pattern '%s'" % pattern)
+            value = mask = 0
+            for octet in octets:
+                value <<= 8
+                mask <<= 8
+                if octet != '*':
+                    value |= int(octet, 16)
+                    mask |= 0xff
+            return MacPattern(value, mask)
+
+        digits, _, bits = pattern.partition('/')
+        digits = digits.replace(':', '').replace('-', '')
+        if not digits or len(digits) > 12:
+            raise ValueError("Invalid mac pattern '%s'" % pattern)
+        value = int(digits, 16) << (4 * (12 - len(digits)))
+        if not bits:
+            bits = 4 * len(digits)
+        elif len(bits.replace(':', '').replace('-', '')) == 12:
+            return MacPattern(value, Mac(bits).value())
+        else:
+            bits = int(bits)
+        if not 0 <= bits <= 48:
+            raise ValueError("Invalid mac pattern '%s'" % pattern)
+        return MacPattern(value, (MacPattern.ALL << (48 - bits)) & MacPattern.ALL)
+
+    def range(self):
+        '''
+        The lowest and the highest mac that can match, as 48 bit integers: the
+        leading bits of the mask narrow the range, the rest are filtered
+        '''
+        leading = 0
+        bit = 1 << 47
+        while bit and self.mask & bit:
+            leading |= bit
+            bit >>= 1
+        low = self.value & leading
+        return low, low | (self.ALL & ~leading)
+
+    def matches(self, value):
+        return value & self.mask == self.value
+
+    def __str__(self):
+        return "%s/%s" % (Mac("%012x" % self.value), Mac("%012x" % self.mask))
+
 def is_IP(ip):
     '''
     Is the value an IP?
@@ -88,56 +201,175 @@ def is_IP(ip):
         return False
     return True
 
-class MacLookupCache(object):
+def ip_value(ip):
     '''
-    Keep the results of the last call in a file for easy access.
+    The ip as a 32 bit integer
+    '''
+    return struct.unpack('!I', socket.inet_aton(ip))[0]
 
-    The caller can specify a freshness value to force a refresh.
+def neighbours(ip, radius):
+    '''
+    The ip and the radius ips either side of it
+    '''
+    value = ip_value(ip)
+    return [
+        socket.inet_ntoa(struct.pack('!I', v))
+        for v in range(max(value - radius, 0), min(value + radius, 0xffffffff) + 1)]
 
-    This class uses arp-scan to populate a mac->ip lookup and stores the data in
-    a json format
+class ScanTarget(object):
     '''
+    One network segment to be swept by the scanner.
 
-    def __init__(self, fname):
-        self.__fname = fname
-        self.__cached = None
+    interface: the interface to scan on (eg "eth0") or None for the scanner default
+    network: the CIDR to scan (eg "192.168.1.0/24") or None for the interface's local net
+    timeout: seconds the scan may take before it is killed and considered failed
+    hosts: ips to scan instead of the network, for a probe (see probe)
+    '''
 
-    def mtime(self):
-        try:
-            return os.stat(self.__fname).st_mtime
-        except OSError:
-            return 0
+    DEFAULT_TIMEOUT = 60
 
-    def write(self, obj):
-        with open(self.__fname, 'w') as f:
-            f.write(json.dumps(obj))
+    def __init__(self, interface=None, network=None, timeout=DEFAULT_TIMEOUT, hosts=None):
+        self.interface = interface
+        self.network = network
+        self.timeout = timeout
+        self.hosts = hosts
 
-    def read(self):
+    @staticmethod
+    def from_string(value):
+        '''
+        Parse "interface[,network[,timeout]]", as given on the command line.
+
+        Empty fields take the defaults, so ",10.0.0.0/24" scans a network on the
+        default interface.
+        '''
+        tokens = value.split(',')
+        if len(tokens) > 3:
+            raise ValueError("Invalid scan target '%s'" % value)
+        tokens += [''] * (3 - len(tokens))
+        interface, network, timeout = tokens
+        return ScanTarget(
+            interface=interface or None,
+            network=network or None,
+            timeout=float(timeout) if timeout else ScanTarget.DEFAULT_TIMEOUT)
+
+    def args(self):
+        '''
+        The scanner arguments selecting this segment
+        '''
+        args = []
+        if self.interface:
+            args += ['-I', self.interface]
+        if self.hosts:
+            args += self.hosts
+        else:
+            args.append(self.network or '-l')
+        return args
+
+    def contains(self, ip):
+        '''
+        Is ip in network? None when there is no network (or it is not a CIDR) to tell.
+        '''
+        if not self.network:
+            return None
+        address, _, bits = self.network.partition('/')
         try:
-            with open(self.__fname, 'r') as f:
-                return json.loads(f.read())
-        except OSError:
+            mask = (0xffffffff << (32 - int(bits or 32))) & 0xffffffff
+            return ip_value(ip) & mask == ip_value(address) & mask
+        except (socket.error, ValueError):
             return None
 
-    def lookup(self, mac, freshness=30):
-        assert isinstance(mac, Mac)
+    def probe(self, hosts):
+        '''
+        The target scanning just hosts, on the same interface
+        '''
+        return ScanTarget(self.interface, self.network, self.timeout, hosts=list(hosts))
 
-        if (self.mtime() + freshness) <= time.time():
-            print >> sys.stderr, "We need a fresh reading"
-            # Go get a fresh reading if we're due
-            self.__cached = self.__fetch()
-        else:
-            if self.__cached is None:
-                # Read the cached result (if exists)
-                self.__cached = self.read()
+    def __str__(self):
+        if self.hosts:
+            return "%s:%s" % (self.interface or 'default', ",".join(self.hosts))
+        return "%s:%s" % (self.interface or 'default', self.network or 'localnet')
 
-            if (self.__cached is None) or not self.__cached.has_key(mac.simple()):
-                # If we didn't have one, or the value requested isn't there, get a fresh
-                # reading.
-                self.__cached = self.__fetch()
+class MacLookupCache(lookupcache.LookupCache):
+    '''
+    Keep the results of the last scan in a file for easy access.
 
-        assert self.__cached is not None, "cache should be set by all paths"
-        return self.__cached[mac.simple()]
+    The caller can specify a freshness value to force a refresh.
+
+    This is the LookupCache (see nagios.lookupcache) of mac: ip, keyed by Mac.simple(),
+    whose fetch is a complete scan with arp-scan: negative entries, adaptive
+    freshness (with max_freshness, an infrastructure mac that never moves stops
+    causing scans on behalf of DHCP clients that do), bounds and statistics all come
+    from there, and a fetch counts in stats as "scans".
+
+    By default the local network of the default interface is scanned. Pass a list of
+    ScanTarget to sweep several segments instead; up to max_parallel of them are
+    scanned at once and their results are merged. A failed segment is recorded in
+    failures but does not discard what the other segments found, nor what is cached
+    from before; the macs last seen on it are not backed off.
+
+    With probe_radius, the macs a lookup has to scan for are first probed for (see
+    _probe): on a large segment, scanning the few ips around where a mac was last
+    seen costs a tiny part of a sweep, and a mac that kept its ip (or took one next
+    to it) is found without any. statistics() counts the probes, the ones that
+    found every mac and so spared a sweep, and their timings.
+
+    With lease_files (dnsmasq or ISC dhcpd, see nagios.leases), the active leases
+    answer before any probe, and a sweep adds them to what it found, so a host that
+    does not answer arp is still resolved. A mac backing off after a miss is answered
+    as soon as it is leased. They are parsed incrementally, where they
+    were left at kept in fname + ".leases", so a lookup parses only what the dhcp
+    server wrote since the last one.
+
+    query finds every cached mac matching a MacPattern (a vendor prefix, or any mask)
+    through the sorted keys: they are fixed width hex, so they sort like the macs as
+    48 bit integers, the leading bits of the mask give a range to bisect for, and
+    only the macs in it are filtered.
+    '''
+
+    FETCHES = 'scans'
+
+    def __init__(self, fname, targets=None, max_parallel=4, scanner=ARP_SCAN,
+        negative_ttl=60, max_backoff=3600, max_freshness=None, max_entries=None, probe_radius=None,
+        lease_files=None):
+        assert max_parallel >= 1
+        assert probe_radius is None or probe_radius >= 0
+        super(MacLookupCache, self).__init__(
+            fname, complete=True, max_ttl=max_freshness, negative_ttl=negative_ttl,
+            max_backoff=max_backoff, max_entries=max_entries)
+        self.__targets = targets or [ScanTarget()]
+        self.__max_parallel = max_parallel
+        self.__scanner = scanner
+        self.__probe_radius = probe_radius
+        self.__leases = leases.Leases(lease_files, fname + ".leases") if lease_files else None
+        self.failures = []
+
+    def lookup(self, mac, freshness=30):
+        found = self.lookup_many([mac], freshness)
+        if mac not in found:
+            raise KeyError(mac.simple())
+        return found[mac]
+
+    def lookup_many(self, macs, freshness=30):
+        '''
+        Look up several macs with at most one scan, run if any of them is missing
+        or stale. Return a dict of Mac: ip for the ones found.
+        '''
+        for mac in macs:
+            assert isinstance(mac, Mac)
+        found = super(MacLookupCache, self).lookup_many([mac.simple() for mac in macs], ttl=freshness)
+        return dict((mac, found[mac.simple()]) for mac in macs if mac.simple() in found)
+
+    def query(self, pattern, freshness=None):
+        '''
+        Iterate over (Mac, ip) for every cached mac matching pattern (a MacPattern), in
+        order. With freshness, scan first if the last scan is older than that.
+        '''
+        if freshness is not None and self.mtime() + freshness <= time.time():
+            self.refresh()
+        low, high = pattern.range()
+        return (
+            (Mac(key), ip) for key, ip in self._between("%012x" % low, "%012x" % high)
+            if pattern.matches(int(key, 16)))
 
     @staticmethod
     def parse(data):
@@ -153,27 +385,283 @@ class MacLookupCache(object):
             result[mac.simple()] = tokens[0]
         return result
 
-    def __fetch(self):
+    def _scan(self, target):
+        '''
+        Run the scanner against a single target and return its output.
+
+        Raise if the scanner fails or runs past the target's timeout.
+        '''
+        p = subprocess.Popen(self.__scanner + target.args(), stdout=subprocess.PIPE)
 
-        p = subprocess.Popen(['/usr/bin/sudo', '-n', '/usr/bin/arp-scan', '-l'], stdout=subprocess.PIPE)
-        p.wait()
+        expired = []
+        def expire():
+            expired.append(True)
+            p.terminate() # sudo relays TERM to the scanner, it cannot relay KILL
+
+        timer = threading.Timer(target.timeout, expire)
+        timer.start()
+        try:
+            data = p.communicate()[0]
+        finally:
+            timer.cancel()
+
+        if expired:
+            raise Exception("Scan of %s timed out after %ss" % (target, target.timeout))
         if p.returncode:
-            raise Exception("Unexpected value running arp-scan. Is it installed and can this user sudo?")
+            raise Exception("Unexpected value running arp-scan on %s. Is it installed and can this user sudo?" % target)
+        return data
+
+    def __probe_target(self, ip):
+        '''
+        The target ip is on: the one whose network has it, else the only one with no
+        network (the local net of its interface), else None
+        '''
+        for target in self.__targets:
+            if target.contains(ip):
+                return target
+        local = [t for t in self.__targets if not t.network]
+        return local[0] if len(local) == 1 else None
+
+    def __leased(self):
+        '''
+        The mac: ip of the active leases, after parsing what the lease files gained
+        '''
+        self.__leases.update()
+        return self.__leases.macs()
 
-        result = self.parse(p.stdout.read())
-        self.write(result)
+    def _failed_keys(self, keys):
+        '''
+        The keys last seen on a target whose scan failed, None if none did
+        '''
+        if not self.failures:
+            return None
+        failed = set(target for target, _ in self.failures)
+        result = []
+        for key in keys:
+            ip = self._get(key)
+            if ip is None:
+                entry = self._get_history(key)
+                ip = entry and entry['value']
+            if ip and self.__probe_target(ip) in failed:
+                result.append(key)
         return result
 
+    def _turned_up(self, keys):
+        '''
+        The keys leased since they were missed
+        '''
+        if self.__leases is None:
+            return ()
+        leased = self.__leased()
+        return [key for key in keys if key in leased]
+
+    def _probe(self, keys):
+        '''
+        Answer the keys the leases have, then probe for the rest
+        '''
+        if self.__leases is None:
+            return self.__probe_around(keys)
+        leased = self.__leased()
+        result = dict((key, leased[key]) for key in keys if key in leased)
+        missing = [key for key in keys if key not in result]
+        if missing:
+            result.update(self.__probe_around(missing) or {})
+        return result
+
+    def __probe_around(self, keys):
+        '''
+        Scan the last known ip of every mac and the probe_radius ips either side of
+        it, one scan per target, if they all have one
+        '''
+        if self.__probe_radius is None:
+            return None
+        hosts = {}
+        for key in keys:
+            ip = self._get(key)
+            if ip is None:
+                # Gone from the table, but maybe not for long
+                entry = self._get_history(key)
+                ip = entry and entry['value']
+            target = ip and self.__probe_target(ip)
+            if not target:
+                return None
+            hosts.setdefault(target, set()).update(
+                i for i in neighbours(ip, self.__probe_radius) if target.contains(i) is not False)
+
+        result = {}
+        for target, ips in hosts.items():
+            result.update(self.parse(self._scan(target.probe(sorted(ips, key=ip_value)))))
+        return result
+
+    def _fetch(self, keys):
+        '''
+        Scan every target, whatever keys are asked for, on top of the active leases
+        '''
+        pending = Queue.Queue()
+        for target in self.__targets:
+            pending.put(target)
+
+        result = self.__leased() if self.__leases is not None else {}
+        failures = []
+        lock = threading.Lock()
+
+        def worker():
+            while True:
+                try:
+                    target = pending.get_nowait()
+                except Queue.Empty:
+                    return
+                try:
+                    found = self.parse(self._scan(target))
+                except Exception, e:
+                    with lock:
+                        failures.append((target, str(e)))
+                else:
+                    with lock:
+                        result.update(found)
+
+        workers = [
+            threading.Thread(target=worker)
+            for _ in range(min(self.__max_parallel, len(self.__targets)))
+        ]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+
+        self.failures = failures
+        for target, msg in failures:
+            print >> sys.stderr, msg
+        if len(failures) == len(self.__targets) and self.__leases is None:
+            raise Exception("All scans failed: %s" % "; ".join(msg for _, msg in failures))
+
+        return result
+
+class SqliteMacLookupCache(lookupcache.SqliteLookupCache, MacLookupCache):
+    '''
+    MacLookupCache kept in a sqlite database (see lookupcache.SqliteLookupCache), for
+    several pollers sharing one cache
+    '''
+
+class _OptionParser(optparse.OptionParser):
+    '''
+    Raise on bad arguments instead of exiting with 2, so that they come out as
+    "failed" like any other failure
+    '''
+
+    def error(self, msg):
+        raise ValueError(msg)
+
+_oui_failed = False
+
+def vendor_name(mac, index_file=None):
+    '''
+    The vendor of mac for -V: "unknown" when it has none, or when the index cannot
+    be read (said once on stderr, the ip is still worth printing)
+    '''
+    global _oui_failed
+    if not _oui_failed:
+        try:
+            return mac.vendor(index_file) or "unknown"
+        except (EnvironmentError, ValueError, struct.error), e:
+            _oui_failed = True
+            print >> sys.stderr, "Cannot read the oui index: %s" % e
+    return "unknown"
+
+def default_cache_file():
+    '''
+    The per-user cache file in /tmp
+    '''
+    return os.path.join('/tmp', "." + pwd.getpwuid(os.getuid()).pw_name + ".mac_to_ip.cache")
+
 if __name__ == "__main__":
+    cache = None
     try:
-        to_find = sys.argv[1]
-        mac = Mac(to_find)
-
-        cache_file = os.path.join('/tmp', "." + pwd.getpwuid(os.getuid()).pw_name + ".mac_to_ip.cache")
-        cache = MacLookupCache(cache_file)
-        print cache.lookup(mac, freshness=300) # Allow up to 5 minutes
+        parser = _OptionParser(usage="%prog [options] mac\n       %prog [options] -q pattern")
+        parser.add_option(
+            '-t', '--target', dest="targets", action="append", default=[],
+            help="Segment to scan as interface[,cidr[,timeout]]. May be repeated.")
+        parser.add_option(
+            '-p', '--parallel', dest="parallel", type="int", default=4,
+            help="Maximum number of segments scanned at once")
+        parser.add_option(
+            '-n', '--negative-ttl', dest="negative_ttl", type="int", default=60,
+            help="Seconds to answer notfound for a missing mac before scanning again (doubles per miss)")
+        parser.add_option(
+            '-s', '--stats', dest="stats", action="store_true", default=False,
+            help="Write the cache counters to stderr")
+        parser.add_option(
+            '-d', '--sqlite', dest="sqlite", action="store_true", default=False,
+            help="Keep the cache in a sqlite database that many pollers can share")
+        parser.add_option(
+            '-f', '--freshness', dest="freshness", type="int", default=300,
+            help="Seconds a cached ip is trusted for")
+        parser.add_option(
+            '-m', '--max-freshness', dest="max_freshness", type="int", default=3600,
+            help="Seconds the ip of a mac that rarely changes may be trusted for")
+        parser.add_option(
+            '-V', '--vendor', dest="vendor", action="store_true", default=False,
+            help="Follow the ip with the organization the mac is assigned to")
+        parser.add_option(
+            '--oui-index', dest="oui_index", type="string", default=None,
+            help="The vendor index built by oui_index (default /var/lib/nagios/oui.index)")
+        parser.add_option(
+            '-r', '--probe-radius', dest="probe_radius", type="int", default=2,
+            help="Ips either side of a mac's last known ip to probe before sweeping")
+        parser.add_option(
+            '--no-probe', dest="probe", action="store_false", default=True,
+            help="Always sweep the segments")
+        parser.add_option(
+            '-l', '--leases', dest="leases", action="append", default=[],
+            help="A dnsmasq or ISC dhcpd lease file to answer from before scanning. May be repeated.")
+        parser.add_option(
+            '--cache', dest="cache", type="string", default=None,
+            help="The cache file (default a per-user file in /tmp)")
+        parser.add_option(
+            '-q', '--query', dest="query", type="string", default=None,
+            help="Print the mac and ip of every mac matching a prefix (00:11:22), "
+                "wildcards (00:11:22:*:*:01) or a mask (00:11:22:00:00:01/ff:ff:ff:00:00:ff)")
+        opts, args = parser.parse_args()
+
+        if opts.query:
+            pattern = MacPattern.from_string(opts.query)
+        else:
+            mac = Mac(args[0])
+
+        cache_file = opts.cache or default_cache_file()
+        cache_class = MacLookupCache
+        if opts.sqlite:
+            if not opts.cache:
+                cache_file += ".db"
+            cache_class = SqliteMacLookupCache
+        cache = cache_class(
+            cache_file,
+            targets=[ScanTarget.from_string(t) for t in opts.targets],
+            max_parallel=opts.parallel,
+            negative_ttl=opts.negative_ttl,
+            max_backoff=max(3600, opts.negative_ttl),
+            max_freshness=max(opts.freshness, opts.max_freshness),
+            probe_radius=opts.probe_radius if opts.probe else None,
+            lease_files=opts.leases)
+        if opts.query:
+            found = False
+            for mac, ip in cache.query(pattern, freshness=opts.freshness):
+                found = True
+                if opts.vendor:
+                    ip += " " + vendor_name(mac, opts.oui_index)
+                print mac, ip
+            if not found:
+                raise KeyError(opts.query)
+        else:
+            ip = cache.lookup(mac, freshness=opts.freshness)
+            if opts.vendor:
+                ip += " " + vendor_name(mac, opts.oui_index)
+            print ip
     except KeyError:
         print "notfound"
     except Exception, e:
         print >> sys.stderr, "Failure: %s" % str(e)
         print "failed"
+    finally:
+        if cache is not None and opts.stats:
+            print >> sys.stderr, " ".join("%s=%d" % i for i in sorted(cache.stats.items()))
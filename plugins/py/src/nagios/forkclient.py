@@ -0,0 +1,84 @@
+'''
+The client side of nagios.forkserver
+
+Kept to the standard library (and little of it) so that a client starts as fast as
+python does: not paying for imports is the point of the fork server.
+
+A request is the client's stdin, stdout and stderr, passed as file descriptors,
+followed by the length of the argv and the argv, NUL separated. The reply, once the
+plugin exited, is a line with its exit code and possibly a message.
+
+This source is provided under the MIT License (see LICENSE.txt)
+Copyright (c) 2014 Ryan C. Catherman
+'''
+
+import _multiprocessing
+import os
+import socket
+
+STDIO = (0, 1, 2)
+
+def send_request(sock, argv, fds=STDIO):
+    for fd in fds:
+        _multiprocessing.sendfd(sock.fileno(), fd)
+    payload = "\0".join(argv)
+    sock.sendall("%d\n%s" % (len(payload), payload))
+
+def receive_request(sock):
+    '''
+    Return (fds, argv) of a request. The fds are new descriptors of this process.
+    '''
+    fds = []
+    try:
+        for _ in STDIO:
+            fds.append(_multiprocessing.recvfd(sock.fileno()))
+        f = sock.makefile('r', 0)
+        length = int(f.readline())
+        payload = f.read(length)
+        if len(payload) != length:
+            raise ValueError("Truncated request")
+        return fds, payload.split("\0")
+    except:
+        for fd in fds:
+            os.close(fd)
+        raise
+
+def send_reply(sock, code, message=''):
+    sock.sendall("%d %s\n" % (code, message))
+
+def receive_reply(sock):
+    '''
+    Return (code, message), or None if the server went away first
+    '''
+    line = sock.makefile('r', 0).readline()
+    if not line.endswith("\n"):
+        return None
+    code, _, message = line[:-1].partition(' ')
+    return int(code), message
+
+def run(path, argv):
+    '''
+    Run argv (the plugin name, then its arguments) in the fork server listening at
+    path, with this process's stdio. Return the plugin's exit code.
+
+    Raise socket.error if no server listens at path or it would not take the request.
+    '''
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        try:
+            send_request(sock, argv)
+        except OSError, e:
+            # sendfd reports like os does; the plugin did not run either way
+            raise socket.error(e.errno, e.strerror)
+        reply = receive_reply(sock)
+    finally:
+        sock.close()
+
+    if reply is None:
+        print "Fork server went away"
+        return 3
+    code, message = reply
+    if message:
+        print message
+    return code
@@ -0,0 +1,247 @@
+'''
+Run plugins in children forked from a warm process, to stop paying for imports
+
+A plugin run by nagios starts python and imports everything it needs, every time.
+The fork server is a process that has already imported the plugins; a client
+(fork_client) connects over a unix socket and hands it its argv and its stdin,
+stdout and stderr. The server forks a child with those as its own stdio, the child
+runs the plugin the way its script would and exits with its code, and the server
+passes the code back to the client, which exits with it.
+
+Each check still gets a process of its own, so a plugin that hangs, crashes or
+leaks is no worse off than when it is exec'd. When the client goes away (nagios
+timed it out) its child is terminated.
+
+This source is provided under the MIT License (see LICENSE.txt)
+Copyright (c) 2014 Ryan C. Catherman
+'''
+
+import errno
+import fcntl
+import os
+import random
+import select
+import signal
+import socket
+import struct
+import sys
+
+import nagios.forkclient as forkclient
+import nagios.objects as objects
+import nagios.plugins as plugins
+
+def run_plugin(registry, argv):
+    '''
+    Run the plugin named by argv[0] like its script would (see check_random) and
+    return its exit code
+    '''
+    name = os.path.basename(argv[0])
+    if name.endswith('.py'):
+        name = name[:-3]
+    factory = registry.get(name)
+    if factory is None:
+        print "No plugin registered for %s" % name
+        return plugins.RESULT_UNKNOWN
+
+    sys.argv = argv
+    try:
+        factory()(argv)
+    except SystemExit, e:
+        if e.code is None:
+            return plugins.RESULT_OK
+        if isinstance(e.code, int):
+            return e.code
+        print e.code
+        return plugins.RESULT_UNKNOWN
+    except Exception, e:
+        print "Unexpected failure: %s" % str(e)
+    return plugins.RESULT_UNKNOWN
+
+class ForkServer(object):
+    '''
+    Serve the plugins of registry (name -> PluginBase subclass, nagios.objects.PLUGINS
+    by default) on a unix socket at path.
+
+    At most max_children plugins run at once; further clients wait to be accepted.
+    '''
+
+    # Seconds a client has to send its request once connected
+    REQUEST_TIMEOUT = 5
+
+    def __init__(self, path, registry=None, max_children=64):
+        assert max_children >= 1
+        self.__path = path
+        self.__registry = objects.PLUGINS if registry is None else registry
+        self.__max_children = max_children
+        # pid -> connection of the client waiting for it
+        self.__children = {}
+        # Children whose client went away, already told to terminate
+        self.__hung_up = set()
+        self.__listener = None
+        self.__wake = None
+        self.__stopping = False
+        self.forks = 0
+
+    def listen(self):
+        if os.path.exists(self.__path):
+            os.unlink(self.__path) # left over by a server that did not stop cleanly
+        self.__listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.__listener.bind(self.__path)
+        self.__listener.listen(128)
+
+    def stop(self):
+        '''
+        Stop accepting clients and return from serve_forever once the running
+        plugins are done. Safe to call from a signal handler.
+        '''
+        self.__stopping = True
+        if self.__wake is not None:
+            try:
+                os.write(self.__wake[1], '\0')
+            except OSError:
+                pass
+
+    def serve_forever(self):
+        '''
+        Serve until stop() is called. Must run in the main thread: children are
+        noticed through SIGCHLD.
+        '''
+        if self.__listener is None:
+            self.listen()
+
+        self.__wake = os.pipe()
+        for fd in self.__wake:
+            fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+        previous_wakeup = signal.set_wakeup_fd(self.__wake[1])
+        previous_handler = signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+        try:
+            while not self.__stopping or self.__children:
+                self.__serve_once()
+        finally:
+            signal.signal(signal.SIGCHLD, previous_handler)
+            signal.set_wakeup_fd(previous_wakeup)
+            for fd in self.__wake:
+                os.close(fd)
+            self.__wake = None
+            self.__listener.close()
+            self.__listener = None
+            os.unlink(self.__path)
+
+    def __serve_once(self):
+        waiting = [self.__wake[0]] + [
+            conn for pid, conn in self.__children.iteritems() if pid not in self.__hung_up]
+        if not self.__stopping and len(self.__children) < self.__max_children:
+            waiting.append(self.__listener)
+        try:
+            readable = select.select(waiting, [], [], 1.0)[0]
+        except select.error, e:
+            if e.args[0] != errno.EINTR:
+                raise
+            readable = []
+
+        for r in readable:
+            if r is self.__listener:
+                self.__accept()
+            elif r == self.__wake[0]:
+                try:
+                    os.read(r, 4096)
+                except OSError:
+                    pass
+            else:
+                # A waiting client only sends again by going away
+                self.__hang_up(r)
+        self.__reap()
+
+    def __accept(self):
+        try:
+            conn = self.__listener.accept()[0]
+        except socket.error, e:
+            if e.args[0] in (errno.EINTR, errno.EAGAIN):
+                return
+            raise
+
+        try:
+            # Not settimeout: that makes the socket non-blocking, which recvfd cannot take
+            conn.setsockopt(socket.SOL_SOCKET, socket.SO_RCVTIMEO, struct.pack('ll', self.REQUEST_TIMEOUT, 0))
+            fds, argv = forkclient.receive_request(conn)
+        except Exception:
+            conn.close()
+            return
+
+        # Whatever is buffered would be written by the child too
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            self.__child(conn, fds, argv)
+        self.forks += 1
+        for fd in fds:
+            os.close(fd)
+        self.__children[pid] = conn
+
+    def __child(self, conn, fds, argv):
+        code = plugins.RESULT_UNKNOWN
+        try:
+            signal.set_wakeup_fd(-1)
+            for signum in [signal.SIGCHLD, signal.SIGTERM, signal.SIGINT]:
+                signal.signal(signum, signal.SIG_DFL)
+            for fd in self.__wake:
+                os.close(fd)
+            self.__listener.close()
+            for other in self.__children.values():
+                other.close()
+            conn.close()
+
+            # Out of the way first, in case the server's own stdio was closed
+            moved = [fcntl.fcntl(fd, fcntl.F_DUPFD, 3) for fd in fds]
+            for fd in fds:
+                os.close(fd)
+            for target, fd in zip(forkclient.STDIO, moved):
+                os.dup2(fd, target)
+                os.close(fd)
+            # Or every child would draw the same numbers
+            random.seed()
+            code = run_plugin(self.__registry, argv)
+        finally:
+            try:
+                sys.stdout.flush()
+                sys.stderr.flush()
+            finally:
+                os._exit(code)
+
+    def __hang_up(self, conn):
+        for pid, c in self.__children.items():
+            if c is conn:
+                self.__hung_up.add(pid)
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except OSError:
+                    pass
+
+    def __reap(self):
+        while self.__children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except OSError, e:
+                if e.errno == errno.EINTR:
+                    continue
+                if e.errno != errno.ECHILD:
+                    raise
+                return
+            if pid == 0:
+                return
+            conn = self.__children.pop(pid, None)
+            if conn is None:
+                continue
+            self.__hung_up.discard(pid)
+
+            if os.WIFEXITED(status):
+                code, message = os.WEXITSTATUS(status), ''
+            else:
+                code = plugins.RESULT_UNKNOWN
+                message = "Plugin killed by signal %d" % os.WTERMSIG(status)
+            try:
+                forkclient.send_reply(conn, code, message)
+            except socket.error:
+                pass # the client is gone
+            conn.close()
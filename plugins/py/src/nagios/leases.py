@@ -0,0 +1,265 @@
+'''
+Read the mac and ip of dhcp leases from the lease files of a dhcp server on the same
+box: dnsmasq (dnsmasq.leases) and ISC dhcpd (dhcpd.leases).
+
+A LeaseFile remembers how far it has parsed (the inode, size, mtime and offset of
+the file) so that an update only parses what changed:
+
+dhcpd appends a lease block for every change, so only the blocks appended since the
+    last update are parsed, and a later block of an ip replaces the earlier one. A
+    block still being written is left for the next update. When dhcpd rewrites the
+    file (a new inode, a shorter file, or different bytes before the offset) it is
+    parsed again from the start.
+dnsmasq rewrites the whole file on every change, so a changed file is parsed again
+    and an unchanged one not at all.
+
+Leases keeps the parsing state of several files in a json file between runs,
+rewritten only when an offset or a lease changed, and without the leases that ended.
+
+This source is provided under the MIT License (see LICENSE.txt)
+Copyright (c) 2014 Ryan C. Catherman
+'''
+
+import calendar
+import json
+import os
+import re
+import time
+import zlib
+
+import nagios.lookupcache as lookupcache
+
+DNSMASQ = 'dnsmasq'
+ISC = 'isc'
+
+# Bytes before the offset that must be unchanged for the file to count as appended to
+_CHECKED = 4096
+
+_ISC_LEASE = re.compile(r'^lease\s+(\S+)\s*\{(.*?)^\}\n?', re.M | re.S)
+_ISC_HARDWARE = re.compile(r'^\s*hardware\s+ethernet\s+([0-9a-fA-F:]+);', re.M)
+# Not "next binding state" or "rewind binding state"
+_ISC_STATE = re.compile(r'^\s*binding\s+state\s+(\w+);', re.M)
+_ISC_ENDS = re.compile(r'^\s*ends\s+([^;]*);', re.M)
+_MAC = re.compile(r'^[0-9a-f]{12}$')
+
+def _mac(value):
+    '''
+    The mac as 12 hex digits, the way Mac.simple() has it, or None if it is not one
+    '''
+    mac = value.replace(':', '').replace('-', '').lower()
+    return mac if _MAC.match(mac) else None
+
+def _isc_time(value):
+    '''
+    Parse the time of an "ends" statement: "4 2014/05/01 22:00:00" (UTC),
+    "epoch 1398981600" or "never" (None)
+    '''
+    tokens = value.split()
+    if tokens == ['never']:
+        return None
+    if len(tokens) == 2 and tokens[0] == 'epoch':
+        return float(tokens[1])
+    return float(calendar.timegm(time.strptime(" ".join(tokens[1:3]), "%Y/%m/%d %H:%M:%S")))
+
+def parse_isc(data):
+    '''
+    Parse lease blocks of dhcpd.leases. Return (leases, consumed): a list of
+    (ip, mac, ends) in file order, with mac None for a lease no longer bound, and
+    the length of data up to the end of the last complete block.
+    '''
+    leases = []
+    consumed = 0
+    for match in _ISC_LEASE.finditer(data):
+        consumed = match.end()
+        body = match.group(2)
+        hardware = _ISC_HARDWARE.search(body)
+        state = _ISC_STATE.search(body)
+        ends = _ISC_ENDS.search(body)
+        mac = _mac(hardware.group(1)) if hardware else None
+        if state is not None and state.group(1) != 'active':
+            mac = None
+        try:
+            expiry = _isc_time(ends.group(1)) if ends else None
+        except ValueError:
+            expiry = None
+        leases.append((match.group(1), mac, expiry))
+    return leases, consumed
+
+def parse_dnsmasq(data):
+    '''
+    Parse the lines of dnsmasq.leases: "expiry mac ip hostname client-id", expiry 0
+    for a lease that never ends. Return (leases, consumed) as parse_isc does,
+    leaving out IPv6 leases and anything that is not an ethernet mac.
+    '''
+    leases = []
+    consumed = data.rfind('\n') + 1
+    for line in data[:consumed].splitlines():
+        tokens = line.split()
+        if len(tokens) < 3 or tokens[2].count('.') != 3:
+            continue
+        mac = _mac(tokens[1])
+        if mac is None:
+            continue
+        try:
+            expiry = float(tokens[0]) or None
+        except ValueError:
+            continue
+        leases.append((tokens[2], mac, expiry))
+    return leases, consumed
+
+class LeaseFile(object):
+    '''
+    The leases of one lease file, parsed incrementally (see the module documentation).
+
+    state is what state() returned for the same path before, to carry on from there.
+    changes counts the updates and prunes that changed the offset or the leases.
+    '''
+
+    def __init__(self, path, state=None):
+        self.path = path
+        self.__state = state or self.__empty()
+        self.changes = 0
+
+    @staticmethod
+    def __empty():
+        return {'format': None, 'inode': None, 'size': 0, 'mtime': None, 'offset': 0, 'crc': 0, 'leases': {}}
+
+    def state(self):
+        '''
+        What to give to a later LeaseFile of the same path, as plain values
+        '''
+        return self.__state
+
+    def update(self):
+        '''
+        Parse what changed since the last update. Return the number of bytes parsed.
+        A missing file has no leases.
+        '''
+        state = self.__state
+        try:
+            f = open(self.path, 'rb')
+        except IOError:
+            if state['inode'] is not None:
+                self.__state = self.__empty()
+                self.changes += 1
+            return 0
+
+        with f:
+            stat = os.fstat(f.fileno())
+            if (stat.st_ino, stat.st_size, stat.st_mtime) == (state['inode'], state['size'], state['mtime']):
+                return 0
+
+            offset = state['offset']
+            appended = (
+                state['format'] == ISC and stat.st_ino == state['inode'] and stat.st_size >= offset and
+                self.__crc(f, offset) == state['crc'])
+            if not appended:
+                state = self.__empty()
+                offset = 0
+            f.seek(offset)
+            data = f.read(stat.st_size - offset)
+
+            if state['format'] is None:
+                state['format'] = ISC if re.search(r'^lease\s', data, re.M) else DNSMASQ
+            parse = parse_isc if state['format'] == ISC else parse_dnsmasq
+            leases, consumed = parse(data)
+            changed = False
+            for ip, mac, ends in leases:
+                if mac is None:
+                    changed = state['leases'].pop(ip, None) is not None or changed
+                elif state['leases'].get(ip) != [mac, ends]:
+                    state['leases'][ip] = [mac, ends]
+                    changed = True
+            if not appended:
+                changed = state['leases'] != self.__state['leases']
+            changed = changed or (stat.st_ino, offset + consumed) != (self.__state['inode'], self.__state['offset'])
+
+            state.update(inode=stat.st_ino, size=stat.st_size, mtime=stat.st_mtime, offset=offset + consumed)
+            state['crc'] = self.__crc(f, state['offset'])
+        self.__state = state
+        if changed:
+            self.changes += 1
+        return len(data)
+
+    def prune(self, now):
+        '''
+        Forget the leases that ended by now. Return how many.
+        '''
+        leases = self.__state['leases']
+        ended = [ip for ip, (mac, ends) in leases.iteritems() if ends is not None and ends <= now]
+        for ip in ended:
+            del leases[ip]
+        if ended:
+            self.changes += 1
+        return len(ended)
+
+    @staticmethod
+    def __crc(f, offset):
+        '''
+        The checksum of the bytes just before offset
+        '''
+        start = max(0, offset - _CHECKED)
+        f.seek(start)
+        return zlib.crc32(f.read(offset - start))
+
+    def leases(self):
+        '''
+        Every lease as a dict of ip: (mac, ends), ends being None for one that never ends
+        '''
+        return dict((ip, tuple(lease)) for ip, lease in self.__state['leases'].items())
+
+def active(leases, now=None):
+    '''
+    The mac: ip of the leases (as LeaseFile.leases() has them) that have not ended.
+    A mac with several is given the ip of the one that ends last.
+    '''
+    now = time.time() if now is None else now
+    macs = {}
+    latest = {}
+    for ip, (mac, ends) in leases.iteritems():
+        if ends is not None and ends <= now:
+            continue
+        ends = float('inf') if ends is None else ends
+        if mac not in macs or ends > latest[mac]:
+            macs[mac] = ip
+            latest[mac] = ends
+    return macs
+
+class Leases(object):
+    '''
+    Several lease files, their parsing state kept in state_file between runs
+    '''
+
+    def __init__(self, paths, state_file):
+        self.__state_file = state_file
+        try:
+            with open(state_file, 'r') as f:
+                states = json.loads(f.read())
+        except (IOError, ValueError):
+            states = {}
+        self.__files = [LeaseFile(path, states.get(path)) for path in paths]
+
+    def update(self, now=None):
+        '''
+        Update every file (see LeaseFile.update) and, if an offset or a lease changed,
+        save where they are at without the leases that ended by now. Return the number
+        of bytes parsed.
+        '''
+        now = time.time() if now is None else now
+        changes = sum(lease_file.changes for lease_file in self.__files)
+        parsed = sum(lease_file.update() for lease_file in self.__files)
+        if sum(lease_file.changes for lease_file in self.__files) != changes:
+            for lease_file in self.__files:
+                lease_file.prune(now)
+            lookupcache.atomic_write(
+                self.__state_file, json.dumps(dict((f.path, f.state()) for f in self.__files)))
+        return parsed
+
+    def macs(self, now=None):
+        '''
+        The mac: ip of the active leases of every file
+        '''
+        leases = {}
+        for lease_file in self.__files:
+            leases.update(lease_file.leases())
+        return active(leases, now)
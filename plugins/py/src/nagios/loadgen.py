@@ -0,0 +1,283 @@
+'''
+Drive plugins at a target rate through one of the ways a poller can run them, and
+measure what it costs: how many checks a second get done, how late they finish
+and how much cpu and memory that takes.
+
+Three ways of running a check (targets):
+
+ExecTarget: execute the plugin script for every check, as nagios does by default
+RunnerTarget: run it in this process with nagios.runner.PluginRunner
+ForkTarget: execute fork_client against a fork server (see nagios.forkserver)
+            started for the run
+
+generate() sends a Mix of argv to a target, either at a fixed rate or as fast as
+concurrency allows, and returns a report: a dict of plain values, so that reports
+of different targets (or boxes) can be stored as json and compared.
+
+This source is provided under the MIT License (see LICENSE.txt)
+Copyright (c) 2014 Ryan C. Catherman
+'''
+
+import bisect
+import os
+import random
+import resource
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import nagios.forkserver as forkserver
+import nagios.plugins as plugins
+import nagios.runner as runner
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+
+class Mix(object):
+    '''
+    A weighted choice of argv, each one the plugin name then its arguments
+    '''
+
+    def __init__(self, entries):
+        assert entries
+        self.__argvs = []
+        self.__bounds = []
+        total = 0
+        for weight, argv in entries:
+            assert weight > 0
+            total += weight
+            self.__argvs.append(list(argv))
+            self.__bounds.append(total)
+        self.__total = total
+
+    @staticmethod
+    def from_strings(values):
+        '''
+        Parse "weight:argv" strings (eg "3:check_random -x 50"), the weight being optional
+        '''
+        entries = []
+        for value in values:
+            weight, colon, argv = value.partition(':')
+            if not colon or ' ' in weight.strip():
+                weight, argv = "1", value
+            try:
+                weight = float(weight)
+            except ValueError:
+                raise ValueError("Invalid weight in '%s'" % value)
+            if weight <= 0 or not argv.split():
+                raise ValueError("Invalid mix entry '%s'" % value)
+            entries.append((weight, argv.split()))
+        return Mix(entries)
+
+    def argvs(self):
+        return [list(argv) for argv in self.__argvs]
+
+    def choose(self, rng=random):
+        return list(self.__argvs[bisect.bisect_right(self.__bounds, rng.random() * self.__total)])
+
+def results_mix(distribution, name='check_random'):
+    '''
+    A Mix of check_random (named name) runs whose results follow distribution, a
+    dict of RESULT_ value: weight. Every argv gives its result every time.
+    '''
+    argvs = {
+        plugins.RESULT_OK: ['--min', '50', '--max', '50', '-w', '0:90', '-c', '0:95'],
+        plugins.RESULT_WARNING: ['--min', '92', '--max', '92', '-w', '0:90', '-c', '0:95'],
+        plugins.RESULT_CRITICAL: ['--min', '97', '--max', '97', '-w', '0:90', '-c', '0:95'],
+        # randint fails on an empty range
+        plugins.RESULT_UNKNOWN: ['--min', '1', '--max', '0'],
+    }
+    return Mix([(weight, [name] + argvs[code]) for code, weight in sorted(distribution.items()) if weight > 0])
+
+class ExecTarget(object):
+    '''
+    Execute plugin_dir/<plugin name> with python for every check
+    '''
+
+    name = 'exec'
+    # The checks run in child processes of this one
+    children = True
+
+    def __init__(self, plugin_dir=SRC, python=sys.executable):
+        self.__plugin_dir = plugin_dir
+        self.__python = python
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def _command(self, argv):
+        return [self.__python, os.path.join(self.__plugin_dir, argv[0])] + argv[1:]
+
+    def run(self, argv):
+        with open(os.devnull, 'w') as null:
+            return subprocess.call(self._command(argv), stdout=null, stderr=null)
+
+class RunnerTarget(object):
+    '''
+    Run the plugins in this process, registry mapping their names to their factory
+    '''
+
+    name = 'runner'
+    children = False
+
+    def __init__(self, registry):
+        self.__runners = dict((name, runner.PluginRunner(factory)) for name, factory in registry.items())
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def run(self, argv):
+        return self.__runners[argv[0]].run(argv).code
+
+class ForkTarget(ExecTarget):
+    '''
+    Execute fork_client for every check, against a fork server serving registry
+    that runs (as a child of this process) from start to stop
+    '''
+
+    name = 'fork'
+
+    def __init__(self, registry, max_children=64, plugin_dir=SRC, python=sys.executable):
+        super(ForkTarget, self).__init__(plugin_dir, python)
+        self.__registry = registry
+        self.__max_children = max_children
+        self.__dir = None
+        self.__path = None
+        self.__pid = None
+
+    def start(self):
+        self.__dir = tempfile.mkdtemp()
+        self.__path = os.path.join(self.__dir, 'socket')
+        server = forkserver.ForkServer(self.__path, self.__registry, max_children=self.__max_children)
+        server.listen()
+        self.__pid = os.fork()
+        if self.__pid == 0:
+            try:
+                signal.signal(signal.SIGTERM, lambda signum, frame: server.stop())
+                server.serve_forever()
+            finally:
+                os._exit(0)
+
+    def stop(self):
+        if self.__pid is not None:
+            os.kill(self.__pid, signal.SIGTERM)
+            os.waitpid(self.__pid, 0)
+            self.__pid = None
+        if self.__dir is not None:
+            shutil.rmtree(self.__dir)
+            self.__dir = None
+
+    def _command(self, argv):
+        return super(ForkTarget, self)._command(['fork_client', self.__path] + argv)
+
+def generate(target, mix, duration, rate=None, concurrency=8, seed=None):
+    '''
+    Run checks chosen from mix through target for duration seconds and return the
+    report.
+
+    With rate, check i is due at i / rate seconds from the start and its latency is
+    from then until it finished: a target that cannot keep up shows it as growing
+    latency (and a throughput under rate), not as a slower schedule. Without rate,
+    concurrency checks run back to back and latency is just how long each took.
+
+    cpu is user + system seconds of this process and its children (plugins, the
+    fork server and what it forked) over the run; rss_kb is the peak resident size
+    of this process and child_rss_kb that of the biggest child (0 for a target
+    without children). The kernel only keeps the peak of the biggest child waited
+    for since this process started, so when that did not grow over the run it may
+    be a child of an earlier run: child_rss_upper_bound says so.
+    '''
+    assert concurrency >= 1
+    rng = random.Random(seed)
+    lock = threading.Lock()
+    counter = [0]
+    results = []
+
+    target.start()
+    before = [resource.getrusage(who) for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN)]
+    start = time.time()
+    end = start + duration
+
+    def worker():
+        while True:
+            with lock:
+                i = counter[0]
+                counter[0] += 1
+                argv = mix.choose(rng)
+            now = time.time()
+            due = start + i / float(rate) if rate else now
+            if due >= end:
+                return
+            if due > now:
+                time.sleep(due - now)
+            began = time.time()
+            code = target.run(argv)
+            finished = time.time()
+            with lock:
+                results.append((finished - due, finished - began, code, finished))
+
+    try:
+        workers = [threading.Thread(target=worker) for _ in range(concurrency)]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+    finally:
+        # Stopped first so that the fork server and its plugins count as children
+        target.stop()
+    after = [resource.getrusage(who) for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN)]
+
+    elapsed = max([r[3] for r in results] + [end]) - start
+    latencies = plugins.Samples(r[0] for r in results)
+    services = plugins.Samples(r[1] for r in results)
+    cpu = sum(a.ru_utime + a.ru_stime - b.ru_utime - b.ru_stime for a, b in zip(after, before))
+    codes = dict((name, 0) for name in plugins.RESULT_NAMES)
+    for r in results:
+        name = plugins.RESULT_NAMES[r[2]] if 0 <= r[2] < len(plugins.RESULT_NAMES) else str(r[2])
+        codes[name] = codes.get(name, 0) + 1
+
+    def ms(value):
+        return None if value is None else round(value * 1000, 3)
+
+    def percentiles(samples, names):
+        return dict((name, ms(samples.percentile(p)) if len(samples) else None) for name, p in names)
+
+    return {
+        'target': target.name,
+        'rate': rate,
+        'concurrency': concurrency,
+        'seconds': round(elapsed, 3),
+        'checks': len(results),
+        'throughput': round(len(results) / elapsed, 2),
+        'latency_ms': percentiles(latencies, [('p50', 50), ('p90', 90), ('p99', 99), ('max', 100)]),
+        'service_ms': percentiles(services, [('p50', 50), ('p99', 99)]),
+        'cpu_seconds': round(cpu, 3),
+        'cpu_ms_per_check': ms(cpu / len(results)) if results else None,
+        'rss_kb': after[0].ru_maxrss,
+        'child_rss_kb': after[1].ru_maxrss if target.children else 0,
+        'child_rss_upper_bound': target.children and after[1].ru_maxrss == before[1].ru_maxrss,
+        'codes': codes,
+    }
+
+def format_reports(reports):
+    '''
+    The reports as a table, one line per report
+    '''
+    lines = ["%-8s %8s %8s %8s %9s %9s %9s %9s %8s %8s" % (
+        "target", "rate", "checks", "per sec", "p50 ms", "p90 ms", "p99 ms", "cpu ms", "rss kB", "child kB")]
+    for r in reports:
+        lines.append("%-8s %8s %8d %8.1f %9.2f %9.2f %9.2f %9.2f %8d %8s" % (
+            r['target'], r['rate'] or "max", r['checks'], r['throughput'],
+            r['latency_ms']['p50'] or 0, r['latency_ms']['p90'] or 0, r['latency_ms']['p99'] or 0,
+            r['cpu_ms_per_check'] or 0, r['rss_kb'],
+            ("<=%d" if r['child_rss_upper_bound'] else "%d") % r['child_rss_kb']))
+    return "\n".join(lines)
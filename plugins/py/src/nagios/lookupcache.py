@@ -0,0 +1,658 @@
+'''
+Share the results of slow lookups (arp scans, dns, snmp tables, service discovery)
+between plugin runs, and between the processes of a poller.
+
+A LookupCache answers keys from a table kept in a file and only fetches, once for
+all the keys a lookup needs, when one of them is missing or stale. fetch(keys)
+returns a dict of key: value for the keys it found. A complete fetch (a sweep of a
+network, say) returns everything there is and its result replaces the table; any
+other (a resolver) answers for the keys asked and its result is merged in.
+
+Around that:
+
+ttl: a value is trusted for ttl seconds after it was fetched. With max_ttl, the value
+    of a key that rarely changes is trusted for longer, as ADAPTIVE_FRACTION of the
+    time its value has typically stayed the same (see entry_ttl), up to max_ttl.
+negative entries: a key a fetch did not return answers "not found" without fetching
+    until its backoff runs out, unless _turned_up (a subclass's cheap way of knowing
+    better) says it has turned up since. The backoff starts at negative_ttl seconds
+    and doubles with every fetch that still misses the key, up to max_backoff.
+max_entries: the table is bounded. When a fetch is stored, the keys least recently
+    used (looked up by any process, or else fetched) are evicted. A hit saves its use
+    time at most once every USED_RESOLUTION seconds per key, so keys used within
+    that long of each other may be evicted in either order.
+probes: before a complete fetch, the keys due are given to _probe, a subclass's
+    cheaper way of fetching just them (a mac at its last known ip rather than a
+    sweep of the network). If it finds them all its result is merged in and the
+    complete fetch is not run.
+failures: a fetch that partly failed (see _failed_keys) is merged in rather than
+    replacing the table, and the keys it could not answer for are not backed off.
+
+The files are fname (the table, as json of key: value), fname + ".negative" and
+fname + ".history" (per key: its value, when it was first and last fetched, how many
+times it changed and when it was last used), each replaced atomically, and
+fname + ".used", the use times of hits appended as lines of json [key, time] until
+the next fetch folds them into the history. Subclasses
+keep them elsewhere by overriding the write/read/_get hooks, as SqliteLookupCache
+does. Keys are strings, values anything json can store.
+
+This source is provided under the MIT License (see LICENSE.txt)
+Copyright (c) 2014 Ryan C. Catherman
+'''
+
+import bisect
+import contextlib
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+def atomic_write(fname, data):
+    '''
+    Replace the contents of fname with data such that a concurrent reader sees either
+    the old or the new contents, never a partial file.
+    '''
+    dirname, basename = os.path.split(os.path.abspath(fname))
+    f = tempfile.NamedTemporaryFile(dir=dirname, prefix="." + basename, delete=False)
+    try:
+        with f:
+            f.write(data)
+        os.rename(f.name, fname)
+    except:
+        os.unlink(f.name)
+        raise
+
+class LookupCache(object):
+    '''
+    The cache of the values fetch returns. See the module documentation.
+
+    stats counts, for this instance, the keys found ("hits"), not found after a fetch
+    ("misses"), answered from the negative entries ("negative_hits") and the fetches
+    run (named by FETCHES). statistics() adds the hit ratio and the fetch latency.
+    '''
+
+    # Share of a key's typical time between value changes that its value is trusted for
+    ADAPTIVE_FRACTION = 0.2
+    # History of keys not fetched for this long is dropped
+    HISTORY_TTL = 7 * 86400
+    # What stats calls a fetch
+    FETCHES = 'fetches'
+    # Seconds between the use times saved for a key
+    USED_RESOLUTION = 60
+
+    def __init__(self, fname, fetch=None, complete=False, ttl=30, max_ttl=None,
+        negative_ttl=60, max_backoff=3600, max_entries=None):
+        assert 0 < negative_ttl <= max_backoff
+        assert max_entries is None or max_entries >= 1
+        self.__fname = fname
+        self.__negative_fname = fname + ".negative"
+        self.__history_fname = fname + ".history"
+        self.__used_fname = fname + ".used"
+        self.__fetcher = fetch
+        self.__complete = complete
+        self.__ttl = ttl
+        self.__max_ttl = max_ttl
+        self.__negative_ttl = negative_ttl
+        self.__max_backoff = max_backoff
+        self.__max_entries = max_entries
+        self.__cached = None
+        self.__index = None
+        self.__negative = None
+        self.__history = None
+        # Keys this instance answered, and when: merged into the history on the next
+        # fetch, and saved with write_used for the fetches of other processes
+        self.__used = {}
+        # Keys the last fetch could not answer for, see _failed_keys
+        self.__failed = ()
+        self.__lookups = 0
+        self.__lookups_fetched = 0
+        self.__fetch_seconds = []
+        self.__probe_seconds = []
+        self.__probes_found = 0
+        self.__evictions = 0
+        self.stats = {'hits': 0, 'misses': 0, 'negative_hits': 0, self.FETCHES: 0}
+
+    def mtime(self):
+        '''
+        When the table was last written, 0 if never
+        '''
+        try:
+            return os.stat(self.__fname).st_mtime
+        except OSError:
+            return 0
+
+    def write(self, obj):
+        atomic_write(self.__fname, json.dumps(obj))
+
+    def read(self):
+        '''
+        The table as a dict of key: value, None if there is none
+        '''
+        try:
+            with open(self.__fname, 'r') as f:
+                return json.loads(f.read())
+        except (IOError, OSError, ValueError):
+            return None
+
+    def _get(self, key):
+        '''
+        The value stored for key, or None
+        '''
+        if self.__cached is None:
+            self.__cached = self.read() or {}
+        return self.__cached.get(key)
+
+    def _between(self, low, high):
+        '''
+        The (key, value) of the keys from low to high, in order
+        '''
+        if self.__cached is None:
+            self.__cached = self.read() or {}
+        cached = self.__cached
+        if self.__index is None or self.__index[0] is not cached:
+            # Rebuilt whenever a fetch (or a read) replaced the cached table
+            self.__index = (cached, sorted(cached))
+        keys = self.__index[1]
+        return (
+            (keys[i], cached[keys[i]])
+            for i in xrange(bisect.bisect_left(keys, low), bisect.bisect_right(keys, high)))
+
+    def write_negative(self, obj):
+        atomic_write(self.__negative_fname, json.dumps(obj))
+
+    def read_negative(self):
+        '''
+        The negative entries as a dict of key: {"misses": n, "until": time}
+        '''
+        try:
+            with open(self.__negative_fname, 'r') as f:
+                return json.loads(f.read())
+        except (IOError, ValueError):
+            return {}
+
+    def _get_negative(self, key):
+        '''
+        The negative entry for key, or None
+        '''
+        if self.__negative is None:
+            self.__negative = self.read_negative()
+        return self.__negative.get(key)
+
+    def write_history(self, obj):
+        atomic_write(self.__history_fname, json.dumps(obj))
+
+    def read_history(self):
+        '''
+        The history as a dict of key:
+            {"value": value, "first": time, "checked": time, "changes": n, "used": time}
+        '''
+        try:
+            with open(self.__history_fname, 'r') as f:
+                return json.loads(f.read())
+        except (IOError, ValueError):
+            return {}
+
+    def _get_history(self, key):
+        '''
+        The history of key, or None
+        '''
+        if self.__history is None:
+            self.__history = self.read_history()
+        return self.__history.get(key)
+
+    def write_used(self, obj):
+        '''
+        Save the use times obj, a dict of key: time, for the next fetch of any process
+        '''
+        # Appended, so that a hit costs a small write rather than one of the history
+        with open(self.__used_fname, 'a') as f:
+            f.write("".join(json.dumps([key, used]) + "\n" for key, used in obj.iteritems()))
+
+    def take_used(self):
+        '''
+        The use times saved by write_used since the last take_used, as key: time
+        '''
+        taken = "%s.%d.%x" % (self.__used_fname, os.getpid(), id(self))
+        try:
+            os.rename(self.__used_fname, taken)
+        except OSError:
+            return {}
+        used = {}
+        try:
+            with open(taken, 'r') as f:
+                for line in f:
+                    try:
+                        key, when = json.loads(line)
+                    except ValueError:
+                        # Cut short by a writer that failed
+                        continue
+                    used[key] = max(when, used.get(key, 0))
+        finally:
+            os.unlink(taken)
+        return used
+
+    def _fetch(self, keys):
+        '''
+        Fetch keys and return a dict of key: value for the ones found. Raise if the
+        fetch failed: nothing stored is changed.
+        '''
+        assert self.__fetcher is not None, "No fetch given and _fetch not overridden"
+        return self.__fetcher(keys)
+
+    def _probe(self, keys):
+        '''
+        Fetch just keys, for a complete cache, and return a dict of key: value for the
+        ones found, or None if they cannot be fetched that way. Raising counts as a
+        probe that found nothing.
+        '''
+        return None
+
+    def _failed_keys(self, keys):
+        '''
+        After a fetch of keys, None if all of it worked, else the keys among them it
+        could not answer for because part of it failed: the result is then merged
+        into the table, even for a complete fetch, and those keys are not recorded
+        as misses.
+        '''
+        return None
+
+    def _turned_up(self, keys):
+        '''
+        The keys among keys, all backing off after a miss, known without a fetch to
+        have turned up since: they are looked up as if they had no negative entry.
+        '''
+        return ()
+
+    def entry_ttl(self, entry, ttl):
+        '''
+        Seconds the value of the key with history entry can be trusted for after its
+        last fetch
+        '''
+        if self.__max_ttl is None:
+            return ttl
+        lifetime = (entry['checked'] - entry['first']) / (entry['changes'] + 1)
+        return min(max(self.ADAPTIVE_FRACTION * lifetime, ttl), self.__max_ttl)
+
+    def __is_due(self, key, now, ttl):
+        value = self._get(key)
+        if value is None:
+            return True
+        entry = self._get_history(key)
+        if entry is None or entry['value'] != value:
+            # Written without a history (or by an older version): the write time is all we have
+            return (self.mtime() + ttl) <= now
+        return (entry['checked'] + self.entry_ttl(entry, ttl)) <= now
+
+    def lookup(self, key, ttl=None):
+        '''
+        The value of key. Raise KeyError if there is none.
+        '''
+        found = self.__lookup_many([key], ttl)
+        if key not in found:
+            raise KeyError(key)
+        return found[key]
+
+    def lookup_many(self, keys, ttl=None):
+        '''
+        Look up several keys with at most one fetch, run if any of them is missing or
+        stale (older than ttl, the cache's ttl if None). Return a dict of key: value
+        for the ones found.
+        '''
+        return self.__lookup_many(keys, ttl)
+
+    def __lookup_many(self, keys, ttl):
+        now = time.time()
+        ttl = self.__ttl if ttl is None else ttl
+        wanted = []
+        backing_off = []
+        for key in keys:
+            entry = self._get_negative(key)
+            if entry is not None and now < entry['until']:
+                # The last fetch missed it and we are still backing off
+                backing_off.append(key)
+            else:
+                wanted.append(key)
+        if backing_off:
+            turned_up = set(self._turned_up(backing_off))
+            wanted.extend(key for key in backing_off if key in turned_up)
+            self.stats['negative_hits'] += len([key for key in backing_off if key not in turned_up])
+
+        due = [key for key in wanted if self.__is_due(key, now, ttl)]
+        self.__lookups += len(keys)
+        self.__lookups_fetched += len(due)
+        # Answered from the fetch and what was fresh before it, as a fetch that stores
+        # more keys than max_entries evicts some of the ones asked for
+        values = dict((key, self._get(key)) for key in wanted if key not in due)
+        if due:
+            fetched = self.__fetch(due, now)
+            values.update((key, fetched.get(key)) for key in due)
+
+        found = {}
+        missed = []
+        touched = {}
+        for key in wanted:
+            value = values[key]
+            if value is None:
+                self.stats['misses'] += 1
+                missed.append(key)
+            else:
+                self.stats['hits'] += 1
+                if key not in due and self.__used_since(key) + self.USED_RESOLUTION <= now:
+                    touched[key] = now
+                self.__used[key] = now
+                found[key] = value
+        if touched:
+            self.write_used(touched)
+        missed = [key for key in missed if key not in self.__failed]
+        if missed:
+            self.__remember_misses(missed, now)
+        return found
+
+    def __used_since(self, key):
+        '''
+        The last use of key known here: saved, fetched or by this instance
+        '''
+        entry = self._get_history(key) or {}
+        return max(entry.get('used', 0), entry.get('checked', 0), self.__used.get(key, 0))
+
+    def refresh(self, keys=()):
+        '''
+        Fetch keys (everything, for a complete fetch) now, however fresh they are,
+        without probing first
+        '''
+        self.__fetch(list(keys), time.time(), probe=False)
+
+    def __fetch(self, keys, now, probe=True):
+        self.__failed = ()
+        if self.__complete and keys and probe:
+            probed = self.__probe(keys)
+            if probed is not None and all(key in probed for key in keys):
+                self.__probes_found += 1
+                self.__store(probed, keys, now, False)
+                return probed
+
+        self.stats[self.FETCHES] += 1
+        started = time.time()
+        try:
+            result = self._fetch(keys)
+        finally:
+            self.__fetch_seconds.append(time.time() - started)
+        failed = self._failed_keys(keys)
+        if failed is None:
+            self.__store(result, keys, now, self.__complete)
+        else:
+            # Part of it failed: what was stored for that part is all there is
+            self.__failed = set(failed)
+            self.__store(result, [key for key in keys if key not in self.__failed], now, False)
+        return result
+
+    def __probe(self, keys):
+        started = time.time()
+        try:
+            probed = self._probe(keys)
+        except Exception, e:
+            print >> sys.stderr, "Probe failed: %s" % e
+            probed = {}
+        if probed is not None:
+            self.__probe_seconds.append(time.time() - started)
+        return probed
+
+    def __store(self, result, keys, now, complete):
+        if complete:
+            table = dict(result)
+        else:
+            # Start from what is stored, other processes may have fetched since
+            table = self.read() or {}
+            for key in keys:
+                table.pop(key, None)
+            table.update(result)
+
+        self.__record_fetch(result, now)
+        self.__evict(table)
+        self.write(table)
+        self.__cached = table
+        self.write_history(self.__history)
+
+        # Anything found again is no longer backing off
+        self.__negative = self.read_negative()
+        found = [k for k in self.__negative if k in result]
+        if found:
+            for k in found:
+                del self.__negative[k]
+            self.write_negative(self.__negative)
+
+    def __record_fetch(self, result, now):
+        # Start from what is stored, other processes may have fetched since
+        self.__history = self.read_history()
+        for key, value in result.iteritems():
+            entry = self.__history.get(key)
+            if entry is None:
+                self.__history[key] = {'value': value, 'first': now, 'checked': now, 'changes': 0}
+                continue
+            if entry['value'] != value:
+                entry['value'] = value
+                entry['changes'] += 1
+            entry['checked'] = now
+
+        used = self.take_used()
+        for key, when in self.__used.iteritems():
+            used[key] = max(when, used.get(key, 0))
+        self.__used = {}
+        for key, when in used.iteritems():
+            entry = self.__history.get(key)
+            if entry is not None and when > entry.get('used', 0):
+                entry['used'] = when
+
+        for k in [k for k, v in self.__history.items() if now > v['checked'] + self.HISTORY_TTL]:
+            del self.__history[k]
+
+    def __evict(self, table):
+        if self.__max_entries is None or len(table) <= self.__max_entries:
+            return
+        def last_used(key):
+            entry = self.__history.get(key) or {}
+            return max(entry.get('used', 0), entry.get('checked', 0))
+        by_use = sorted(table, key=last_used)
+        for key in by_use[:len(table) - self.__max_entries]:
+            del table[key]
+            self.__history.pop(key, None)
+            self.__evictions += 1
+
+    def __remember_misses(self, keys, now):
+        # Start from what is stored, other processes may have added entries since
+        self.__negative = self.read_negative()
+        for key in keys:
+            entry = self.__negative.get(key)
+            if entry is None or now > entry['until'] + self.__max_backoff:
+                # Unknown, or quiet for long enough that the backoff starts over
+                misses = 1
+            else:
+                misses = entry['misses'] + 1
+
+            backoff = min(self.__negative_ttl * (2 ** (misses - 1)), self.__max_backoff)
+            self.__negative[key] = {'misses': misses, 'until': now + backoff}
+
+        # Drop what can no longer affect a backoff so the file stays small
+        for k in [k for k, v in self.__negative.items() if now > v['until'] + self.__max_backoff]:
+            del self.__negative[k]
+        self.write_negative(self.__negative)
+
+    def statistics(self):
+        '''
+        stats, and:
+            lookups: keys looked up
+            hit_ratio: share of them answered without waiting for a fetch (None before any)
+            fetch_seconds_mean, fetch_seconds_max: how long fetches took (None before any)
+            evictions: keys evicted to keep within max_entries
+            probes: probes run, probes_found: how many of them spared a complete fetch
+            probe_seconds_mean, probe_seconds_max: how long probes took (None before any)
+        '''
+        seconds = self.__fetch_seconds
+        probe_seconds = self.__probe_seconds
+        result = dict(self.stats)
+        result.update(
+            lookups=self.__lookups,
+            hit_ratio=(
+                float(self.__lookups - self.__lookups_fetched) / self.__lookups if self.__lookups else None),
+            fetch_seconds_mean=sum(seconds) / len(seconds) if seconds else None,
+            fetch_seconds_max=max(seconds) if seconds else None,
+            evictions=self.__evictions,
+            probes=len(probe_seconds),
+            probes_found=self.__probes_found,
+            probe_seconds_mean=sum(probe_seconds) / len(probe_seconds) if probe_seconds else None,
+            probe_seconds_max=max(probe_seconds) if probe_seconds else None)
+        return result
+
+class SqliteLookupCache(LookupCache):
+    '''
+    LookupCache kept in a sqlite database in WAL mode rather than json files.
+
+    Meant for several pollers sharing one cache: each process (or thread) uses its own
+    instance, lookups are single indexed queries that never wait on a writer, and a
+    table is upserted in transactions of batch_size rows. Rows not in it are removed
+    in the last transaction, along with the write time that mtime reports. The
+    negative entries and the history live in tables of the same database: writing
+    them upserts the rows that changed since they were read and deletes the ones
+    dropped, and a hit saves its use time straight into the history.
+    '''
+
+    SCHEMA = [
+        "CREATE TABLE IF NOT EXISTS lookup (key TEXT PRIMARY KEY, value TEXT NOT NULL, written REAL NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS lookup_negative (key TEXT PRIMARY KEY, misses INTEGER NOT NULL, until REAL NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS lookup_meta (key TEXT PRIMARY KEY, value REAL NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS lookup_history (key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+            "first REAL NOT NULL, checked REAL NOT NULL, changes INTEGER NOT NULL, used REAL)",
+    ]
+
+    def __init__(self, fname, batch_size=500, busy_timeout=30, **kwargs):
+        super(SqliteLookupCache, self).__init__(fname, **kwargs)
+        assert batch_size >= 1
+        self.__batch_size = batch_size
+        # The rows of the negative entries and history as last read or written
+        self.__negative_rows = {}
+        self.__history_rows = {}
+
+        # Autocommit, so that transactions are only the ones made explicitly below
+        self.__db = sqlite3.connect(fname, timeout=busy_timeout, isolation_level=None)
+        self.__db.execute("PRAGMA journal_mode=WAL")
+        self.__db.execute("PRAGMA synchronous=NORMAL")
+        with self.__transaction() as db:
+            for statement in self.SCHEMA:
+                db.execute(statement)
+
+    def close(self):
+        self.__db.close()
+
+    @contextlib.contextmanager
+    def __transaction(self):
+        # IMMEDIATE takes the write lock up front, so writers queue on the busy
+        # timeout instead of failing to upgrade a read lock part way through.
+        self.__db.execute("BEGIN IMMEDIATE")
+        try:
+            yield self.__db
+        except:
+            self.__db.execute("ROLLBACK")
+            raise
+        self.__db.execute("COMMIT")
+
+    def mtime(self):
+        row = self.__db.execute("SELECT value FROM lookup_meta WHERE key = 'written'").fetchone()
+        return row[0] if row else 0
+
+    def write(self, obj):
+        written = time.time()
+        items = obj.items()
+        for i in range(0, len(items), self.__batch_size):
+            with self.__transaction() as db:
+                db.executemany(
+                    "INSERT OR REPLACE INTO lookup (key, value, written) VALUES (?, ?, ?)",
+                    [(key, json.dumps(value), written) for key, value in items[i:(i + self.__batch_size)]])
+
+        with self.__transaction() as db:
+            db.execute("DELETE FROM lookup WHERE written < ?", (written,))
+            db.execute("INSERT OR REPLACE INTO lookup_meta (key, value) VALUES ('written', ?)", (written,))
+
+    def read(self):
+        return dict((key, json.loads(value)) for key, value in self.__db.execute("SELECT key, value FROM lookup"))
+
+    def _get(self, key):
+        row = self.__db.execute("SELECT value FROM lookup WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _between(self, low, high):
+        # The primary key is the index
+        return (
+            (key, json.loads(value)) for key, value in self.__db.execute(
+                "SELECT key, value FROM lookup WHERE key BETWEEN ? AND ? ORDER BY key", (low, high)))
+
+    def __write_changed(self, table, columns, before, after):
+        '''
+        Make table, whose rows were before (key: values of columns), hold after
+        '''
+        changed = [(key,) + row for key, row in after.iteritems() if before.get(key) != row]
+        dropped = [(key,) for key in before if key not in after]
+        if not changed and not dropped:
+            return
+        with self.__transaction() as db:
+            db.executemany(
+                "INSERT OR REPLACE INTO %s (key, %s) VALUES (?%s)" % (
+                    table, ", ".join(columns), ", ?" * len(columns)),
+                changed)
+            db.executemany("DELETE FROM %s WHERE key = ?" % table, dropped)
+
+    def write_negative(self, obj):
+        rows = dict((key, (v['misses'], v['until'])) for key, v in obj.iteritems())
+        self.__write_changed("lookup_negative", ("misses", "until"), self.__negative_rows, rows)
+        self.__negative_rows = rows
+
+    def _get_negative(self, key):
+        row = self.__db.execute("SELECT misses, until FROM lookup_negative WHERE key = ?", (key,)).fetchone()
+        return {'misses': row[0], 'until': row[1]} if row else None
+
+    def read_negative(self):
+        self.__negative_rows = dict(
+            (key, (misses, until))
+            for key, misses, until in self.__db.execute("SELECT key, misses, until FROM lookup_negative"))
+        return dict(
+            (key, {'misses': misses, 'until': until}) for key, (misses, until) in self.__negative_rows.iteritems())
+
+    @staticmethod
+    def __history_row(entry):
+        return (json.dumps(entry['value']), entry['first'], entry['checked'], entry['changes'], entry.get('used'))
+
+    def write_history(self, obj):
+        rows = dict((key, self.__history_row(entry)) for key, entry in obj.iteritems())
+        self.__write_changed(
+            "lookup_history", ("value", "first", "checked", "changes", "used"), self.__history_rows, rows)
+        self.__history_rows = rows
+
+    def write_used(self, obj):
+        with self.__transaction() as db:
+            db.executemany(
+                "UPDATE lookup_history SET used = ? WHERE key = ? AND (used IS NULL OR used < ?)",
+                [(used, key, used) for key, used in obj.iteritems()])
+
+    def take_used(self):
+        # write_used saved them in the history already
+        return {}
+
+    @staticmethod
+    def __history_entry(value, first, checked, changes, used):
+        entry = {'value': json.loads(value), 'first': first, 'checked': checked, 'changes': changes}
+        if used is not None:
+            entry['used'] = used
+        return entry
+
+    def _get_history(self, key):
+        row = self.__db.execute(
+            "SELECT value, first, checked, changes, used FROM lookup_history WHERE key = ?", (key,)).fetchone()
+        return self.__history_entry(*row) if row else None
+
+    def read_history(self):
+        history = dict(
+            (row[0], self.__history_entry(*row[1:]))
+            for row in self.__db.execute("SELECT key, value, first, checked, changes, used FROM lookup_history"))
+        self.__history_rows = dict((key, self.__history_row(entry)) for key, entry in history.iteritems())
+        return history
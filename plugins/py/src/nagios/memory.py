@@ -0,0 +1,180 @@
+'''
+Measure the memory a piece of code takes, for PluginBase's --memory.
+
+There is no tracemalloc in python 2, so this watches the resident set size of the
+process instead: a MemoryProfile samples it from /proc/self/statm on a thread while
+the code runs, and every time it reaches a new high the growth is put down to the
+line the code was running at (its innermost frame). That gives the peak and the
+sites that took the process there, as tracemalloc would the allocations, though it
+only sees memory once the allocator takes it from the system, and growth inside a
+C call that holds the interpreter lock is put down to the line after it. The
+kernel's high water mark (VmHWM) catches a peak between two samples.
+
+Where there is no /proc, the peak is the one getrusage reports for the process and
+there are no sites.
+
+This source is provided under the MIT License (see LICENSE.txt)
+Copyright (c) 2014 Ryan C. Catherman
+'''
+
+import json
+import os
+import resource
+import sys
+import threading
+import time
+
+# Site of growth the sampler did not see, found when the profile stops
+OTHER = 'other'
+
+_UNITS = [('G', 1 << 30), ('M', 1 << 20), ('K', 1 << 10)]
+
+try:
+    _PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+except (AttributeError, ValueError, OSError):
+    _PAGE_SIZE = 4096
+
+def parse_size(value):
+    '''
+    Bytes of a size such as "4096", "512K", "256M" or "1.5G"
+    '''
+    text = value.strip().upper()
+    scale = 1
+    for suffix, size in _UNITS:
+        if text.endswith(suffix) or text.endswith(suffix + 'B'):
+            text = text[:text.rindex(suffix)]
+            scale = size
+            break
+    result = int(float(text) * scale)
+    if result <= 0:
+        raise ValueError("Invalid size %s" % value)
+    return result
+
+def format_size(value):
+    '''
+    A size in bytes the way a person would write it: "1.5MB"
+    '''
+    for suffix, size in _UNITS:
+        if value >= size:
+            return "%.3g%sB" % (float(value) / size, suffix)
+    return "%dB" % value
+
+def rss():
+    '''
+    The resident set size of the process in bytes, or None without /proc
+    '''
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (IOError, IndexError, ValueError):
+        return None
+
+def peak_rss():
+    '''
+    The most the process has ever had resident, in bytes
+    '''
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (IOError, IndexError, ValueError):
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+class MemoryProfile(object):
+    '''
+    Watch the memory of the process from start() to stop() (see the module
+    documentation), crediting growth to the thread that called start().
+
+    After stop():
+        start_rss, end_rss: resident bytes at either end, None without /proc
+        peak: the most resident while it ran
+        growth: how far the peak is over start_rss (0 without /proc)
+        sites: [(site, bytes)] of the growth, "file:line" or OTHER, most first
+        samples: [(seconds since start, bytes)] of every new high
+    '''
+
+    def __init__(self, interval=0.005):
+        assert interval > 0
+        self.__interval = interval
+        self.__stopped = threading.Event()
+        self.__thread = None
+        self.__ident = None
+        self.__started = None
+        self.__peak_before = None
+        self.__high = None
+        self.__sites = {}
+        self.start_rss = None
+        self.end_rss = None
+        self.peak = None
+        self.growth = 0
+        self.sites = []
+        self.samples = []
+
+    def start(self):
+        self.__ident = threading.current_thread().ident
+        self.__started = time.time()
+        self.__peak_before = peak_rss()
+        self.start_rss = self.__high = rss()
+        if self.start_rss is not None:
+            self.__thread = threading.Thread(target=self.__sample_until_stopped)
+            self.__thread.daemon = True
+            self.__thread.start()
+        return self
+
+    def stop(self):
+        if self.__thread is not None:
+            self.__stopped.set()
+            self.__thread.join()
+        self.end_rss = rss()
+        peak_after = peak_rss()
+
+        if self.start_rss is None:
+            self.peak = peak_after
+        else:
+            self.__sample(self.end_rss, OTHER)
+            # The high water mark only moves while this runs if the peak is this one's
+            if peak_after > self.__peak_before and peak_after > self.__high:
+                self.__sample(peak_after, OTHER)
+            self.peak = self.__high
+            self.growth = self.peak - self.start_rss
+        self.sites = sorted(self.__sites.items(), key=lambda site: (-site[1], site[0]))
+        return self
+
+    def __sample_until_stopped(self):
+        while not self.__stopped.wait(self.__interval):
+            value = rss()
+            if value is not None and value > self.__high:
+                self.__sample(value, self.__site())
+
+    def __site(self):
+        frame = sys._current_frames().get(self.__ident)
+        if frame is None:
+            return OTHER
+        return "%s:%d" % (os.path.basename(frame.f_code.co_filename), frame.f_lineno)
+
+    def __sample(self, value, site):
+        if value is None or value <= self.__high:
+            return
+        self.__sites[site] = self.__sites.get(site, 0) + value - self.__high
+        self.__high = value
+        self.samples.append((time.time() - self.__started, value))
+
+    def top(self, count):
+        '''
+        The count sites that grew the most
+        '''
+        return self.sites[:count]
+
+    def write(self, path, **extra):
+        '''
+        Save the profile as json in path, with the extra items
+        '''
+        snapshot = dict(extra)
+        snapshot.update(
+            start_rss=self.start_rss, end_rss=self.end_rss, peak=self.peak, growth=self.growth,
+            interval=self.__interval, sites=self.sites, samples=self.samples)
+        with open(path, 'w') as f:
+            json.dump(snapshot, f, indent=1, sort_keys=True)
@@ -0,0 +1,164 @@
+'''
+Export the latest plugin results in the OpenMetrics text format
+
+Keep a MetricsExporter, give it every PluginResult (see nagios.runner) as it comes in
+and scrape it over HTTP (serve()) or call render() directly. For every check it exports:
+
+nagios_check_state{host,service}                  the RESULT_ value
+nagios_check_duration_seconds{host,service}       how long the plugin ran
+nagios_perfdata_value{host,service,label,uom}     every perf data item
+nagios_perfdata_threshold{...,threshold,bound}    the warning/critical range ends
+
+See: https://github.com/OpenObservability/OpenMetrics
+
+This source is provided under the MIT License (see LICENSE.txt)
+Copyright (c) 2014 Ryan C. Catherman
+'''
+
+import BaseHTTPServer
+import collections
+import threading
+
+import nagios.plugins as plugins
+import nagios.runner as runner
+
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+FAMILIES = [
+    ('nagios_check_state', "Result of the last run (0 OK, 1 WARNING, 2 CRITICAL, 3 UNKNOWN)"),
+    ('nagios_check_duration_seconds', "Run time of the last run"),
+    ('nagios_perfdata_value', "Perf data reported by the last run"),
+    ('nagios_perfdata_threshold', "Ends of the warning and critical ranges of the perf data"),
+]
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(pairs):
+    return "{%s}" % ",".join('%s="%s"' % (k, _escape(v)) for k, v in pairs)
+
+def _number(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+def _range_ends(threshold):
+    '''
+    (lower, upper) of a plain range, with None for an infinite end. None for an
+    inverted range, which has no single pair of ends to export.
+    '''
+    try:
+        ranges = plugins.RangeThreshold._parse_range(str(threshold))
+    except ValueError:
+        return None
+    if len(ranges) != 1:
+        return None
+    return ranges[0]
+
+class MetricsExporter(object):
+    '''
+    The latest result of up to max_checks checks, rendered for scraping.
+
+    Each check's lines are rendered when its result arrives and kept, so a scrape
+    only joins strings; nothing is rendered again unless it changed. When a new check
+    would go over max_checks, the one updated longest ago is dropped, so memory stays
+    bounded however much checks (or their perf data labels) come and go.
+    '''
+
+    def __init__(self, max_checks=100000):
+        assert max_checks >= 1
+        self.__max_checks = max_checks
+        # (host, service) -> one rendered fragment per family, oldest update first
+        self.__checks = collections.OrderedDict()
+        self.__lock = threading.Lock()
+        self.__rendered = None
+        self.renders = 0
+
+    def __len__(self):
+        return len(self.__checks)
+
+    def update(self, host, service, result):
+        '''
+        Record the PluginResult of a check. service is None for host checks.
+        '''
+        assert isinstance(result, runner.PluginResult)
+        fragments = self._render_check(host, service or '', result)
+        with self.__lock:
+            self.__checks.pop((host, service), None)
+            self.__checks[(host, service)] = fragments
+            while len(self.__checks) > self.__max_checks:
+                self.__checks.popitem(last=False)
+            self.__rendered = None
+
+    def remove(self, host, service):
+        with self.__lock:
+            if self.__checks.pop((host, service), None) is not None:
+                self.__rendered = None
+
+    def _render_check(self, host, service, result):
+        key = [('host', host), ('service', service)]
+        perf_values = []
+        perf_thresholds = []
+        for perf in result.perf_data:
+            labels = key + [('label', perf.label), ('uom', perf.uom)]
+            perf_values.append("nagios_perfdata_value%s %s\n" % (_labels(labels), _number(perf.value)))
+            for name, threshold in [('warning', perf.warning), ('critical', perf.critical)]:
+                ends = None if threshold is None else _range_ends(threshold)
+                if ends is None:
+                    continue
+                for bound, value in zip(('lower', 'upper'), ends):
+                    if value is not None:
+                        perf_thresholds.append("nagios_perfdata_threshold%s %s\n" % (
+                            _labels(labels + [('threshold', name), ('bound', bound)]), _number(value)))
+
+        duration = ""
+        if result.seconds is not None:
+            duration = "nagios_check_duration_seconds%s %s\n" % (_labels(key), _number(result.seconds))
+        return (
+            "nagios_check_state%s %d\n" % (_labels(key), result.code),
+            duration,
+            "".join(perf_values),
+            "".join(perf_thresholds),
+        )
+
+    def render(self):
+        '''
+        Everything, in the OpenMetrics text format
+        '''
+        with self.__lock:
+            if self.__rendered is None:
+                checks = self.__checks.values()
+                parts = []
+                for index, (family, help_) in enumerate(FAMILIES):
+                    parts.append("# TYPE %s gauge\n# HELP %s %s\n" % (family, family, help_))
+                    parts.extend([fragments[index] for fragments in checks])
+                parts.append("# EOF\n")
+                self.__rendered = "".join(parts)
+                self.renders += 1
+            return self.__rendered
+
+def serve(exporter, address=('', 9267)):
+    '''
+    Serve exporter.render() at /metrics from a background thread. Return the
+    server; call shutdown() on it to stop.
+    '''
+    class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = exporter.render()
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = BaseHTTPServer.HTTPServer(address, Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
@@ -0,0 +1,364 @@
+'''
+Find the nagios services that run our plugins, from the object configuration
+
+Reads object config files (the "define command {...}" kind, see README.txt) or the
+objects.cache nagios writes out, resolves every service's command_line with its
+macros, and maps the ones whose command is a registered plugin to that PluginBase
+subclass with its options already parsed. Batch or daemon runners can then run those
+checks in-process (see nagios.runner) instead of forking a plugin per check.
+
+    objects.register_plugin('check_random', check_random.CheckRandom)
+    config = objects.ObjectConfig(['/var/cache/nagios3/objects.cache'])
+    for check in config.services():
+        if check.factory is not None and check.error is None:
+            result = runner.PluginRunner(check.factory).run(check.argv)
+
+The files are read twice and never held: the first pass keeps the commands,
+templates, hosts and host groups that services refer to, the second streams the
+services. Memory grows with the number of hosts, not services.
+
+This source is provided under the MIT License (see LICENSE.txt)
+Copyright (c) 2014 Ryan C. Catherman
+'''
+
+import os
+import re
+import shlex
+import StringIO
+
+import nagios.plugins as plugins
+
+# Plugin name (the command's file name, without .py) -> PluginBase subclass
+PLUGINS = {}
+
+def register_plugin(name, factory):
+    '''
+    Map commands running the executable name to factory, a PluginBase subclass
+    (or anything creating one when called as factory(out_file=...))
+    '''
+    PLUGINS[name] = factory
+
+def _strip_comment(line):
+    '''
+    Cut an inline ; comment, keeping escaped \\; as ;
+    '''
+    start = 0
+    while True:
+        index = line.find(';', start)
+        if index < 0:
+            break
+        if index and line[index - 1] == '\\':
+            line = line[:index - 1] + line[index:]
+            start = index
+            continue
+        line = line[:index].rstrip()
+        break
+    return line
+
+def read_objects(f):
+    '''
+    Yield (type, fields) for every "define type { ... }" block of an object config
+    file. fields is a dict of the directives in the block.
+    '''
+    fields = None
+    for line in f:
+        line = line.strip()
+        if not line or line[0] in '#;':
+            continue
+        if ';' in line:
+            line = _strip_comment(line)
+
+        if fields is None:
+            if line.startswith('define'):
+                kind = line[6:].rstrip('{').strip()
+                fields = {}
+        elif line == '}':
+            yield kind, fields
+            fields = None
+        else:
+            tokens = line.split(None, 1)
+            fields[tokens[0]] = tokens[1] if len(tokens) > 1 else ''
+
+def read_resources(f):
+    '''
+    The $USERn$ macros of a resource file, as a dict of "USERn": value
+    '''
+    resources = {}
+    for line in f:
+        line = line.strip()
+        if line.startswith('$') and '=' in line:
+            name, _, value = line.partition('=')
+            resources[name.strip().strip('$')] = value.strip()
+    return resources
+
+def read_main_config(fname):
+    '''
+    Return (object config files, resources) of a main config file (nagios.cfg): the
+    cfg_file entries and the *.cfg files under the cfg_dir entries, and the macros of
+    every resource_file.
+    '''
+    files = []
+    resources = {}
+    base = os.path.dirname(fname)
+    with open(fname) as f:
+        for line in f:
+            key, _, value = line.strip().partition('=')
+            if not value:
+                continue
+            path = os.path.join(base, value)
+            if key == 'cfg_file':
+                files.append(path)
+            elif key == 'cfg_dir':
+                for dirpath, dirnames, filenames in os.walk(path):
+                    dirnames.sort()
+                    files.extend(os.path.join(dirpath, n) for n in sorted(filenames) if n.endswith('.cfg'))
+            elif key == 'resource_file':
+                with open(path) as r:
+                    resources.update(read_resources(r))
+    return files, resources
+
+_MACRO = re.compile(r'\$([A-Za-z0-9_]*)\$')
+
+def resolve_macros(text, macros):
+    '''
+    Replace the $NAME$ macros of text found in macros. Others are left alone, and $$
+    is a $.
+    '''
+    def replace(match):
+        name = match.group(1)
+        if not name:
+            return '$'
+        return macros.get(name, match.group(0))
+    return _MACRO.sub(replace, text)
+
+# Other names nagios accepts for service directives
+_SERVICE_ALIASES = [
+    ('host', 'host_name'),
+    ('hosts', 'host_name'),
+    ('hostgroup', 'hostgroup_name'),
+    ('hostgroups', 'hostgroup_name'),
+    ('description', 'service_description'),
+]
+
+def _split(value):
+    return [v.strip() for v in value.split(',') if v.strip()]
+
+class ServiceCheck(object):
+    '''
+    One service of one host, as nagios would run it.
+
+    command_line: the resolved command line
+    argv: the command line split as the plugin would get it in sys.argv, or None
+        when it needs a shell
+    factory: the registered plugin running it, or None
+    options: the plugin's options parsed from argv (optparse Values), or None. The
+        thresholds it runs with are in options.warning and options.critical (see
+        nagios.plugins.get_option_parser).
+    error: why it cannot be run in-process (no registered plugin, a shell is needed,
+        or its options do not parse), or None
+    '''
+
+    def __init__(self, host_name, service_description, command_line, argv=None,
+        factory=None, options=None, error=None):
+        self.host_name = host_name
+        self.service_description = service_description
+        self.command_line = command_line
+        self.argv = argv
+        self.factory = factory
+        self.options = options
+        self.error = error
+
+    def __repr__(self):
+        return "ServiceCheck(%r, %r, %r)" % (self.host_name, self.service_description, self.command_line)
+
+class ObjectConfig(object):
+    '''
+    The object configuration spread over fnames (object config files or
+    objects.cache). resources holds the $USERn$ macros (see read_resources).
+    '''
+
+    # Distinct command lines whose parsed options are kept for reuse
+    MAX_PARSED = 10000
+
+    def __init__(self, fnames, resources=None):
+        self.__fnames = list(fnames)
+        self.__resources = dict(resources or {})
+        self.__commands = {}
+        # (type, name) -> fields of the objects that can be used as templates
+        self.__templates = {}
+        # host name -> (address, alias, custom variable macros)
+        self.__hosts = {}
+        self.__hostgroups = {}
+        self.__parsed = {}
+        self.__load()
+
+    def __objects(self):
+        for fname in self.__fnames:
+            with open(fname) as f:
+                for kind, fields in read_objects(f):
+                    yield kind, fields
+
+    def __load(self):
+        hosts = []
+        for kind, fields in self.__objects():
+            if 'name' in fields:
+                self.__templates[(kind, fields['name'])] = fields
+            if kind == 'command':
+                if 'command_name' in fields:
+                    self.__commands[fields['command_name']] = fields.get('command_line', '')
+            elif kind == 'host':
+                if fields.get('register') != '0':
+                    # Only what the macros and host groups need
+                    hosts.append(dict((k, v) for k, v in fields.iteritems()
+                        if k in ('host_name', 'address', 'alias', 'use', 'hostgroups') or k[0] == '_'))
+            elif kind == 'hostgroup':
+                if fields.get('register') != '0' and 'hostgroup_name' in fields:
+                    members = self.__hostgroups.setdefault(fields['hostgroup_name'], set())
+                    members.update(_split(fields.get('members', '')))
+
+        for fields in hosts:
+            fields = self.__inherit('host', fields)
+            name = fields.get('host_name')
+            if name is None:
+                continue
+            custom = dict(('_HOST' + k[1:].upper(), v) for k, v in fields.iteritems() if k[0] == '_')
+            self.__hosts[name] = (fields.get('address', name), fields.get('alias', name), custom)
+            for group in _split(fields.get('hostgroups', '').lstrip('+')):
+                self.__hostgroups.setdefault(group, set()).add(name)
+
+    def __inherit(self, kind, fields, seen=()):
+        '''
+        fields with what its templates (use) define and it does not
+        '''
+        if 'use' not in fields:
+            return fields
+        merged = {}
+        for name in reversed(_split(fields['use'])):
+            template = self.__templates.get((kind, name))
+            if template is None or name in seen:
+                continue
+            merged.update(self.__inherit(kind, template, seen + (name,)))
+        merged.update(fields)
+        del merged['use']
+        return merged
+
+    def __host_names(self, fields):
+        names = []
+        excluded = set()
+        for name in _split(fields.get('host_name', '')):
+            if name.startswith('!'):
+                excluded.add(name[1:])
+            elif name == '*':
+                names.extend(sorted(self.__hosts))
+            else:
+                names.append(name)
+        for group in _split(fields.get('hostgroup_name', '')):
+            if group.startswith('!'):
+                excluded.update(self.__hostgroups.get(group[1:], ()))
+            else:
+                names.extend(sorted(self.__hostgroups.get(group, ())))
+
+        seen = set()
+        for name in names:
+            if name not in excluded and name not in seen:
+                seen.add(name)
+                yield name
+
+    def services(self):
+        '''
+        Yield a ServiceCheck for every service of every host it applies to
+        '''
+        for kind, fields in self.__objects():
+            if kind != 'service' or fields.get('register') == '0':
+                continue
+            fields = self.__inherit('service', fields)
+            for alias, name in _SERVICE_ALIASES:
+                if alias in fields and name not in fields:
+                    fields[name] = fields[alias]
+            if 'check_command' not in fields or 'service_description' not in fields:
+                continue
+            for host_name in self.__host_names(fields):
+                yield self.__service_check(host_name, fields)
+
+    def __service_check(self, host_name, fields):
+        description = fields['service_description']
+        args = fields['check_command'].split('!')
+        command_line = self.__commands.get(args[0])
+        if command_line is None:
+            return ServiceCheck(host_name, description, None, error="Unknown command %s" % args[0])
+
+        address, alias, custom = self.__hosts.get(host_name, (host_name, host_name, {}))
+        macros = dict(self.__resources)
+        macros.update(custom)
+        macros.update(('ARG%d' % i, arg) for i, arg in enumerate(args[1:], 1))
+        macros.update(('_SERVICE' + k[1:].upper(), v) for k, v in fields.iteritems() if k[0] == '_')
+        macros.update({
+            'HOSTNAME': host_name,
+            'HOSTADDRESS': address,
+            'HOSTALIAS': alias,
+            'SERVICEDESC': description,
+        })
+        # Arguments can hold macros of their own
+        for i in range(1, len(args)):
+            macros['ARG%d' % i] = resolve_macros(macros['ARG%d' % i], macros)
+        command_line = resolve_macros(command_line, macros)
+
+        check = ServiceCheck(host_name, description, command_line)
+        self.__map_plugin(check)
+        return check
+
+    def __map_plugin(self, check):
+        unresolved = _MACRO.search(check.command_line)
+        if unresolved:
+            check.error = "Unresolved macro %s" % unresolved.group(0)
+            return
+        if any(c in check.command_line for c in '`|&<>$'):
+            check.error = "Needs a shell"
+            return
+        if any(c in check.command_line for c in '\'"\\'):
+            try:
+                argv = shlex.split(check.command_line)
+            except ValueError, e:
+                check.error = "Cannot split the command line: %s" % str(e)
+                return
+        else:
+            # Nothing quoted, which is most of them: no need for shlex, which is slow
+            argv = check.command_line.split()
+        if not argv:
+            check.error = "Empty command line"
+            return
+        check.argv = argv
+
+        name = os.path.basename(argv[0])
+        if name.endswith('.py'):
+            name = name[:-3]
+        check.factory = PLUGINS.get(name)
+        if check.factory is None:
+            check.error = "No plugin registered for %s" % name
+            return
+
+        key = (name, tuple(argv[1:]))
+        parsed = self.__parsed.get(key)
+        if parsed is None:
+            parsed = self.__parse_options(check.factory, argv)
+            if len(self.__parsed) >= self.MAX_PARSED:
+                self.__parsed.clear()
+            self.__parsed[key] = parsed
+        check.options, check.error = parsed
+
+    @staticmethod
+    def __parse_options(factory, argv):
+        '''
+        Return (options, None), or (None, message) when the plugin rejects argv
+        '''
+        out_file = StringIO.StringIO()
+        plugin = factory(out_file=out_file)
+        assert isinstance(plugin, plugins.PluginBase)
+        try:
+            options = plugins.parse_options(plugin._parser, argv)
+        except SystemExit:
+            return None, out_file.getvalue().strip() or "Invalid options"
+        # None for a plugin without -w or -c
+        options.ensure_value('warning', None)
+        options.ensure_value('critical', None)
+        return options, None
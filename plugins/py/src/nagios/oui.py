@@ -0,0 +1,181 @@
+'''
+Find the organization a mac address is assigned to, from the IEEE registries
+
+The registries (MA-L, MA-M and MA-S, about 50k prefixes between them) are too big
+to parse on every run, so they are compiled once (see oui_index) into a file of
+sorted prefix tables that is memory mapped on first use. A lookup is a binary search
+per prefix length, longest first, touching a few pages of the file.
+
+Nothing is read until the first lookup, and nothing at all by callers who never ask.
+
+This source is provided under the MIT License (see LICENSE.txt)
+Copyright (c) 2014 Ryan C. Catherman
+'''
+
+import bisect
+import csv
+import itertools
+import mmap
+import os
+import re
+import struct
+import tempfile
+
+DEFAULT_PATH = '/var/lib/nagios/oui.index'
+
+# magic, number of sections
+_HEADER = struct.Struct('<8sI')
+# prefix length in bits, number of prefixes, offset of the prefixes, offset of the names
+_SECTION = struct.Struct('<IIII')
+_PREFIX = struct.Struct('<Q')
+_NAME = struct.Struct('<I')
+_MAGIC = 'NGOUI001'
+
+_HEX = re.compile(r'^[0-9A-F]+$')
+
+def read_registry(f):
+    '''
+    Yield (prefix, organization) for every assignment of a registry file, prefix
+    being its hex digits: 6 for MA-L, 7 for MA-M, 9 for MA-S (and IAB).
+
+    Reads the IEEE csv files (oui.csv, mam.csv, oui36.csv), the IEEE oui.txt and
+    the "prefix<TAB>organization" files arp-scan ships.
+    '''
+    first = f.readline()
+    if first.startswith('Registry,'):
+        for row in csv.reader(f):
+            if len(row) >= 3:
+                yield row[1].strip().upper(), row[2].strip()
+        return
+
+    for line in itertools.chain([first], f):
+        if '(hex)' in line:
+            prefix, _, name = line.partition('(hex)')
+            prefix = prefix.replace('-', '')
+        else:
+            prefix, _, name = line.partition('\t')
+        prefix = prefix.strip().upper()
+        if _HEX.match(prefix):
+            yield prefix, name.strip()
+
+def compile_index(entries, fname):
+    '''
+    Write the index of entries, (prefix, organization) pairs as read_registry
+    yields them, to fname. Later entries replace earlier ones for the same prefix.
+    '''
+    by_bits = {}
+    for prefix, name in entries:
+        if len(prefix) not in (6, 7, 9) or not name:
+            continue
+        try:
+            value = int(prefix, 16)
+        except ValueError:
+            continue
+        bits = 4 * len(prefix)
+        by_bits.setdefault(bits, {})[value << (48 - bits)] = name
+
+    names = []
+    names_size = 0
+    name_offsets = {}
+    sections = []
+    for bits in sorted(by_bits, reverse=True):
+        table = sorted(by_bits[bits].items())
+        offsets = []
+        for _, name in table:
+            if name not in name_offsets:
+                name_offsets[name] = names_size
+                names.append(name)
+                names_size += len(name) + 1
+            offsets.append(name_offsets[name])
+        sections.append((bits, table, offsets))
+
+    data = []
+    offset = _HEADER.size + len(sections) * _SECTION.size
+    headers = []
+    for bits, table, offsets in sections:
+        headers.append(_SECTION.pack(bits, len(table), offset, offset + len(table) * _PREFIX.size))
+        data.append("".join(_PREFIX.pack(p) for p, _ in table))
+        data.append("".join(_NAME.pack(o) for o in offsets))
+        offset += len(table) * (_PREFIX.size + _NAME.size)
+
+    dirname, basename = os.path.split(os.path.abspath(fname))
+    f = tempfile.NamedTemporaryFile(dir=dirname, prefix="." + basename, delete=False)
+    try:
+        with f:
+            f.write(_HEADER.pack(_MAGIC, len(sections)))
+            f.write("".join(headers))
+            f.write("".join(data))
+            f.write("".join(n + "\0" for n in names))
+        os.chmod(f.name, 0644)
+        os.rename(f.name, fname)
+    except:
+        os.unlink(f.name)
+        raise
+
+class _Prefixes(object):
+    '''
+    The prefixes of a section, as a sequence bisect can search
+    '''
+
+    def __init__(self, data, offset, count):
+        self.__data = data
+        self.__offset = offset
+        self.__count = count
+
+    def __len__(self):
+        return self.__count
+
+    def __getitem__(self, index):
+        return _PREFIX.unpack_from(self.__data, self.__offset + index * _PREFIX.size)[0]
+
+class OuiIndex(object):
+    '''
+    A compiled index, memory mapped
+    '''
+
+    def __init__(self, fname):
+        with open(fname, 'rb') as f:
+            self.__map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.__map) < _HEADER.size or self.__map[:len(_MAGIC)] != _MAGIC:
+            raise ValueError("%s is not an oui index" % fname)
+        _, count = _HEADER.unpack_from(self.__map, 0)
+
+        self.__sections = []
+        end = _HEADER.size + count * _SECTION.size
+        for i in range(count):
+            bits, size, prefixes, names = _SECTION.unpack_from(self.__map, _HEADER.size + i * _SECTION.size)
+            self.__sections.append((48 - bits, _Prefixes(self.__map, prefixes, size), names))
+            end = max(end, names + size * _NAME.size)
+        # The names follow the last section
+        self.__names = end
+
+    def __len__(self):
+        return sum(len(prefixes) for _, prefixes, _ in self.__sections)
+
+    def close(self):
+        self.__map.close()
+
+    def vendor(self, value):
+        '''
+        The organization of the longest prefix matching value (a mac as a 48 bit
+        integer), or None
+        '''
+        for shift, prefixes, names in self.__sections:
+            key = (value >> shift) << shift
+            index = bisect.bisect_left(prefixes, key)
+            if index < len(prefixes) and prefixes[index] == key:
+                start = self.__names + _NAME.unpack_from(self.__map, names + index * _NAME.size)[0]
+                return self.__map[start:self.__map.find('\0', start)]
+        return None
+
+_indexes = {}
+
+def vendor(value, fname=None):
+    '''
+    OuiIndex.vendor of the index at fname (DEFAULT_PATH if None), mapped on first use
+    '''
+    fname = fname or DEFAULT_PATH
+    index = _indexes.get(fname)
+    if index is None:
+        index = _indexes[fname] = OuiIndex(fname)
+    return index.vendor(value)
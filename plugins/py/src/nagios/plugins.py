@@ -7,14 +7,67 @@ This source is provided under the MIT License (see LICENSE.txt)
 Copyright (c) 2014 Ryan C. Catherman
 '''
 
+import array
+import math
 import optparse
 import sys
+import threading
+import time
 
 RESULT_OK = 0
 RESULT_WARNING = 1
 RESULT_CRITICAL = 2
 RESULT_UNKNOWN = 3
 
+RESULT_NAMES = ['OK', 'WARNING', 'CRITICAL', 'UNKNOWN']
+
+# From least to most severe. UNKNOWN ranks between WARNING and CRITICAL, the way
+# nagios orders service states.
+RESULTS_BY_SEVERITY = [RESULT_OK, RESULT_WARNING, RESULT_UNKNOWN, RESULT_CRITICAL]
+
+def worst_result(results):
+    '''
+    The most severe of several RESULT_ values (RESULT_OK if there are none)
+    '''
+    return max(list(results) or [RESULT_OK], key=RESULTS_BY_SEVERITY.index)
+
+def _format_number(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+class PerfData(object):
+    '''
+    One performance data item, displayed as:
+    'label'=value[UOM];[warn];[crit];[min];[max]
+
+    warning and critical can be RangeThreshold instances or range strings.
+    '''
+
+    def __init__(self, label, value, uom='', warning=None, critical=None,
+        minimum=None, maximum=None):
+        assert '=' not in label and "'" not in label
+        self.label = label
+        self.value = value
+        self.uom = uom
+        self.warning = warning
+        self.critical = critical
+        self.minimum = minimum
+        self.maximum = maximum
+
+    def __str__(self):
+        label = self.label
+        if ' ' in label:
+            label = "'%s'" % label
+        fields = [
+            _format_number(self.value) + self.uom,
+            '' if self.warning is None else str(self.warning),
+            '' if self.critical is None else str(self.critical),
+            '' if self.minimum is None else _format_number(self.minimum),
+            '' if self.maximum is None else _format_number(self.maximum),
+        ]
+        return "%s=%s" % (label, ";".join(fields).rstrip(';'))
+
 
 class OutputHandler(object):
     '''
@@ -34,6 +87,9 @@ class OutputHandler(object):
         self.__perf_data = []
         self.__verbosity = 0
         self.__file = file
+        self.__history = None
+        self.__history_prefix = ''
+        self.__recorded = False
 
     def file(self):
         return self.__file
@@ -42,36 +98,95 @@ class OutputHandler(object):
         assert level >= 0 and level <= 3
         self.__verbosity = level
 
+    def verbosity(self):
+        return self.__verbosity
+
     def set_simple_result(self, result, long_result=None):
         assert self.__simple_result is None, "Simple Result should only be set once"
         self.__simple_result = result
         self.__long_result = long_result or result
 
+    def simple_result(self):
+        return self.__simple_result
+
+    def append_result(self, text):
+        '''
+        Add text to the end of the simple and long results, which must be set
+        '''
+        assert self.__simple_result is not None, "Result was never set!"
+        self.__simple_result = "%s; %s" % (self.__simple_result, text)
+        self.__long_result = "%s; %s" % (self.__long_result, text)
+
+    def long_result(self):
+        return self.__long_result
+
     def add_multiline(self, text):
         self.__multilines.append(text)
 
-    def add_perf_data(self):
+    def multilines(self):
+        return list(self.__multilines)
+
+    def add_perf_data(self, label, value, uom='', warning=None, critical=None,
+        minimum=None, maximum=None):
         '''
         'label'=value[UOM];[warn];[crit];[min];[max]
+
+        See PerfData. The items are displayed after a '|' on the first line.
         '''
-        assert False, "Not implemented yet"
+        self.__perf_data.append(
+            PerfData(label, value, uom, warning, critical, minimum, maximum))
 
-    def display_and_exit(self, result=RESULT_OK):
+    def perf_data(self):
+        return list(self.__perf_data)
+
+    def set_history(self, history, prefix=''):
         '''
-        Write the result data to stdout (default) and exit with result
+        Record the perf data in history (a nagios.tsdb.TimeSeriesStore), every item as
+        the series prefix + label, when the result is displayed
+        '''
+        self.__history = history
+        self.__history_prefix = prefix
 
-        This ensures the output conventions are followed.
+    def record_history(self, timestamp=None):
+        '''
+        Record the perf data now rather than when the result is displayed. It is only
+        ever recorded once.
+        '''
+        if self.__history is None or self.__recorded:
+            return
+        self.__recorded = True
+        self.__history.append_many(
+            [(self.__history_prefix + p.label, p.value) for p in self.__perf_data
+                if type(p.value) in [int, long, float]],
+            timestamp)
+
+    def lines(self):
+        '''
+        The lines to display for the configured verbosity
         '''
         assert self.__simple_result is not None, "Result was never set!"
 
         if 0 == self.__verbosity:
-            print >> self.__file, self.__simple_result
+            first = self.__simple_result
         else:
-            print >> self.__file, self.__long_result
+            first = self.__long_result
+        if self.__perf_data:
+            first = "%s | %s" % (first, " ".join(str(p) for p in self.__perf_data))
 
+        lines = [first]
         if 2 <= self.__verbosity:
-            for line in self.__multilines:
-                print >> self.__file, line
+            lines += self.__multilines
+        return lines
+
+    def display_and_exit(self, result=RESULT_OK):
+        '''
+        Write the result data to stdout (default) and exit with result
+
+        This ensures the output conventions are followed.
+        '''
+        self.record_history()
+        for line in self.lines():
+            print >> self.__file, line
 
         sys.exit(result)
 
@@ -123,18 +238,34 @@ class RangeThreshold(object):
         '''
         self.set_range(range_)
 
+    def __str__(self):
+        return self.__range_str
+
     def is_allowed(self, value):
         return self._check_value(self.__ranges, value)
 
+    def check_history(self, history, series, aggregate, window, now=None):
+        '''
+        Apply the range to an aggregate (see nagios.tsdb.Points.aggregate, eg "slope"
+        or "time_to:100") of the last window seconds of series in history, a
+        nagios.tsdb.TimeSeriesStore. Return (value, allowed), with (None, True) when
+        there is too little history to tell.
+        '''
+        value = history.aggregate(series, aggregate, window, now)
+        if value is None:
+            return None, True
+        return value, self.is_allowed(value)
+
     def opt_parse_callback(self, option, opt_str, value, parser):
         '''
-        Attempt to apply value
+        Attempt to apply value, and keep this instance in the parsed options
         '''
 
         try:
             self.set_range(value)
         except ValueError:
             parser.error("Invalid range option %(value)s" % {'value': value})
+        setattr(parser.values, option.dest, self)
 
     def set_range(self, range_str):
         '''
@@ -143,10 +274,17 @@ class RangeThreshold(object):
         Useful for just after option parsing
         '''
         self.__ranges = self._parse_range(range_str)
+        self.__range_str = range_str
 
     @staticmethod
     def _check_value(ranges, value):
-        assert type(value) in [int, long]
+        assert type(value) in [int, long, float]
+
+        if type(value) is float and len(ranges) == 2:
+            # An inverted range, kept as the integers either side of it. A value
+            # between those integers and the range is still outside the range.
+            (_, below), (above, _) = ranges
+            return value < below + 1 or value > above - 1
 
         # Assume False until a True is found
         for range in ranges:
@@ -248,9 +386,9 @@ def get_option_parser(
     version: Value to display when version called.
     out_file: (default sys.stdout). Most times, you can leave this alone
     warning_range: instance of RangeThreshold or None. If specified, the -w option will
-        be exposed and the RangeThreshold instance will be added to the options and configured
-        accordingly.
-    critical_range: instance of RangeThreshold or None
+        be exposed and the RangeThreshold instance will be added to the options (as
+        "warning") and configured accordingly.
+    critical_range: instance of RangeThreshold or None, as "critical"
     '''
 
     assert warning_range is None or isinstance(warning_range, RangeThreshold)
@@ -274,13 +412,13 @@ def get_option_parser(
 
     if warning_range:
         parser.add_option(
-            "-w", "--warning", dest="warning", type="string",
+            "-w", "--warning", dest="warning", type="string", default=warning_range,
             help="Standard nagios warning threshold option", action="callback",
             callback=warning_range.opt_parse_callback)
 
     if critical_range:
         parser.add_option(
-            "-c", "--critical", dest="warning", type="string",
+            "-c", "--critical", dest="critical", type="string", default=critical_range,
             help="Standard nagios critical threshold option", action="callback",
             callback=critical_range.opt_parse_callback)
 
@@ -323,6 +461,47 @@ class NagiosCritical(Exception):
     '''
     pass
 
+class Samples(object):
+    '''
+    A set of numeric samples, kept in an array of doubles, and the aggregates
+    that can be computed over them.
+    '''
+
+    AGGREGATES = ('mean', 'min', 'max', 'p50', 'p95', 'p99')
+
+    def __init__(self, values=()):
+        self.__values = array.array('d', values)
+        self.__sorted = None
+
+    def append(self, value):
+        self.__values.append(value)
+        self.__sorted = None
+
+    def __len__(self):
+        return len(self.__values)
+
+    def percentile(self, p):
+        '''
+        The nearest-rank percentile: the smallest sample with at least p% of the
+        samples at or below it.
+        '''
+        assert 0 < p <= 100
+        if self.__sorted is None:
+            self.__sorted = array.array('d', sorted(self.__values))
+        rank = int(math.ceil(p / 100.0 * len(self.__sorted)))
+        return self.__sorted[max(rank, 1) - 1]
+
+    def aggregate(self, name):
+        assert name in self.AGGREGATES
+        assert len(self.__values), "No samples"
+        if name == 'mean':
+            return math.fsum(self.__values) / len(self.__values)
+        if name == 'min':
+            return min(self.__values)
+        if name == 'max':
+            return max(self.__values)
+        return self.percentile(int(name[1:]))
+
 class PluginBase(object):
     '''
     Base class for plugin implementations.
@@ -330,14 +509,45 @@ class PluginBase(object):
     You don't have to actually use this...but it can't hurt!
     
     Subclass this and implement _run.
+
+    Plugins that need something from their previous run (like the last sample of a
+    counter) can keep it in self._state (see nagios.state.PluginState). It is stored
+    in STATE_FILE, or a per-user file in /tmp if that is None.
+
+    Plugins measuring something noisy can set SAMPLING and implement _sample. That
+    adds --samples, --interval, --concurrent and --aggregate: with more than one
+    sample, _sample is called that many times and the thresholds are applied to
+    the aggregate (mean, min, max, p50, p95 or p99) instead of calling _run. Every
+    aggregate and the sample count are reported as perf data.
+
+    Unless HISTORY is False, --history NAME keeps the perf data of the run in a
+    nagios.tsdb.TimeSeriesStore in HISTORY_PATH (a per-user directory in /tmp if
+    None), as the series "<plugin class>/NAME/<label>". --trend then applies
+    --trend-warning and --trend-critical to an aggregate of the last --trend-window
+    seconds of a perf data item (the first one if there is no --trend-label): eg
+    "--trend time_to:100 --trend-critical 86400:" for a disk filling up within a day.
+
+    Unless MEMORY is False, --memory watches the memory of the process while the
+    plugin runs (see nagios.memory.MemoryProfile) and reports its peak, how much it
+    grew and the --memory-sites lines it grew at most as perf data. --memory-budget
+    turns an OK result into a WARNING when the peak is over it, and
+    --memory-snapshot saves the whole profile as json. Either implies --memory.
     '''
     
     VERSION = None
     DEFAULT_WARNING = None
     DEFAULT_CRITICAL = None
+    STATE_FILE = None
+    SAMPLING = False
+    SAMPLE_UOM = ''
+    HISTORY = True
+    HISTORY_PATH = None
+    MEMORY = True
 
     def __init__(self, out_file=sys.stdout):
         self._output = OutputHandler(out_file)
+        self.__state = None
+        self.__history = None
 
         if self.DEFAULT_WARNING is None:
             self._warning = None
@@ -356,21 +566,264 @@ class PluginBase(object):
             critical_range=self._critical,
         )
 
+        if self.SAMPLING:
+            self._parser.add_option(
+                "--samples", dest="samples", type="int", default=1,
+                help="Number of samples to aggregate")
+            self._parser.add_option(
+                "--interval", dest="interval", type="float", default=0.0,
+                help="Seconds between samples")
+            self._parser.add_option(
+                "--concurrent", dest="concurrent", action="store_true", default=False,
+                help="Take all samples at once")
+            self._parser.add_option(
+                "--aggregate", dest="aggregate", type="choice", choices=list(Samples.AGGREGATES),
+                default='mean', help="Aggregate the thresholds apply to: %s" % ", ".join(Samples.AGGREGATES))
+
+        if self.HISTORY:
+            self._parser.add_option(
+                "--history", dest="history", type="string", default=None,
+                help="Keep the perf data in the history as NAME (eg the host)")
+            self._parser.add_option(
+                "--trend", dest="trend", type="string", default=None,
+                # Spelt out, nagios.tsdb is only imported for --history
+                help="Aggregate of the history the trend thresholds apply to: mean, min, max, last, "
+                    "count, slope (per SECONDS as slope:SECONDS) or time_to:VALUE")
+            self._parser.add_option(
+                "--trend-label", dest="trend_label", type="string", default=None,
+                help="Perf data item of the trend (default the first)")
+            self._parser.add_option(
+                "--trend-window", dest="trend_window", type="float", default=3600,
+                help="Seconds of history the trend is over")
+            self._parser.add_option(
+                "--trend-warning", dest="trend_warning", type="string", default=None,
+                help="Warning threshold of the trend")
+            self._parser.add_option(
+                "--trend-critical", dest="trend_critical", type="string", default=None,
+                help="Critical threshold of the trend")
+
+        if self.MEMORY:
+            self._parser.add_option(
+                "--memory", dest="memory", action="store_true", default=False,
+                help="Report the peak memory of the run and where it grew as perf data")
+            self._parser.add_option(
+                "--memory-budget", dest="memory_budget", type="string", default=None,
+                help="Warn when the peak memory of the run is over SIZE (eg 256M)")
+            self._parser.add_option(
+                "--memory-snapshot", dest="memory_snapshot", type="string", default=None,
+                help="Save the memory profile of the run as json in FILE")
+            self._parser.add_option(
+                "--memory-sites", dest="memory_sites", type="int", default=3,
+                help="Number of the lines the memory grew at most to report")
+
     def __call__(self, argv):
+        result, failure = self._execute(argv)
+        if failure is not None:
+            print >> self._output.file(), failure
+            sys.exit(RESULT_UNKNOWN)
+        self._output.display_and_exit(result)
+
+    def _execute(self, argv):
+        '''
+        Parse argv and run the plugin, leaving what it reported in self._output.
+
+        Return (RESULT_ value, None), or (RESULT_UNKNOWN, message) when the plugin
+        failed unexpectedly and message should be displayed instead of self._output.
+        Option parsing problems (and --help, --version) still exit.
+        '''
         opts = parse_options(self._parser, argv, output_handler=self._output)
+        if self.SAMPLING and opts.samples < 1:
+            self._parser.error("At least one sample is needed")
+        trend_thresholds = self.__trend_thresholds(opts)
+        profile, memory_budget = self.__start_memory(opts)
         try:
-            result = self._run(opts) or RESULT_OK
+            if self.SAMPLING and opts.samples > 1:
+                result = self._run_samples(opts) or RESULT_OK
+            else:
+                result = self._run(opts) or RESULT_OK
         except NagiosWarning, w:
             self._output.set_simple_result(str(w))
-            self._output.display_and_exit(RESULT_WARNING)
+            result = RESULT_WARNING
         except NagiosCritical, c:
             self._output.set_simple_result(str(c))
-            self._output.display_and_exit(RESULT_CRITICAL)
+            result = RESULT_CRITICAL
         except Exception, e:
-            print >> self._output.file(), "Unexpected failure: %s" % (str(e))
-            sys.exit(RESULT_UNKNOWN)
-        else:
-            self._output.display_and_exit(result)
+            return RESULT_UNKNOWN, "Unexpected failure: %s" % (str(e))
+        finally:
+            if profile is not None:
+                profile.stop()
+
+        if profile is not None and self._output.simple_result() is not None:
+            try:
+                result = self.__report_memory(opts, argv, result, profile, memory_budget)
+            except Exception, e:
+                return RESULT_UNKNOWN, "Unexpected failure: %s" % (str(e))
+
+        if self.HISTORY and opts.history is not None and self._output.simple_result() is not None:
+            try:
+                result = self.__run_history(opts, result, trend_thresholds)
+            except Exception, e:
+                return RESULT_UNKNOWN, "Unexpected failure: %s" % (str(e))
+        return result, None
+
+    def __trend_thresholds(self, opts):
+        '''
+        [(RESULT_ value, RangeThreshold)] of the trend options, most severe first
+        '''
+        if not self.HISTORY or opts.trend is None:
+            return []
+        if opts.history is None:
+            self._parser.error("--trend needs --history")
+        import nagios.tsdb
+        try:
+            nagios.tsdb.parse_aggregate(opts.trend)
+        except ValueError, e:
+            self._parser.error(str(e))
+        thresholds = []
+        for code, range_ in [(RESULT_CRITICAL, opts.trend_critical), (RESULT_WARNING, opts.trend_warning)]:
+            if range_ is not None:
+                try:
+                    thresholds.append((code, RangeThreshold(range_)))
+                except ValueError:
+                    self._parser.error("Invalid range option %s" % range_)
+        return thresholds
+
+    def __start_memory(self, opts):
+        '''
+        (the started nagios.memory.MemoryProfile, the bytes of --memory-budget or None)
+        if any of the memory options is given, else (None, None)
+        '''
+        if not self.MEMORY or not (opts.memory or opts.memory_budget is not None or opts.memory_snapshot):
+            return None, None
+        # Imported here so that plugins run without them don't pay for it at startup
+        import nagios.memory
+        budget = None
+        if opts.memory_budget is not None:
+            try:
+                budget = nagios.memory.parse_size(opts.memory_budget)
+            except ValueError:
+                self._parser.error("Invalid memory budget %s" % opts.memory_budget)
+        return nagios.memory.MemoryProfile().start(), budget
+
+    def __report_memory(self, opts, argv, result, profile, budget):
+        '''
+        Add the memory profile of the run to the perf data and apply the budget
+        '''
+        self._output.add_perf_data('memory_peak', profile.peak, 'B',
+            None if budget is None else str(budget), minimum=0)
+        self._output.add_perf_data('memory_growth', profile.growth, 'B', minimum=0)
+        for site, size in profile.top(opts.memory_sites):
+            self._output.add_perf_data("memory %s" % site, size, 'B')
+        if budget is not None and profile.peak > budget:
+            import nagios.memory
+            self._output.append_result("peak memory %s is over the budget of %s" % (
+                nagios.memory.format_size(profile.peak), nagios.memory.format_size(budget)))
+            result = worst_result([result, RESULT_WARNING])
+        if opts.memory_snapshot:
+            profile.write(opts.memory_snapshot, plugin=self.__class__.__name__, argv=list(argv),
+                result=RESULT_NAMES[result])
+        return result
+
+    def __run_history(self, opts, result, trend_thresholds):
+        '''
+        Record the perf data of the run and apply the trend thresholds to the history
+        '''
+        prefix = "%s/%s/" % (self.__class__.__name__, opts.history)
+        self._output.set_history(self._history, prefix)
+        self._output.record_history()
+        if opts.trend is None:
+            return result
+
+        perf_data = self._output.perf_data()
+        label = opts.trend_label or (perf_data[0].label if perf_data else None)
+        if label is None:
+            raise ValueError("No perf data to follow the trend of")
+        series = prefix + label
+        value = self._history.aggregate(series, opts.trend, opts.trend_window)
+        if value is not None:
+            for code, threshold in trend_thresholds:
+                if not threshold.is_allowed(value):
+                    self._output.append_result(
+                        "%s of %s over %ds is %g" % (opts.trend, label, opts.trend_window, value))
+                    result = worst_result([result, code])
+                    break
+            self._output.add_perf_data("%s_%s" % (label, opts.trend.partition(':')[0]), value)
+        return result
+
+    @property
+    def _state(self):
+        '''
+        The state kept for this plugin between runs, opened on first use
+        '''
+        if self.__state is None:
+            # Imported here so that plugins keeping no state don't pay for it at startup
+            import nagios.state
+            store = nagios.state.StateStore(self.STATE_FILE)
+            self.__state = nagios.state.PluginState(store, self.__class__.__name__)
+        return self.__state
+
+    @property
+    def _history(self):
+        '''
+        The history of perf data (see HISTORY), opened on first use
+        '''
+        if self.__history is None:
+            import nagios.tsdb
+            self.__history = nagios.tsdb.TimeSeriesStore(self.HISTORY_PATH)
+        return self.__history
+
+    def _collect_samples(self, opts):
+        samples = Samples()
+        if not opts.concurrent:
+            for i in range(opts.samples):
+                if i and opts.interval:
+                    time.sleep(opts.interval)
+                samples.append(self._sample(opts))
+            return samples
+
+        values = [None] * opts.samples
+        errors = []
+        def take(i):
+            try:
+                values[i] = self._sample(opts)
+            except Exception, e:
+                errors.append(e)
+        threads = [threading.Thread(target=take, args=(i,)) for i in range(opts.samples)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        if errors:
+            raise errors[0]
+        return Samples(values)
+
+    def _run_samples(self, opts):
+        samples = self._collect_samples(opts)
+        value = samples.aggregate(opts.aggregate)
+
+        for name in Samples.AGGREGATES:
+            if name == opts.aggregate:
+                self._output.add_perf_data(name, samples.aggregate(name), self.SAMPLE_UOM,
+                    self._warning, self._critical)
+            else:
+                self._output.add_perf_data(name, samples.aggregate(name), self.SAMPLE_UOM)
+        self._output.add_perf_data('samples', len(samples))
+
+        msg = "%s of %d samples is %g" % (opts.aggregate, len(samples), value)
+        if self._critical is not None and not self._critical.is_allowed(value):
+            raise NagiosCritical(msg)
+        if self._warning is not None and not self._warning.is_allowed(value):
+            raise NagiosWarning(msg)
+        self._output.set_simple_result(msg)
+
+    def _sample(self, opts):
+        '''
+        Implement this method in your plugin if it sets SAMPLING.
+
+        Take one sample and return it as a number. It may be called from several
+        threads at once with --concurrent.
+        '''
+        raise NotImplementedError
 
     def _run(self, opts):
         '''
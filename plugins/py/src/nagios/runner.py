@@ -0,0 +1,133 @@
+'''
+Run plugins in-process and get their results back as objects
+
+PluginBase.__call__ is made to be the whole life of a plugin process: it writes to
+stdout and exits. PluginRunner runs the same code without either, which is what
+tests and anything embedding plugins want, and is fast enough to run thousands of
+cases (see fuzz()).
+
+This source is provided under the MIT License (see LICENSE.txt)
+Copyright (c) 2014 Ryan C. Catherman
+'''
+
+import random
+import StringIO
+import time
+
+import nagios.plugins as plugins
+
+class PluginResult(object):
+    '''
+    What one plugin run reported.
+
+    code: the RESULT_ value the plugin would have exited with
+    simple, long_: the simple and long results (None if the plugin never got that far)
+    multilines: list of the multiline output
+    perf_data: list of nagios.plugins.PerfData
+    output: exactly what the plugin would have displayed
+    seconds: how long the run took
+    '''
+
+    def __init__(self, code, simple=None, long_=None, multilines=None, perf_data=None, output='',
+        seconds=None):
+        self.code = code
+        self.seconds = seconds
+        self.simple = simple
+        self.long = long_
+        self.multilines = multilines or []
+        self.perf_data = perf_data or []
+        self.output = output
+
+    def __repr__(self):
+        return "PluginResult(%d, %r)" % (self.code, self.output)
+
+class PluginRunner(object):
+    '''
+    Run a plugin as many times as needed without exiting or touching stdout.
+
+    factory is called as factory(out_file=...) to create a fresh plugin for every
+    run, so that nothing (thresholds set by -w, for one) leaks from run to run.
+    Usually it is just the PluginBase subclass.
+    '''
+
+    def __init__(self, factory):
+        self.__factory = factory
+
+    def run(self, argv):
+        '''
+        Run the plugin with argv and return a PluginResult. Never raises for
+        anything the plugin does.
+        '''
+        start = time.time()
+        result = self.__run(argv)
+        result.seconds = time.time() - start
+        return result
+
+    def __run(self, argv):
+        out_file = StringIO.StringIO()
+        plugin = self.__factory(out_file=out_file)
+        assert isinstance(plugin, plugins.PluginBase)
+
+        try:
+            code, failure = plugin._execute(argv)
+        except SystemExit, e:
+            # Option parsing: --help, --version and bad options
+            return PluginResult(e.code, output=out_file.getvalue())
+        except Exception, e:
+            failure = "Unexpected failure: %s" % (str(e))
+            code = plugins.RESULT_UNKNOWN
+
+        output = plugin._output
+        if failure is None and output.simple_result() is None:
+            failure = "Result was never set!"
+            code = plugins.RESULT_UNKNOWN
+        if failure is not None:
+            return PluginResult(code, simple=failure, output=failure + "\n")
+
+        return PluginResult(
+            code,
+            simple=output.simple_result(),
+            long_=output.long_result(),
+            multilines=output.multilines(),
+            perf_data=output.perf_data(),
+            output="\n".join(output.lines()) + "\n")
+
+    def run_many(self, argvs):
+        '''
+        Yield a PluginResult for every argv of an iterable
+        '''
+        for argv in argvs:
+            yield self.run(argv)
+
+def random_range(rng=random):
+    '''
+    A random range string, valid or not, built from the pieces the range format
+    (see RangeThreshold) is made of.
+    '''
+    def number():
+        return str(rng.randint(-20, 20))
+
+    invert = '@' if rng.random() < 0.25 else ''
+    if rng.random() < 0.2:
+        return invert + rng.choice(['', number(), '~', 'x'])
+    start = rng.choice(['', '~', number(), number()])
+    end = rng.choice(['', number(), number()])
+    return "%s%s:%s" % (invert, start, end)
+
+def fuzz(runner, make_argv, check, iterations=10000, seed=None):
+    '''
+    Property based testing of a plugin.
+
+    For each iteration, make_argv(rng) builds an argv from a random.Random, the
+    plugin is run with it and check(argv, result) returns True if the result has
+    the expected property. Return the list of (argv, result) that failed the check.
+    '''
+    assert isinstance(runner, PluginRunner)
+    rng = random.Random(seed)
+    failures = []
+    for _ in xrange(iterations):
+        argv = make_argv(rng)
+        result = runner.run(argv)
+        if not check(argv, result):
+            failures.append((argv, result))
+    return failures
@@ -0,0 +1,186 @@
+'''
+Write passive check results into the nagios check result spool directory
+
+Nagios reads every file in its check_result_path named like "cXXXXXX" once a matching
+"cXXXXXX.ok" file exists. Each file can hold many results, so batching them avoids
+pushing every result through the single command pipe (nagios.cmd).
+
+See: check_result_path in http://nagios.sourceforge.net/docs/3_0/configmain.html
+
+This source is provided under the MIT License (see LICENSE.txt)
+Copyright (c) 2014 Ryan C. Catherman
+'''
+
+import os
+import StringIO
+import tempfile
+import threading
+import time
+
+import nagios.plugins as plugins
+
+class CheckResult(object):
+    '''
+    One passive check result. Leave service_description as None for a host result.
+    '''
+
+    def __init__(self, host_name, service_description, return_code, output,
+        start_time=None, finish_time=None):
+        self.host_name = host_name
+        self.service_description = service_description
+        self.return_code = return_code
+        self.output = output
+        self.finish_time = finish_time or time.time()
+        self.start_time = start_time or self.finish_time
+
+    @staticmethod
+    def from_plugin(plugin, argv, host_name, service_description=None):
+        '''
+        Run a PluginBase and capture what it reported.
+
+        The plugin must have been created with a StringIO as its out_file.
+        '''
+        assert isinstance(plugin, plugins.PluginBase)
+        out_file = plugin._output.file()
+        assert isinstance(out_file, StringIO.StringIO), "plugin must write to a StringIO"
+
+        start = time.time()
+        try:
+            plugin(argv)
+            code = plugins.RESULT_UNKNOWN # plugins always exit
+        except SystemExit, e:
+            code = e.code
+        return CheckResult(host_name, service_description, code, out_file.getvalue(),
+            start_time=start, finish_time=time.time())
+
+    @staticmethod
+    def _escape(text):
+        return text.rstrip('\n').replace('\\', '\\\\').replace('\n', '\\n')
+
+    # check_type 1 is passive
+    _RECORD = (
+        "### Nagios %(kind)s Check Result ###\n"
+        "host_name=%(host_name)s\n"
+        "%(service)s"
+        "check_type=1\n"
+        "check_options=0\n"
+        "scheduled_check=0\n"
+        "reschedule_check=0\n"
+        "latency=0.0\n"
+        "start_time=%(start_time)f\n"
+        "finish_time=%(finish_time)f\n"
+        "early_timeout=0\n"
+        "exited_ok=1\n"
+        "return_code=%(return_code)d\n"
+        "output=%(output)s\n"
+        "\n"
+    )
+
+    def spool_record(self):
+        '''
+        The result as a record of a check result file
+        '''
+        is_host = self.service_description is None
+        return self._RECORD % {
+            'kind': "Host" if is_host else "Service",
+            'host_name': self.host_name,
+            'service': "" if is_host else "service_description=%s\n" % self.service_description,
+            'start_time': self.start_time,
+            'finish_time': self.finish_time,
+            'return_code': self.return_code,
+            'output': self._escape(self.output),
+        }
+
+    def command(self):
+        '''
+        The result as an external command line for the command pipe
+        '''
+        if self.service_description is None:
+            return "[%d] PROCESS_HOST_CHECK_RESULT;%s;%d;%s\n" % (
+                self.finish_time, self.host_name, self.return_code, self._escape(self.output))
+        return "[%d] PROCESS_SERVICE_CHECK_RESULT;%s;%s;%d;%s\n" % (
+            self.finish_time, self.host_name, self.service_description, self.return_code,
+            self._escape(self.output))
+
+class SpoolWriter(object):
+    '''
+    Collect CheckResults and write them in batches to a check result directory.
+
+    A batch is written once batch_size results are pending, or flush_interval seconds
+    after the first result of the batch was added, whichever comes first. Each batch
+    file is complete before its ".ok" marker appears, so nagios never reads half a file.
+
+    Use as a context manager (or call close()) so that the last batch gets written.
+    '''
+
+    def __init__(self, directory, batch_size=100, flush_interval=5.0):
+        assert batch_size >= 1
+        assert flush_interval > 0
+        self.__directory = directory
+        self.__batch_size = batch_size
+        self.__flush_interval = flush_interval
+        self.__pending = []
+        self.__lock = threading.RLock()
+        self.__timer = None
+        self.files_written = 0
+        self.results_written = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def add(self, result):
+        assert isinstance(result, CheckResult)
+        with self.__lock:
+            self.__pending.append(result)
+            if len(self.__pending) >= self.__batch_size:
+                self.flush()
+            elif self.__timer is None:
+                self.__timer = threading.Timer(self.__flush_interval, self.flush)
+                self.__timer.daemon = True
+                self.__timer.start()
+
+    def extend(self, results):
+        '''
+        Add every CheckResult of an iterable
+        '''
+        for result in results:
+            self.add(result)
+
+    def flush(self):
+        '''
+        Write whatever is pending now
+        '''
+        with self.__lock:
+            if self.__timer is not None:
+                self.__timer.cancel()
+                self.__timer = None
+            batch, self.__pending = self.__pending, []
+            if batch:
+                self._write_batch(batch)
+
+    def close(self):
+        self.flush()
+
+    def _write_batch(self, batch):
+        # "c" and 6 random characters is the name nagios looks for
+        fd, fname = tempfile.mkstemp(prefix='c', dir=self.__directory)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write("### Active Check Result File ###\n")
+                f.write("file_time=%d\n\n" % time.time())
+                f.write("".join([result.spool_record() for result in batch]))
+            # mkstemp's 0600 would keep a nagios in another group from reading it
+            os.chmod(fname, 0644)
+        except:
+            os.unlink(fname)
+            raise
+
+        # The marker is what makes nagios pick the file up
+        with open(fname + '.ok', 'w'):
+            pass
+
+        self.files_written += 1
+        self.results_written += len(batch)
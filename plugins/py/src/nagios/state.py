@@ -0,0 +1,266 @@
+'''
+Keep small pieces of state between plugin runs, such as the previous sample of a
+counter so that a rate can be computed.
+
+The store is one file of fixed size records in an open addressing hash table, memory
+mapped so that a run only touches the few pages it needs. The cost of a run stays
+the same however many series are stored.
+
+This source is provided under the MIT License (see LICENSE.txt)
+Copyright (c) 2014 Ryan C. Catherman
+'''
+
+import contextlib
+import fcntl
+import hashlib
+import mmap
+import os
+import pwd
+import struct
+import tempfile
+import time
+
+# magic, capacity (records), count (records in use)
+_HEADER = struct.Struct('<8sQQ')
+# md5 of the key, timestamp, value
+_RECORD = struct.Struct('<16sdQ')
+_MAGIC = 'NGSTATE1'
+_EMPTY = '\0' * 16
+
+def default_path():
+    '''
+    A per-user state file in /tmp, the same way mac_to_ip keeps its cache
+    '''
+    return os.path.join('/tmp', "." + pwd.getpwuid(os.getuid()).pw_name + ".nagios.state")
+
+class StateStore(object):
+    '''
+    A persistent map of key to (timestamp, value).
+
+    value is an unsigned 64 bit integer, which is what counters are. Keys are any
+    string; plugins should use PluginState to keep theirs apart.
+
+    Every call locks the store (flock on fname + ".lock"), shared for reading and
+    exclusive for writing, so it is safe for concurrent runs. When the table gets
+    three quarters full it is rebuilt at twice the size and swapped in with a rename;
+    other processes notice the new file on their next call.
+    '''
+
+    LOAD_FACTOR = 0.75
+
+    def __init__(self, fname=None, capacity=4096):
+        assert capacity >= 1
+        self.__fname = fname or default_path()
+        self.__initial_capacity = capacity
+        self.__lock = open(self.__fname + ".lock", 'a')
+        self.__file = None
+        self.__map = None
+        self.__capacity = 0
+
+    def close(self):
+        self.__unmap()
+        self.__lock.close()
+
+    def __unmap(self):
+        if self.__map is not None:
+            self.__map.close()
+            self.__file.close()
+        self.__map = None
+        self.__file = None
+
+    @contextlib.contextmanager
+    def __locked(self, exclusive):
+        fcntl.flock(self.__lock, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            self.__remap()
+            yield
+        finally:
+            fcntl.flock(self.__lock, fcntl.LOCK_UN)
+
+    def __remap(self):
+        '''
+        Map the current file, if it is not the one already mapped
+        '''
+        try:
+            current = os.stat(self.__fname)
+        except OSError:
+            current = None
+
+        if self.__map is not None and current is not None and \
+                (current.st_ino, current.st_dev) == self.__mapped_id:
+            return
+
+        self.__unmap()
+        if current is None or current.st_size < _HEADER.size:
+            # Creating it under a shared lock is fine: the rename is atomic and
+            # whoever renames last just wins with an identical empty table.
+            self.__create(self.__fname, self.__initial_capacity, [])
+
+        self.__file = open(self.__fname, 'r+b')
+        self.__map = mmap.mmap(self.__file.fileno(), 0)
+        stat = os.fstat(self.__file.fileno())
+        self.__mapped_id = (stat.st_ino, stat.st_dev)
+
+        magic, self.__capacity, _ = _HEADER.unpack_from(self.__map, 0)
+        if magic != _MAGIC:
+            raise ValueError("%s is not a state file" % self.__fname)
+
+    @staticmethod
+    def __create(fname, capacity, records):
+        '''
+        Write a new table holding records (as packed bytes) and rename it to fname
+        '''
+        table = bytearray(_HEADER.size + capacity * _RECORD.size)
+        _HEADER.pack_into(table, 0, _MAGIC, capacity, len(records))
+        for record in records:
+            offset = StateStore.__probe(table, capacity, record[:16])[0]
+            table[offset:offset + _RECORD.size] = record
+
+        dirname, basename = os.path.split(os.path.abspath(fname))
+        f = tempfile.NamedTemporaryFile(dir=dirname, prefix="." + basename, delete=False)
+        try:
+            with f:
+                f.write(table)
+            os.rename(f.name, fname)
+        except:
+            os.unlink(f.name)
+            raise
+
+    @staticmethod
+    def __probe(table, capacity, digest):
+        '''
+        Return (offset, found) for the slot of digest: where it is or where it would go
+        '''
+        index = struct.unpack_from('<Q', digest)[0] % capacity
+        for _ in xrange(capacity):
+            offset = _HEADER.size + index * _RECORD.size
+            slot = table[offset:offset + 16]
+            if slot == digest:
+                return offset, True
+            if slot == _EMPTY:
+                return offset, False
+            index = (index + 1) % capacity
+        raise AssertionError("state table is full")
+
+    @staticmethod
+    def _digest(key):
+        return hashlib.md5(key).digest()
+
+    def __get(self, digest):
+        offset, found = self.__probe(self.__map, self.__capacity, digest)
+        if not found:
+            return None
+        return _RECORD.unpack_from(self.__map, offset)[1:]
+
+    def __set(self, digest, timestamp, value):
+        offset, found = self.__probe(self.__map, self.__capacity, digest)
+        if not found:
+            count = _HEADER.unpack_from(self.__map, 0)[2]
+            if count + 1 > self.__capacity * self.LOAD_FACTOR:
+                self.__grow()
+                offset = self.__probe(self.__map, self.__capacity, digest)[0]
+                count = _HEADER.unpack_from(self.__map, 0)[2]
+            _HEADER.pack_into(self.__map, 0, _MAGIC, self.__capacity, count + 1)
+        _RECORD.pack_into(self.__map, offset, digest, timestamp, value)
+
+    def __grow(self):
+        records = []
+        for index in xrange(self.__capacity):
+            offset = _HEADER.size + index * _RECORD.size
+            record = self.__map[offset:offset + _RECORD.size]
+            if record[:16] != _EMPTY:
+                records.append(record)
+        self.__create(self.__fname, self.__capacity * 2, records)
+        self.__remap()
+
+    def __len__(self):
+        with self.__locked(False):
+            return _HEADER.unpack_from(self.__map, 0)[2]
+
+    def get(self, key):
+        '''
+        Return (timestamp, value) stored for key, or None
+        '''
+        with self.__locked(False):
+            return self.__get(self._digest(key))
+
+    def set(self, key, value, timestamp=None):
+        with self.__locked(True):
+            self.__set(self._digest(key), timestamp or time.time(), value)
+
+    def update(self, key, func):
+        '''
+        Atomically replace the entry for key with func(previous), where previous
+        is (timestamp, value) or None. func returns the new (timestamp, value), or
+        None to leave the entry alone. Return what func returned.
+        '''
+        digest = self._digest(key)
+        with self.__locked(True):
+            new = func(self.__get(digest))
+            if new is not None:
+                self.__set(digest, *new)
+            return new
+
+def counter_delta(previous, timestamp, value, wrap=2 ** 32):
+    '''
+    Compare a counter sample with the previous (timestamp, value), or None.
+
+    Return (delta, elapsed seconds), or None when there is no usable previous sample:
+    none at all, no time has passed, or the counter went backwards in a way that
+    looks like a reset rather than a wrap.
+
+    A counter that went backwards is taken to have wrapped at wrap (2**32 or 2**64
+    for the usual SNMP counters) when the previous value was in the top half of its
+    range and the new one is in the bottom half. Anything else is a reset.
+    '''
+    if previous is None:
+        return None
+    last_timestamp, last_value = previous
+    elapsed = timestamp - last_timestamp
+    if elapsed <= 0:
+        return None
+
+    if value >= last_value:
+        return value - last_value, elapsed
+    if wrap and last_value >= wrap // 2 and value < wrap // 2:
+        return wrap - last_value + value, elapsed
+    return None
+
+class PluginState(object):
+    '''
+    The entries of one plugin in a StateStore, keyed by an instance name of the
+    plugin's choosing (an interface, a disk, a host...).
+    '''
+
+    def __init__(self, store, plugin):
+        assert isinstance(store, StateStore)
+        self.__store = store
+        self.__prefix = plugin + "\0"
+
+    def get(self, instance):
+        return self.__store.get(self.__prefix + instance)
+
+    def set(self, instance, value, timestamp=None):
+        self.__store.set(self.__prefix + instance, value, timestamp)
+
+    def counter_delta(self, instance, value, timestamp=None, wrap=2 ** 32):
+        '''
+        Store a new counter sample and return counter_delta() against the previous one
+        '''
+        timestamp = timestamp or time.time()
+        result = []
+        def swap(previous):
+            result.append(counter_delta(previous, timestamp, value, wrap))
+            return timestamp, value
+        self.__store.update(self.__prefix + instance, swap)
+        return result[0]
+
+    def counter_rate(self, instance, value, timestamp=None, wrap=2 ** 32):
+        '''
+        Store a new counter sample and return the change per second since the
+        previous one, or None on the first sample or after a reset.
+        '''
+        delta = self.counter_delta(instance, value, timestamp, wrap)
+        if delta is None:
+            return None
+        return float(delta[0]) / delta[1]
@@ -0,0 +1,188 @@
+'''
+Run several dependent checks as one plugin
+
+A composite check like "host reachable -> port open -> HTTP healthy" is declared as
+SubChecks with dependencies. Sub-checks whose dependencies have passed run in
+parallel, and the dependents of one that failed are skipped instead of being run.
+
+class CheckWeb(SubCheckPlugin):
+    def _subchecks(self, opts):
+        return [
+            SubCheck('reachable', self.ping),
+            SubCheck('port', self.connect, depends=['reachable']),
+            SubCheck('http', self.get, depends=['port']),
+        ]
+
+This source is provided under the MIT License (see LICENSE.txt)
+Copyright (c) 2014 Ryan C. Catherman
+'''
+
+import threading
+import time
+
+import nagios.plugins as plugins
+
+class SubCheck(object):
+    '''
+    One node of a composite check.
+
+    func is called as func(opts) and reports like PluginBase._run does, only for
+    itself: return a message (OK), a (RESULT_, message) tuple, or raise NagiosWarning
+    or NagiosCritical. Any other exception makes it UNKNOWN.
+
+    depends: names of the sub-checks that must pass first. A sub-check fails if it
+    ends CRITICAL or UNKNOWN, or was skipped; a WARNING still lets dependents run.
+    '''
+
+    def __init__(self, name, func, depends=()):
+        self.name = name
+        self.func = func
+        self.depends = list(depends)
+
+class SubCheckResult(object):
+    '''
+    result is None for a sub-check that was skipped
+    '''
+
+    def __init__(self, name, result, message, seconds=None):
+        self.name = name
+        self.result = result
+        self.message = message
+        self.seconds = seconds
+
+    def passed(self):
+        return self.result in (plugins.RESULT_OK, plugins.RESULT_WARNING)
+
+    def summary(self):
+        if self.result is None:
+            return "%s SKIPPED - %s" % (self.name, self.message)
+        text = "%s %s" % (self.name, plugins.RESULT_NAMES[self.result])
+        if self.message:
+            text += " - %s" % self.message
+        return text
+
+    def __str__(self):
+        if self.seconds is None:
+            return self.summary()
+        return "%s (%.3fs)" % (self.summary(), self.seconds)
+
+def _order(subchecks):
+    '''
+    Check the dependencies name existing sub-checks and have no cycle
+    '''
+    by_name = dict((s.name, s) for s in subchecks)
+    if len(by_name) != len(subchecks):
+        raise ValueError("Sub-check names must be unique")
+    for s in subchecks:
+        for name in s.depends:
+            if name not in by_name:
+                raise ValueError("%s depends on unknown sub-check %s" % (s.name, name))
+
+    done = set()
+    remaining = list(subchecks)
+    while remaining:
+        ready = [s for s in remaining if all(d in done for d in s.depends)]
+        if not ready:
+            raise ValueError("Sub-checks depend on each other: %s" % ", ".join(s.name for s in remaining))
+        done.update(s.name for s in ready)
+        remaining = [s for s in remaining if s.name not in done]
+
+def _call(subcheck, opts):
+    start = time.time()
+    try:
+        outcome = subcheck.func(opts)
+        if isinstance(outcome, tuple):
+            result, message = outcome
+        else:
+            result, message = plugins.RESULT_OK, outcome
+    except plugins.NagiosWarning, w:
+        result, message = plugins.RESULT_WARNING, str(w)
+    except plugins.NagiosCritical, c:
+        result, message = plugins.RESULT_CRITICAL, str(c)
+    except Exception, e:
+        result, message = plugins.RESULT_UNKNOWN, "Unexpected failure: %s" % str(e)
+    return SubCheckResult(subcheck.name, result, message, time.time() - start)
+
+def run_subchecks(subchecks, opts):
+    '''
+    Run the sub-checks, each as soon as its dependencies have passed, and return
+    their SubCheckResults in the order they were given.
+    '''
+    _order(subchecks)
+
+    results = {}
+    pending = list(subchecks)
+    running = [0]
+    changed = threading.Condition()
+
+    def run(subcheck):
+        result = _call(subcheck, opts)
+        with changed:
+            results[subcheck.name] = result
+            running[0] -= 1
+            changed.notify()
+
+    with changed:
+        while pending or running[0]:
+            progress = True
+            while progress:
+                progress = False
+                for subcheck in list(pending):
+                    failed = [d for d in subcheck.depends if d in results and not results[d].passed()]
+                    if failed:
+                        results[subcheck.name] = SubCheckResult(
+                            subcheck.name, None, "%s did not pass" % ", ".join(failed))
+                    elif all(d in results for d in subcheck.depends):
+                        running[0] += 1
+                        t = threading.Thread(target=run, args=(subcheck,))
+                        t.daemon = True
+                        t.start()
+                    else:
+                        continue
+                    pending.remove(subcheck)
+                    progress = True
+            if pending or running[0]:
+                changed.wait()
+
+    return [results[s.name] for s in subchecks]
+
+class SubCheckPlugin(plugins.PluginBase):
+    '''
+    A plugin made of SubChecks. Implement _subchecks instead of _run.
+
+    The result is the worst of the sub-checks that ran. The simple result sums them
+    up and names the first problem, the multiline output (-vv) has a line per
+    sub-check, and every sub-check's run time is perf data.
+    '''
+
+    def _subchecks(self, opts):
+        '''
+        Implement this method in your plugin: return the list of SubChecks to run
+        '''
+        raise NotImplementedError
+
+    def _run(self, opts):
+        start = time.time()
+        results = run_subchecks(self._subchecks(opts), opts)
+        elapsed = time.time() - start
+
+        tally = {}
+        for r in results:
+            key = 'SKIPPED' if r.result is None else plugins.RESULT_NAMES[r.result]
+            tally[key] = tally.get(key, 0) + 1
+        summary = ", ".join(
+            "%d %s" % (tally[name], name)
+            for name in ['CRITICAL', 'UNKNOWN', 'WARNING', 'SKIPPED', 'OK'] if name in tally)
+
+        worst = plugins.worst_result(r.result for r in results if r.result is not None)
+        problem = [r for r in results if r.result == worst and worst != plugins.RESULT_OK]
+        if problem:
+            summary = "%s: %s" % (summary, problem[0].summary())
+        self._output.set_simple_result(summary)
+
+        for r in results:
+            self._output.add_multiline(str(r))
+            if r.seconds is not None:
+                self._output.add_perf_data(r.name, round(r.seconds, 6), 's')
+        self._output.add_perf_data('total', round(elapsed, 6), 's')
+        return worst
@@ -0,0 +1,402 @@
+'''
+Keep the history of numeric series (the perf data of past plugin runs) in files, so
+that a plugin can apply its thresholds to a trend, such as how soon a disk will be
+full at the rate it is filling, or to an aggregate over a window rather than to the
+last value alone.
+
+Every series is kept at several levels (LEVELS): every point for two days, then the
+count, sum, min and max of every 5 minutes for five weeks and of every hour for two
+years. A level is a file of fixed size records in time order that is only appended
+to: a point is appended to the raw level and folded into the last record (the
+current bucket) of the others. Once a quarter of a level is past its retention it is
+rewritten without that, so the cost of trimming is spread over many appends.
+
+A range query bisects the records of one level for the start of the range, reading
+one timestamp at a time, then reads the records in the range into arrays: what it
+costs depends on the range, not on how long the series is.
+
+This source is provided under the MIT License (see LICENSE.txt)
+Copyright (c) 2014 Ryan C. Catherman
+'''
+
+import array
+import bisect
+import contextlib
+import errno
+import fcntl
+import glob
+import hashlib
+import os
+import pwd
+import struct
+import tempfile
+import time
+
+# magic, resolution (seconds, 0 for every point), length of the series name that follows
+_HEADER = struct.Struct('<8sII')
+_MAGIC = 'NGTSDB01'
+# timestamp, value
+_POINT = struct.Struct('<dd')
+# bucket start, count, sum, min, max
+_BUCKET = struct.Struct('<ddddd')
+_TIMESTAMP = struct.Struct('<d')
+
+# (resolution, retention) in seconds, from the finest level. Resolution 0 keeps every point.
+LEVELS = [(0, 2 * 86400), (300, 35 * 86400), (3600, 730 * 86400)]
+
+# What Points.aggregate computes. time_to is given a value, as "time_to:100", and slope
+# may be given the seconds it is per, as "slope:3600".
+AGGREGATES = ('mean', 'min', 'max', 'last', 'count', 'slope', 'time_to')
+
+def default_path():
+    '''
+    A per-user directory in /tmp, the same way nagios.state keeps its file
+    '''
+    return os.path.join('/tmp', "." + pwd.getpwuid(os.getuid()).pw_name + ".nagios.tsdb")
+
+def parse_aggregate(name):
+    '''
+    Split an aggregate into its name and argument (a float, or None without one).
+    Raise ValueError for an unknown one.
+    '''
+    text = name
+    name, colon, arg = text.partition(':')
+    if name not in AGGREGATES or (colon and name not in ('time_to', 'slope')) or \
+            (not colon and name == 'time_to'):
+        raise ValueError("Unknown aggregate '%s'" % text)
+    try:
+        arg = float(arg) if colon else None
+    except ValueError:
+        raise ValueError("Unknown aggregate '%s'" % text)
+    if name == 'slope' and arg is not None and arg <= 0:
+        raise ValueError("Unknown aggregate '%s'" % text)
+    return name, arg
+
+class Points(object):
+    '''
+    The points of a series over a time range, as arrays of doubles in time order.
+
+    At a downsampled level (resolution > 0) there is one entry per bucket, the
+    timestamp being its start. For raw points count is 1 and sum, min and max are
+    the value.
+    '''
+
+    def __init__(self, resolution, timestamps, counts, sums, mins, maxs):
+        self.resolution = resolution
+        self.timestamps = timestamps
+        self.counts = counts
+        self.sums = sums
+        self.mins = mins
+        self.maxs = maxs
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def values(self):
+        '''
+        The value of every point (the mean of every bucket)
+        '''
+        return array.array('d', (s / c for s, c in zip(self.sums, self.counts)))
+
+    def fit(self):
+        '''
+        The least squares line through the points, each bucket at its middle and
+        weighted by its count: (slope per second, mean time, mean value), or None
+        without two distinct times.
+        '''
+        middle = self.resolution / 2.0
+        weight = sum(self.counts)
+        if not weight:
+            return None
+        mean_t = sum((t + middle) * c for t, c in zip(self.timestamps, self.counts)) / weight
+        mean_v = sum(self.sums) / weight
+        # Centered, as timestamps squared are past what a double holds exactly
+        stt = svt = 0.0
+        for t, c, s in zip(self.timestamps, self.counts, self.sums):
+            dt = t + middle - mean_t
+            stt += c * dt * dt
+            svt += (s - c * mean_v) * dt
+        if not stt:
+            return None
+        return svt / stt, mean_t, mean_v
+
+    def aggregate(self, name, now=None):
+        '''
+        One of AGGREGATES over the points, None if there are too few for it:
+
+        mean, min, max, count: of all the values
+        last: the last value (the mean of the last bucket)
+        slope, slope:SECONDS: change per second (see fit), or per SECONDS
+        time_to:VALUE: seconds from now until the fitted line reaches VALUE, None if
+            it is moving away from it (or has passed it)
+        '''
+        name, arg = parse_aggregate(name)
+        if not len(self):
+            return None
+        if name == 'mean':
+            return sum(self.sums) / sum(self.counts)
+        if name == 'min':
+            return min(self.mins)
+        if name == 'max':
+            return max(self.maxs)
+        if name == 'last':
+            return self.sums[-1] / self.counts[-1]
+        if name == 'count':
+            return sum(self.counts)
+
+        fit = self.fit()
+        if fit is None:
+            return None
+        slope, mean_t, mean_v = fit
+        if name == 'slope':
+            return slope * (arg or 1)
+        if not slope:
+            return None
+        now = time.time() if now is None else now
+        seconds = (arg - (mean_v + slope * (now - mean_t))) / slope
+        return seconds if seconds >= 0 else None
+
+class _Timestamps(object):
+    '''
+    The timestamps of the records of a level file, read one at a time for bisect
+    '''
+
+    def __init__(self, f, offset, record, count):
+        self.__f = f
+        self.__offset = offset
+        self.__record = record
+        self.__count = count
+
+    def __len__(self):
+        return self.__count
+
+    def __getitem__(self, index):
+        self.__f.seek(self.__offset + index * self.__record.size)
+        return _TIMESTAMP.unpack(self.__f.read(_TIMESTAMP.size))[0]
+
+class _Level(object):
+    '''
+    An open level file of a series
+    '''
+
+    def __init__(self, fname, f, resolution, retention):
+        self.fname = fname
+        self.f = f
+        self.resolution = resolution
+        self.retention = retention
+        self.record = _BUCKET if resolution else _POINT
+
+        header = f.read(_HEADER.size)
+        if len(header) < _HEADER.size:
+            raise ValueError("%s is not a time series file" % fname)
+        magic, stored_resolution, name_size = _HEADER.unpack(header)
+        if magic != _MAGIC or stored_resolution != resolution:
+            raise ValueError("%s is not a time series file" % fname)
+        self.name = f.read(name_size)
+        self.offset = _HEADER.size + name_size
+        f.seek(0, os.SEEK_END)
+        self.count = (f.tell() - self.offset) // self.record.size
+
+    def timestamps(self):
+        return _Timestamps(self.f, self.offset, self.record, self.count)
+
+    def last(self):
+        if not self.count:
+            return None
+        self.f.seek(self.offset + (self.count - 1) * self.record.size)
+        return self.record.unpack(self.f.read(self.record.size))
+
+    def write(self, index, values):
+        self.f.seek(self.offset + index * self.record.size)
+        self.f.write(self.record.pack(*values))
+        self.count = max(self.count, index + 1)
+
+    def read(self, start, end):
+        '''
+        Points of the records from index start up to end
+        '''
+        self.f.seek(self.offset + start * self.record.size)
+        values = array.array('d')
+        values.fromstring(self.f.read((end - start) * self.record.size))
+        if self.resolution:
+            return Points(self.resolution, values[0::5], values[1::5], values[2::5], values[3::5], values[4::5])
+        points = values[1::2]
+        return Points(0, values[0::2], array.array('d', [1.0]) * len(points), points, points, points)
+
+class TimeSeriesStore(object):
+    '''
+    A directory of series, each named by any string (PluginBase uses
+    "plugin/instance/label"), kept at levels, a list of (resolution, retention) as
+    LEVELS is.
+
+    Every series is locked (flock on its ".lock" file) shared for reading and
+    exclusive for appending, so concurrent runs are safe. A point older than the
+    last one of a series is dropped: every level is in time order.
+    '''
+
+    # Share of the retention of a level that may be expired before it is trimmed
+    TRIM_SLACK = 0.25
+
+    def __init__(self, path=None, levels=LEVELS):
+        assert levels
+        assert all(a[0] < b[0] for a, b in zip(levels, levels[1:])), "Levels go from finest to coarsest"
+        self.__path = path or default_path()
+        self.__levels = list(levels)
+        try:
+            os.makedirs(self.__path)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    def __base(self, series):
+        '''
+        The path of the files of series, but for their extension
+        '''
+        return os.path.join(self.__path, hashlib.md5(series).hexdigest())
+
+    @contextlib.contextmanager
+    def __locked(self, series, exclusive):
+        with open(self.__base(series) + ".lock", 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            yield
+
+    def __open(self, series, resolution, retention, create):
+        '''
+        The _Level of series at resolution, None if there is no file and not create
+        '''
+        fname = "%s.%d" % (self.__base(series), resolution)
+        if create and not os.path.exists(fname):
+            # Under the exclusive lock, so nobody else is creating it
+            with open(fname, 'wb') as f:
+                f.write(_HEADER.pack(_MAGIC, resolution, len(series)) + series)
+        try:
+            f = open(fname, 'r+b' if create else 'rb')
+        except IOError, e:
+            if e.errno == errno.ENOENT:
+                return None
+            raise
+        try:
+            return _Level(fname, f, resolution, retention)
+        except:
+            f.close()
+            raise
+
+    @contextlib.contextmanager
+    def __levels_of(self, series, create):
+        levels = []
+        try:
+            for resolution, retention in self.__levels:
+                levels.append(self.__open(series, resolution, retention, create))
+            yield levels
+        finally:
+            for level in levels:
+                if level is not None:
+                    level.f.close()
+
+    def append(self, series, value, timestamp=None):
+        '''
+        Add a point to series. Return False, storing nothing, if it is older than
+        the last one.
+        '''
+        timestamp = time.time() if timestamp is None else timestamp
+        value = float(value)
+        with self.__locked(series, True):
+            with self.__levels_of(series, True) as levels:
+                last = levels[0].last()
+                if last is not None and self.__start(levels[0], timestamp) < last[0]:
+                    return False
+                for level in levels:
+                    self.__append(level, timestamp, value)
+                    self.__trim(level, timestamp)
+        return True
+
+    def append_many(self, points, timestamp=None):
+        '''
+        Add (series, value) points, all at timestamp. Return how many were stored.
+        '''
+        timestamp = time.time() if timestamp is None else timestamp
+        return sum(1 for series, value in points if self.append(series, value, timestamp))
+
+    @staticmethod
+    def __start(level, timestamp):
+        if not level.resolution:
+            return timestamp
+        return timestamp - timestamp % level.resolution
+
+    def __append(self, level, timestamp, value):
+        if not level.resolution:
+            level.write(level.count, (timestamp, value))
+            return
+        start = self.__start(level, timestamp)
+        last = level.last()
+        if last is not None and last[0] == start:
+            _, count, total, low, high = last
+            level.write(level.count - 1, (start, count + 1, total + value, min(low, value), max(high, value)))
+        elif last is None or last[0] < start:
+            level.write(level.count, (start, 1, value, value, value))
+
+    def __trim(self, level, now):
+        '''
+        Rewrite level without what is past its retention, once enough of it is
+        '''
+        oldest = now - level.retention
+        if not level.count or level.timestamps()[0] >= oldest - self.TRIM_SLACK * level.retention:
+            return
+        keep = bisect.bisect_left(level.timestamps(), oldest)
+        level.f.seek(0)
+        header = level.f.read(level.offset)
+        level.f.seek(level.offset + keep * level.record.size)
+        records = level.f.read()
+
+        dirname, basename = os.path.split(level.fname)
+        f = tempfile.NamedTemporaryFile(dir=dirname, prefix="." + basename, delete=False)
+        try:
+            with f:
+                f.write(header)
+                f.write(records)
+            os.rename(f.name, level.fname)
+        except:
+            os.unlink(f.name)
+            raise
+        level.count -= keep
+
+    def points(self, series, start, end=None, resolution=None):
+        '''
+        The Points of series from start to end (now if None), both included, at
+        resolution: by default the finest level whose retention reaches back to start.
+        '''
+        end = time.time() if end is None else end
+        if resolution is None:
+            candidates = [r for r, retention in self.__levels if end - retention <= start]
+            resolution = candidates[0] if candidates else self.__levels[-1][0]
+        retention = dict(self.__levels)[resolution]
+
+        with self.__locked(series, False):
+            level = self.__open(series, resolution, retention, False)
+            if level is None:
+                return Points(resolution, *[array.array('d') for _ in range(5)])
+            try:
+                timestamps = level.timestamps()
+                # A bucket that started before start still holds points from it
+                low = start - start % resolution if resolution else start
+                return level.read(bisect.bisect_left(timestamps, low), bisect.bisect_right(timestamps, end))
+            finally:
+                level.f.close()
+
+    def aggregate(self, series, name, window, now=None):
+        '''
+        An aggregate (see Points.aggregate) of the last window seconds of series
+        '''
+        now = time.time() if now is None else now
+        return self.points(series, now - window, now).aggregate(name, now)
+
+    def series(self):
+        '''
+        The names of the series stored
+        '''
+        names = []
+        resolution, retention = self.__levels[0]
+        for fname in glob.glob(os.path.join(self.__path, "*.%d" % resolution)):
+            with open(fname, 'rb') as f:
+                names.append(_Level(fname, f, resolution, retention).name)
+        return sorted(names)
@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+'''
+Build the vendor index Mac.vendor() (and mac_to_ip -V) looks macs up in.
+
+usage: oui_index [options] REGISTRY...
+
+Every REGISTRY is an IEEE registry file: oui.csv (MA-L), mam.csv (MA-M) and
+oui36.csv (MA-S) from https://regauth.standards.ieee.org, the IEEE oui.txt, or
+arp-scan's ieee-oui.txt. Rebuild it whenever the registries are updated; the index
+is replaced atomically, so running lookups are not disturbed.
+
+This source is provided under the MIT License (see LICENSE.txt)
+Copyright (c) 2014 Ryan C. Catherman
+'''
+
+import optparse
+
+import nagios.oui as oui
+
+def read_registries(fnames):
+    '''
+    The (prefix, organization) pairs of every registry file, in order
+    '''
+    for fname in fnames:
+        with open(fname) as f:
+            for entry in oui.read_registry(f):
+                yield entry
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser(usage="%prog [options] REGISTRY...")
+    parser.add_option(
+        '-o', '--output', dest="output", type="string", default=oui.DEFAULT_PATH,
+        help="The index file to write")
+    opts, args = parser.parse_args()
+    if not args:
+        parser.error("At least one registry file is needed")
+
+    try:
+        oui.compile_index(read_registries(args), opts.output)
+    except (IOError, OSError), e:
+        parser.error(str(e))
+    print "%d prefixes in %s" % (len(oui.OuiIndex(opts.output)), opts.output)
@@ -0,0 +1,29 @@
+'''
+Fixtures shared by the tests
+
+This source is provided under the MIT License (see LICENSE.txt)
+Copyright (c) 2014 Ryan C. Catherman
+'''
+
+import os
+import shutil
+import tempfile
+import unittest
+
+class TempDirTestCase(unittest.TestCase):
+    '''
+    Gives every test an empty directory, self.dir, removed after it. Subclasses
+    calling setUp and tearDown of their own call these too.
+    '''
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def path(self, *names):
+        '''
+        The path of names in self.dir
+        '''
+        return os.path.join(self.dir, *names)
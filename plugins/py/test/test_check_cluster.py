@@ -0,0 +1,193 @@
+#!/usr/bin/env python2.7
+'''
+Test the check_cluster plugin
+
+This source is provided under the MIT License (see LICENSE.txt)
+Copyright (c) 2014 Ryan C. Catherman
+'''
+
+import array
+import StringIO
+import time
+import unittest
+
+import check_cluster
+import fixtures
+import nagios.plugins as plugins
+
+STATUS = '''
+info {
+    created=1412345678
+    }
+
+hoststatus {
+    host_name=web1
+    current_state=0
+    }
+
+servicestatus {
+    host_name=web1
+    service_description=http
+    current_state=0
+    plugin_output=OK
+    }
+
+servicestatus {
+    host_name=web1
+    service_description=disk
+    current_state=1
+    }
+
+servicestatus {
+    host_name=web2
+    service_description=http
+    current_state=2
+    }
+
+programstatus {
+    current_state=2
+    }
+'''
+
+RESULTS = '''[1412345678] PROCESS_SERVICE_CHECK_RESULT;web1;http;0;OK
+[1412345678] PROCESS_SERVICE_CHECK_RESULT;web2;http;2;Down
+[1412345679] PROCESS_SERVICE_CHECK_RESULT;web2;http;0;Back
+[1412345679] PROCESS_HOST_CHECK_RESULT;web3;3;Who knows
+[1412345679] PROCESS_SERVICE_CHECK_RESULT;web3;http;x;not a code
+[1412345679] SCHEDULE_FORCED_SVC_CHECK;web1;http;1412345679
+'''
+
+class TestReaders(unittest.TestCase):
+
+    def testStatusFile(self):
+        children = list(check_cluster.read_status_file(StringIO.StringIO(STATUS)))
+        self.assertEquals([
+            ('web1', None, 0),
+            ('web1', 'http', 0),
+            ('web1', 'disk', 1),
+            ('web2', 'http', 2),
+        ], children)
+
+    def testResults(self):
+        children = list(check_cluster.read_results(StringIO.StringIO(RESULTS)))
+        self.assertEquals([
+            ('web1', 'http', 0),
+            ('web2', 'http', 2),
+            ('web2', 'http', 0),
+            ('web3', None, 3),
+        ], children)
+
+class TestAggregate(unittest.TestCase):
+
+    CHILDREN = [
+        ('a', 's1', 0), ('a', 's2', 0), ('a', 's3', 0), ('a', 's4', 1),
+        ('b', 's1', 2), ('b', 's2', 0),
+        ('c', 's1', 3), ('c', 's2', 1),
+        ('d', 's1', 0),
+    ]
+
+    def testWorst(self):
+        aggregate = check_cluster.Aggregate(self.CHILDREN)
+        results, _ = aggregate.evaluate('worst')
+        self.assertEquals(
+            {'a': plugins.RESULT_WARNING, 'b': plugins.RESULT_CRITICAL,
+             'c': plugins.RESULT_UNKNOWN, 'd': plugins.RESULT_OK},
+            dict(zip(aggregate.names, results)))
+
+    def testCount(self):
+        aggregate = check_cluster.Aggregate(self.CHILDREN)
+        results, values = aggregate.evaluate(
+            'count', plugins.RangeThreshold('0'), plugins.RangeThreshold('1'))
+        self.assertEquals({'a': 1, 'b': 1, 'c': 2, 'd': 0}, dict(zip(aggregate.names, values)))
+        self.assertEquals(
+            {'a': plugins.RESULT_WARNING, 'b': plugins.RESULT_WARNING,
+             'c': plugins.RESULT_CRITICAL, 'd': plugins.RESULT_OK},
+            dict(zip(aggregate.names, results)))
+
+    def testPercent(self):
+        aggregate = check_cluster.Aggregate(self.CHILDREN)
+        results, values = aggregate.evaluate(
+            'percent', plugins.RangeThreshold('25'), plugins.RangeThreshold('50'))
+        self.assertEquals({'a': 25, 'b': 50, 'c': 100, 'd': 0}, dict(zip(aggregate.names, values)))
+        self.assertEquals(
+            {'a': plugins.RESULT_OK, 'b': plugins.RESULT_WARNING,
+             'c': plugins.RESULT_CRITICAL, 'd': plugins.RESULT_OK},
+            dict(zip(aggregate.names, results)))
+
+    def testGroupByService(self):
+        aggregate = check_cluster.Aggregate(self.CHILDREN, group_by='service')
+        results, values = aggregate.evaluate(
+            'count', plugins.RangeThreshold('0'), plugins.RangeThreshold('1'))
+        self.assertEquals({'s1': 2, 's2': 1, 's3': 0, 's4': 1}, dict(zip(aggregate.names, values)))
+
+    def testHostDown(self):
+        children = [('a', None, 1), ('b', None, 2), ('c', None, 0), ('c', 's1', 1), ('d', None, 3)]
+        aggregate = check_cluster.Aggregate(children)
+        results, _ = aggregate.evaluate('worst')
+        self.assertEquals(
+            {'a': plugins.RESULT_CRITICAL, 'b': plugins.RESULT_CRITICAL,
+             'c': plugins.RESULT_WARNING, 'd': plugins.RESULT_UNKNOWN},
+            dict(zip(aggregate.names, results)))
+        self.assertEquals('0 ok, 0 warning, 1 critical, 0 unknown', aggregate.describe(aggregate.names.index('a')))
+
+    def testWorstOfResults(self):
+        self.assertEquals(plugins.RESULT_OK, plugins.worst_result([]))
+        self.assertEquals(plugins.RESULT_UNKNOWN, plugins.worst_result([0, 1, 3]))
+        self.assertEquals(plugins.RESULT_CRITICAL, plugins.worst_result(array.array('B', [3, 2, 1])))
+
+    def testManyGroups(self):
+        '''
+        Thousands of groups should be judged well within a second
+        '''
+        children = [
+            ('host%d' % h, 'svc%d' % s, (h * s) % 4)
+            for h in range(5000) for s in range(20)
+        ]
+        start = time.time()
+        aggregate = check_cluster.Aggregate(children)
+        aggregate.evaluate('percent', plugins.RangeThreshold('10'), plugins.RangeThreshold('50'))
+        self.assertEquals(5000, len(aggregate))
+        self.assertTrue(time.time() - start < 1, time.time() - start)
+
+class TestPlugin(fixtures.TempDirTestCase):
+
+    def setUp(self):
+        super(TestPlugin, self).setUp()
+        self.__status = self.path('status.dat')
+        with open(self.__status, 'w') as f:
+            f.write(STATUS)
+        self.__results = self.path('results')
+        with open(self.__results, 'w') as f:
+            f.write(RESULTS)
+
+    def __run(self, argv):
+        output = StringIO.StringIO()
+        plugin = check_cluster.CheckCluster(output)
+        with self.assertRaises(SystemExit) as e:
+            plugin(['check_cluster'] + argv)
+        return e.exception.code, output.getvalue()
+
+    def testStatusFile(self):
+        code, output = self.__run(['-f', self.__status, '-vv'])
+        self.assertEquals(plugins.RESULT_WARNING, code, output)
+        self.assertTrue(output.startswith('2 host groups by count: 2 WARNING'), output)
+        self.assertTrue('web2 WARNING (0 ok, 0 warning, 1 critical, 0 unknown)' in output, output)
+
+        code, output = self.__run(['-f', self.__status, '-m', 'worst'])
+        self.assertEquals(plugins.RESULT_CRITICAL, code, output)
+        self.assertEquals('2 groups: 1 CRITICAL, 1 WARNING\n', output)
+
+    def testResults(self):
+        code, output = self.__run(['-r', self.__results, '-g', 'service', '-c', '0'])
+        self.assertEquals(plugins.RESULT_OK, code, output)
+
+        code, output = self.__run(['-r', self.__results, '-m', 'worst'])
+        self.assertEquals(plugins.RESULT_UNKNOWN, code, output)
+
+    def testNoSource(self):
+        code, output = self.__run([])
+        self.assertEquals(plugins.RESULT_UNKNOWN, code, output)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -7,9 +7,15 @@ Copyright (c) 2014 Ryan C. Catherman
 '''
 
 import os
+import stat
 import subprocess
+import time
 import unittest
 
+import check_critical
+import fixtures
+import nagios.state as state
+
 class TestCheckCritical(unittest.TestCase):
     '''
     Test the trivial function of check_critical script
@@ -36,6 +42,109 @@ class TestCheckCritical(unittest.TestCase):
         self.assertEquals(0, self.__runCmd(2))
         self.assertEquals(3, self.__runCmd(3))
 
+class TestHedging(fixtures.TempDirTestCase):
+    '''
+    Hedge a stub command whose first copy stalls and later copies are quick
+    '''
+
+    CHECK_CRITICAL_CMD = TestCheckCritical.CHECK_CRITICAL_CMD
+
+    # Each copy takes the next number from the counter file. Copy 0 stalls for
+    # as many seconds as the stall file says, in a child whose pid is in the sleeper file.
+    STUB = '''#!/bin/bash
+n=$(cat "$0.count" 2>/dev/null || echo 0)
+echo $((n + 1)) > "$0.count"
+if [ $n -eq 0 ]; then sleep $(cat "$0.stall") & echo $! > "$0.sleeper"; wait; fi
+echo "copy $n$1"
+exit 2
+'''
+
+    def setUp(self):
+        super(TestHedging, self).setUp()
+        self.__stub = self.path('stub')
+        with open(self.__stub, 'w') as f:
+            f.write(self.STUB)
+        os.chmod(self.__stub, stat.S_IRWXU)
+        self.__history = self.path('history')
+
+    def __run(self, options, stall, suffix=''):
+        if os.path.exists(self.__stub + '.count'):
+            os.unlink(self.__stub + '.count')
+        with open(self.__stub + '.stall', 'w') as f:
+            f.write(str(stall))
+        cmdl = [self.CHECK_CRITICAL_CMD] + options + [self.__stub, suffix]
+        start = time.time()
+        p = subprocess.Popen(cmdl, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, err = p.communicate()
+        return p.returncode, out, time.time() - start
+
+    def testFixedDelay(self):
+        code, out, elapsed = self.__run(['--hedge-after', '0.2'], 3)
+        self.assertEquals(0, code)
+        self.assertTrue(elapsed < 2, elapsed)
+        self.assertTrue(out.startswith('copy 1 | hedges=1 latency='), out)
+        self.assertTrue('hedge_delay=0.2s' in out, out)
+
+    def testLoserKilled(self):
+        '''
+        The copy that lost is killed with what it started
+        '''
+        self.__run(['--hedge-after', '0.2'], 30)
+        with open(self.__stub + '.sleeper') as f:
+            sleeper = int(f.read())
+        time.sleep(0.1)
+        try:
+            with open('/proc/%d/stat' % sleeper) as f:
+                # Killed and waiting to be reaped counts as gone
+                self.assertEquals('Z', f.read().rsplit(')', 1)[1].split()[0])
+        except IOError:
+            pass
+
+    def testNoHedgeNeeded(self):
+        code, out, elapsed = self.__run(['--hedge-after', '1'], 0, '|x=1')
+        self.assertEquals(0, code)
+        self.assertTrue(out.startswith('copy 0|x=1 hedges=0 latency='), out)
+
+    def testMaxHedges(self):
+        # Only copy 0 stalls, so one hedge is all it takes even when more are allowed
+        code, out, elapsed = self.__run(['--hedge-after', '0.1', '--max-hedges', '3'], 3)
+        self.assertTrue(out.startswith('copy 1 | hedges=1'), out)
+
+        # Without hedges allowed, the stalled copy is waited for
+        code, out, elapsed = self.__run(['--hedge-after', '0.1', '--max-hedges', '0'], 1)
+        self.assertTrue(out.startswith('copy 0 | hedges=0'), out)
+        self.assertTrue(elapsed >= 1)
+
+    def testPercentile(self):
+        options = ['--hedge-percentile', '90', '--hedge-after', '0.1', '--history', self.__history]
+        code, out, elapsed = self.__run(options, 3)
+        self.assertTrue('hedge_delay=0.1s' in out, out)
+
+        # Enough quick runs teach it to hedge sooner than the fixed delay
+        for _ in range(check_critical.MIN_HISTORY):
+            self.__run(options, 0)
+        code, out, elapsed = self.__run(options, 3)
+        self.assertTrue(out.startswith('copy 1 | hedges=1'), out)
+        delay = float(out.split('hedge_delay=')[1].split('s')[0])
+        self.assertTrue(delay < 0.1, out)
+
+    def testPercentileOfFirstCopy(self):
+        '''
+        The history keeps how long the first copy took, not the hedge that won
+        '''
+        self.__run(['--hedge-percentile', '90', '--hedge-after', '0.2', '--history', self.__history], 3)
+        history = check_critical.LatencyHistory(state.StateStore(self.__history), [self.__stub, ''])
+        samples = history.samples()
+        self.assertEquals(1, len(samples))
+        self.assertTrue(samples.percentile(100) >= 0.2, samples.percentile(100))
+
+    def testBadOptions(self):
+        for options in [['--hedge-percentile', '0'], ['--hedge-percentile', '101'],
+                ['--hedge-after', '-1'], ['--hedge-after', '1', '--max-hedges', '-1']]:
+            code, out, elapsed = self.__run(options, 0)
+            self.assertEquals(3, code, options)
+            self.assertFalse(os.path.exists(self.__stub + '.count'), options)
+
 
 if __name__ == "__main__":
     unittest.main()
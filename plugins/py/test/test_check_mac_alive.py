@@ -0,0 +1,140 @@
+#!/usr/bin/env python2.7
+'''
+Test the check_mac_alive plugin
+
+This source is provided under the MIT License (see LICENSE.txt)
+Copyright (c) 2014 Ryan C. Catherman
+'''
+
+import os
+import socket
+import stat
+import threading
+import time
+import unittest
+
+import check_mac_alive
+import fixtures
+import mac_to_ip
+import nagios.plugins as plugins
+import nagios.runner as runner
+
+# 01 listens (tcp) and echoes (udp), nothing listens on 02 so it refuses, and 03
+# swallows udp without answering
+STUB = '''#!/bin/bash
+echo "127.0.0.1    00:00:00:00:00:01    Stub"
+echo "127.0.0.2    00:00:00:00:00:02    Stub"
+echo "127.0.0.3    00:00:00:00:00:03    Stub"
+'''
+
+def silent(ip, port):
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    s.bind((ip, port))
+    return s
+
+class CheckMacAliveTests(fixtures.TempDirTestCase):
+
+    def setUp(self):
+        super(CheckMacAliveTests, self).setUp()
+        scanner = self.path('scanner')
+        with open(scanner, 'w') as f:
+            f.write(STUB)
+        os.chmod(scanner, stat.S_IRWXU)
+        self.cache_file = self.path('cache')
+
+        class Plugin(check_mac_alive.CheckMacAlive):
+            def _cache(self, opts):
+                return mac_to_ip.MacLookupCache(opts.cache, scanner=[scanner])
+        self.runner = runner.PluginRunner(Plugin)
+
+        self.tcp = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.tcp.bind(('127.0.0.1', 0))
+        self.tcp.listen(16)
+        self.port = self.tcp.getsockname()[1]
+
+        self.udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.udp.bind(('127.0.0.1', self.port))
+        self.udp.settimeout(0.1)
+        self.stop = threading.Event()
+        def echo():
+            while not self.stop.is_set():
+                try:
+                    data, address = self.udp.recvfrom(512)
+                except socket.timeout:
+                    continue
+                self.udp.sendto(data, address)
+        self.echo = threading.Thread(target=echo)
+        self.echo.start()
+        self.silent = [silent('127.0.0.3', self.port)]
+
+    def tearDown(self):
+        self.stop.set()
+        self.echo.join()
+        self.udp.close()
+        self.tcp.close()
+        for s in self.silent:
+            s.close()
+        super(CheckMacAliveTests, self).tearDown()
+
+    def run_check(self, *args):
+        return self.runner.run([
+            'check_mac_alive', '--cache', self.cache_file, '-p', str(self.port), '-t', '0.5'] + list(args))
+
+    def testAllUp(self):
+        for protocol in ['tcp', 'udp']:
+            result = self.run_check('-P', protocol, '-m', '000000000001,00:00:00:00:00:02')
+            self.assertEquals(plugins.RESULT_OK, result.code, result.output)
+            self.assertEquals("2 of 2 hosts up", result.simple)
+            self.assertEquals(
+                ['00:00:00:00:00:01', '00:00:00:00:00:02', 'up', 'down', 'not_found'],
+                [p.label for p in result.perf_data])
+            self.assertTrue(all(p.value < 0.5 for p in result.perf_data[:2]))
+            self.assertTrue(result.multilines[0].startswith('00:00:00:00:00:01 127.0.0.1 UP'))
+
+    def testDownAndNotFound(self):
+        start = time.time()
+        result = self.run_check(
+            '-P', 'udp', '-m', '000000000001', '-m', '000000000003', '-m', '0000000000ff', '-c', '1')
+        self.assertTrue(time.time() - start < 2)
+        self.assertEquals(plugins.RESULT_CRITICAL, result.code, result.output)
+        self.assertEquals("1 of 3 hosts up, not up: 00:00:00:00:00:03, 00:00:00:00:00:ff", result.simple)
+        self.assertEquals('00:00:00:00:00:03 127.0.0.3 DOWN (timed out)', result.multilines[1])
+        self.assertEquals('00:00:00:00:00:ff NOT FOUND', result.multilines[2])
+        self.assertEquals([1, 1, 1], [p.value for p in result.perf_data[1:]])
+
+        result = self.run_check('-m', '000000000001', '-m', '0000000000ff')
+        self.assertEquals(plugins.RESULT_WARNING, result.code)
+
+    def testOneScan(self):
+        cache = mac_to_ip.MacLookupCache(self.cache_file, scanner=[self.path('scanner')])
+        found = cache.lookup_many([mac_to_ip.Mac('000000000001'), mac_to_ip.Mac('000000000002'),
+            mac_to_ip.Mac('0000000000ff')])
+        self.assertEquals({
+            mac_to_ip.Mac('000000000001'): '127.0.0.1',
+            mac_to_ip.Mac('000000000002'): '127.0.0.2',
+        }, found)
+        self.assertEquals({'hits': 2, 'misses': 1, 'negative_hits': 0, 'scans': 1}, cache.stats)
+
+        # Fresh, and the missing one is backing off
+        cache.lookup_many([mac_to_ip.Mac('000000000001'), mac_to_ip.Mac('0000000000ff')])
+        self.assertEquals({'hits': 3, 'misses': 1, 'negative_hits': 1, 'scans': 1}, cache.stats)
+
+    def testMany(self):
+        '''
+        Hosts are probed at once: a whole subnet of them that never answer
+        takes one timeout, not one each
+        '''
+        ips = ['127.0.1.%d' % i for i in range(1, 255)]
+        self.silent.extend(silent(ip, self.port) for ip in ips)
+        start = time.time()
+        results = check_mac_alive.probe(ips + ['127.0.0.1'], self.port, 0.5, 'udp')
+        self.assertTrue(time.time() - start < 1.5)
+        self.assertEquals(255, len(results))
+        self.assertEquals(check_mac_alive.UP, results['127.0.0.1'][0])
+        self.assertEquals([(check_mac_alive.DOWN, "timed out")] * 254, [results[ip] for ip in ips])
+
+    def testNoMacs(self):
+        self.assertEquals(plugins.RESULT_UNKNOWN, self.run_check().code)
+
+if __name__ == "__main__":
+    unittest.main()
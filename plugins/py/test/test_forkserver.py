@@ -0,0 +1,167 @@
+#!/usr/bin/env python2.7
+'''
+Test the fork server and its client
+
+This source is provided under the MIT License (see LICENSE.txt)
+Copyright (c) 2014 Ryan C. Catherman
+'''
+
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+import unittest
+
+import check_random
+import fixtures
+import nagios.forkclient as forkclient
+import nagios.forkserver as forkserver
+import nagios.plugins as plugins
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'src')
+
+class SleepPlugin(plugins.PluginBase):
+    '''
+    Writes its pid to --pid-file and sleeps for --seconds
+    '''
+
+    def __init__(self, out_file=sys.stdout):
+        super(SleepPlugin, self).__init__(out_file)
+        self._parser.add_option('--seconds', dest="seconds", type="float", default=0)
+        self._parser.add_option('--pid-file', dest="pid_file", type="string", default=None)
+        self._parser.add_option('--code', dest="code", type="int", default=0)
+        self._parser.add_option('--die', dest="die", action="store_true", default=False)
+
+    def _run(self, opts):
+        if opts.pid_file:
+            with open(opts.pid_file, 'w') as f:
+                f.write(str(os.getpid()))
+        if opts.die:
+            os.kill(os.getpid(), signal.SIGKILL)
+        time.sleep(opts.seconds)
+        self._output.set_simple_result("slept %s" % opts.seconds)
+        return opts.code
+
+class ForkServerTests(fixtures.TempDirTestCase):
+
+    def setUp(self):
+        super(ForkServerTests, self).setUp()
+        self.socket_path = self.path('socket')
+        registry = {'check_random': check_random.CheckRandom, 'sleep': SleepPlugin}
+        server = forkserver.ForkServer(self.socket_path, registry)
+        server.listen()
+        self.server_pid = os.fork()
+        if self.server_pid == 0:
+            try:
+                signal.signal(signal.SIGTERM, lambda signum, frame: server.stop())
+                server.serve_forever()
+            finally:
+                os._exit(0)
+
+    def tearDown(self):
+        os.kill(self.server_pid, signal.SIGTERM)
+        os.waitpid(self.server_pid, 0)
+        super(ForkServerTests, self).tearDown()
+
+    def client(self, *argv):
+        p = subprocess.Popen(
+            [sys.executable, os.path.join(SRC, 'fork_client.py'), self.socket_path] + list(argv),
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, err = p.communicate()
+        return p.returncode, out
+
+    def testRun(self):
+        code, out = self.client('check_random', '--min', '5', '--max', '5')
+        self.assertEquals(plugins.RESULT_OK, code)
+        self.assertEquals("value is 5\n", out)
+
+        code, out = self.client('check_random', '--min', '5', '--max', '5', '-c', '0:4')
+        self.assertEquals(plugins.RESULT_CRITICAL, code)
+        self.assertEquals("value is 5\n", out)
+
+        code, out = self.client('/usr/lib/nagios/plugins/sleep.py', '--code', '1')
+        self.assertEquals(plugins.RESULT_WARNING, code)
+        self.assertEquals("slept 0\n", out)
+
+    def testBadOptions(self):
+        code, out = self.client('check_random', '--nope')
+        self.assertEquals(plugins.RESULT_UNKNOWN, code)
+        self.assertTrue('--nope' in out)
+
+    def testUnknownPlugin(self):
+        code, out = self.client('check_other')
+        self.assertEquals(plugins.RESULT_UNKNOWN, code)
+        self.assertEquals("No plugin registered for check_other\n", out)
+
+    def testReseeded(self):
+        outs = set(self.client('check_random', '--min', '0', '--max', '1000000000')[1] for _ in range(3))
+        self.assertEquals(3, len(outs))
+
+    def testKilled(self):
+        code, out = self.client('sleep', '--die')
+        self.assertEquals(plugins.RESULT_UNKNOWN, code)
+        self.assertEquals("Plugin killed by signal %d\n" % signal.SIGKILL, out)
+
+    def testConcurrent(self):
+        start = time.time()
+        clients = [
+            subprocess.Popen(
+                [sys.executable, os.path.join(SRC, 'fork_client.py'), self.socket_path, 'sleep', '--seconds', '0.5'],
+                stdout=subprocess.PIPE)
+            for _ in range(8)
+        ]
+        for p in clients:
+            self.assertEquals("slept 0.5\n", p.communicate()[0])
+        self.assertTrue(time.time() - start < 3)
+
+    def testClientGone(self):
+        pid_file = self.path('pid')
+        p = subprocess.Popen(
+            [sys.executable, os.path.join(SRC, 'fork_client.py'), self.socket_path,
+                'sleep', '--seconds', '30', '--pid-file', pid_file])
+        for _ in range(1000):
+            if os.path.exists(pid_file) and open(pid_file).read():
+                break
+            time.sleep(0.01)
+        p.kill()
+        p.wait()
+
+        child = int(open(pid_file).read())
+        for _ in range(200):
+            try:
+                os.kill(child, 0)
+            except OSError:
+                break
+            time.sleep(0.01)
+        else:
+            self.fail("The plugin of a client that went away is still running")
+
+    def testNoServer(self):
+        # Falls back to running the plugin script itself
+        self.socket_path = self.path('nothing')
+        code, out = self.client('check_random', '--min', '7', '--max', '7')
+        self.assertEquals(plugins.RESULT_OK, code)
+        self.assertEquals("value is 7\n", out)
+
+    def testRequest(self):
+        r, w = os.pipe()
+        a, b = socket.socketpair()
+        try:
+            forkclient.send_request(a, ['x', 'with space', '', 'new\nline'], fds=(r, w, w))
+            fds, argv = forkclient.receive_request(b)
+            self.assertEquals(['x', 'with space', '', 'new\nline'], argv)
+            self.assertEquals(3, len(fds))
+            os.write(fds[1], 'hello')
+            self.assertEquals('hello', os.read(r, 5))
+            for fd in fds:
+                os.close(fd)
+        finally:
+            a.close()
+            b.close()
+            os.close(r)
+            os.close(w)
+
+if __name__ == "__main__":
+    unittest.main()
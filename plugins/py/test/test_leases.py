@@ -0,0 +1,269 @@
+#!/usr/bin/env python2.7
+'''
+Test the nagios.leases module
+
+This source is provided under the MIT License (see LICENSE.txt)
+Copyright (c) 2014 Ryan C. Catherman
+'''
+
+import json
+import os
+import time
+import unittest
+
+import fixtures
+import nagios.leases as leases
+
+NOW = 1400000000
+
+def ip(i):
+    return "10.%d.%d.%d" % (i / 65536 % 256, i / 256 % 256, i % 256)
+
+def mac(i):
+    return "%012x" % (0x020000000000 + i)
+
+def display(mac):
+    return ":".join(mac[i:i + 2] for i in range(0, 12, 2))
+
+def isc_block(i, mac_index=None, state='active', ends=NOW + 3600):
+    '''
+    A dhcpd.leases block for ip(i), bound to mac(mac_index or i)
+    '''
+    ends = time.strftime("%w %Y/%m/%d %H:%M:%S", time.gmtime(ends))
+    return (
+        "lease %s {\n"
+        "  starts 4 2014/05/01 10:00:00;\n"
+        "  ends %s;\n"
+        "  cltt 4 2014/05/01 10:00:00;\n"
+        "  binding state %s;\n"
+        "  next binding state free;\n"
+        "  rewind binding state free;\n"
+        "  hardware ethernet %s;\n"
+        "  uid \"\\001\\002\\000\\000\\000\\000\\001\";\n"
+        "  client-hostname \"host%d\";\n"
+        "}\n") % (ip(i), ends, state, display(mac(i if mac_index is None else mac_index)), i)
+
+def dnsmasq_line(i, expiry=NOW + 3600):
+    return "%d %s %s host%d 01:%s\n" % (expiry, display(mac(i)), ip(i), i, display(mac(i)))
+
+class LeaseFileTestCase(fixtures.TempDirTestCase):
+
+    COUNT = 20000
+
+    def setUp(self):
+        super(LeaseFileTestCase, self).setUp()
+        self.fname = self.path('leases')
+
+    def write(self, data, mode='w'):
+        with open(self.fname, mode) as f:
+            f.write(data)
+
+class TestIsc(LeaseFileTestCase):
+
+    def setUp(self):
+        super(TestIsc, self).setUp()
+        self.write(
+            "# The format of this file is documented in the dhcpd.leases(5) manual page.\n"
+            "authoring-byte-order little-endian;\n\n" +
+            "".join(isc_block(i) for i in range(self.COUNT)))
+
+    def testParse(self):
+        lease_file = leases.LeaseFile(self.fname)
+        self.assertEquals(os.path.getsize(self.fname), lease_file.update())
+        macs = leases.active(lease_file.leases(), NOW)
+        self.assertEquals(self.COUNT, len(macs))
+        self.assertEquals(ip(12345), macs[mac(12345)])
+        self.assertEquals((mac(7), NOW + 3600), lease_file.leases()[ip(7)])
+
+        # Unchanged
+        self.assertEquals(0, lease_file.update())
+        self.assertEquals({}, leases.active(lease_file.leases(), NOW + 3600))
+
+    def testAppended(self):
+        lease_file = leases.LeaseFile(self.fname)
+        lease_file.update()
+
+        # Renewed, moved to another ip, released
+        appended = isc_block(1, ends=NOW + 7200) + isc_block(self.COUNT, mac_index=2) + isc_block(3, state='free')
+        self.write(appended, 'a')
+        self.assertEquals(len(appended), lease_file.update())
+        self.assertEquals((mac(1), NOW + 7200), lease_file.leases()[ip(1)])
+        self.assertFalse(ip(3) in lease_file.leases())
+
+        macs = leases.active(lease_file.leases(), NOW)
+        self.assertFalse(mac(3) in macs)
+        self.assertEquals(self.COUNT - 1, len(macs))
+        self.assertEquals(ip(1), leases.active(lease_file.leases(), NOW + 3600)[mac(1)])
+
+        # Both leases of mac(2) end together: either ip will do
+        self.assertTrue(macs[mac(2)] in (ip(2), ip(self.COUNT)))
+        self.write(isc_block(self.COUNT, mac_index=2, ends=NOW + 7200), 'a')
+        lease_file.update()
+        self.assertEquals(ip(self.COUNT), leases.active(lease_file.leases(), NOW)[mac(2)])
+
+    def testPartialBlock(self):
+        lease_file = leases.LeaseFile(self.fname)
+        lease_file.update()
+
+        block = isc_block(self.COUNT)
+        self.write(block[:40], 'a')
+        self.assertEquals(40, lease_file.update())
+        self.assertFalse(ip(self.COUNT) in lease_file.leases())
+
+        # The rest of the block: parsed from where the last complete block ended
+        self.write(block[40:], 'a')
+        self.assertEquals(len(block), lease_file.update())
+        self.assertEquals(mac(self.COUNT), lease_file.leases()[ip(self.COUNT)][0])
+
+    def testRewritten(self):
+        lease_file = leases.LeaseFile(self.fname)
+        lease_file.update()
+
+        # dhcpd writes a new file and renames it over the old one
+        rewritten = self.path('leases~')
+        with open(rewritten, 'w') as f:
+            f.write("".join(isc_block(i) for i in range(10, 20)))
+        os.rename(rewritten, self.fname)
+        self.assertEquals(os.path.getsize(self.fname), lease_file.update())
+        self.assertEquals(10, len(lease_file.leases()))
+
+        # Shorter in place
+        self.write(isc_block(5))
+        lease_file.update()
+        self.assertEquals([ip(5)], lease_file.leases().keys())
+
+        # Longer in place, the blocks already parsed changed
+        self.write(isc_block(6) + isc_block(7))
+        self.assertEquals(os.path.getsize(self.fname), lease_file.update())
+        self.assertEquals(sorted([ip(6), ip(7)]), sorted(lease_file.leases().keys()))
+
+        os.unlink(self.fname)
+        self.assertEquals(0, lease_file.update())
+        self.assertEquals({}, lease_file.leases())
+
+    def testEnds(self):
+        self.write(
+            isc_block(1).replace("ends", "ends never;\n  old-ends") +
+            isc_block(2).replace(
+                time.strftime("%w %Y/%m/%d %H:%M:%S", time.gmtime(NOW + 3600)), "epoch %d" % (NOW + 60)))
+        lease_file = leases.LeaseFile(self.fname)
+        lease_file.update()
+        self.assertEquals(None, lease_file.leases()[ip(1)][1])
+        self.assertEquals(NOW + 60, lease_file.leases()[ip(2)][1])
+        self.assertEquals({mac(1): ip(1)}, leases.active(lease_file.leases(), NOW + 60))
+
+    def testIncrementalCost(self):
+        '''
+        An update after a few blocks are appended costs far less than parsing the file
+        '''
+        lease_file = leases.LeaseFile(self.fname)
+        start = time.time()
+        lease_file.update()
+        full = time.time() - start
+
+        start = time.time()
+        for i in range(10):
+            self.write(isc_block(self.COUNT + i), 'a')
+            self.assertEquals(len(isc_block(self.COUNT + i)), lease_file.update())
+        self.assertTrue(time.time() - start < full / 2 + 0.01)
+
+class TestDnsmasq(LeaseFileTestCase):
+
+    def setUp(self):
+        super(TestDnsmasq, self).setUp()
+        self.write("".join(dnsmasq_line(i) for i in range(self.COUNT)))
+
+    def testParse(self):
+        self.write(
+            "0 %s 10.255.0.1 * *\n" % display(mac(self.COUNT)) +
+            "%d %s 10.255.0.2 * *\n" % (NOW - 1, display(mac(self.COUNT + 1))) +
+            "duid 00:01:00:01:1a:2b:3c:4d:00:11:22:33:44:55\n"
+            "%d 12345678 2001:db8::5 host *\n" % (NOW + 60) +
+            "%d 20:00:00:00:00:00:00:00:00:01 10.255.0.3 ib *\n" % (NOW + 60), 'a')
+        lease_file = leases.LeaseFile(self.fname)
+        lease_file.update()
+        self.assertEquals(self.COUNT + 2, len(lease_file.leases()))
+        macs = leases.active(lease_file.leases(), NOW)
+        self.assertEquals(self.COUNT + 1, len(macs))
+        self.assertEquals('10.255.0.1', macs[mac(self.COUNT)])
+        self.assertEquals(ip(19999), macs[mac(19999)])
+        self.assertEquals(0, lease_file.update())
+
+    def testRewritten(self):
+        lease_file = leases.LeaseFile(self.fname)
+        lease_file.update()
+
+        # dnsmasq rewrites the file in place: a renewal of the same length is seen too
+        data = "".join(dnsmasq_line(i) for i in range(self.COUNT))
+        self.write(data.replace(dnsmasq_line(5), dnsmasq_line(5, NOW - 1)))
+        os.utime(self.fname, (NOW, NOW))
+        self.assertEquals(len(data), lease_file.update())
+        self.assertFalse(mac(5) in leases.active(lease_file.leases(), NOW))
+        self.assertEquals(self.COUNT, len(lease_file.leases()))
+
+        self.write(dnsmasq_line(1))
+        lease_file.update()
+        self.assertEquals({mac(1): ip(1)}, leases.active(lease_file.leases(), NOW))
+
+class TestLeases(LeaseFileTestCase):
+
+    def testStateFile(self):
+        isc = self.path('dhcpd.leases')
+        with open(isc, 'w') as f:
+            f.write("".join(isc_block(i) for i in range(self.COUNT)))
+        self.write("".join(dnsmasq_line(i) for i in range(self.COUNT, self.COUNT + 100)))
+        state_file = self.path('state')
+
+        both = leases.Leases([isc, self.fname], state_file)
+        self.assertTrue(both.update(NOW) > 0)
+        self.assertEquals(self.COUNT + 100, len(both.macs(NOW)))
+
+        # Carries on where the last run was
+        both = leases.Leases([isc, self.fname], state_file)
+        self.assertEquals(self.COUNT + 100, len(both.macs(NOW)))
+        self.assertEquals(0, both.update(NOW))
+        with open(isc, 'a') as f:
+            f.write(isc_block(self.COUNT + 100))
+        self.assertEquals(len(isc_block(self.COUNT + 100)), both.update(NOW))
+        self.assertEquals(ip(self.COUNT + 100), both.macs(NOW)[mac(self.COUNT + 100)])
+
+        # A file added later is parsed in full, a broken state file starts over
+        other = self.path('other')
+        with open(other, 'w') as f:
+            f.write(dnsmasq_line(self.COUNT + 200))
+        self.assertEquals(len(dnsmasq_line(self.COUNT + 200)),
+            leases.Leases([isc, self.fname, other], state_file).update(NOW))
+        with open(state_file, 'w') as f:
+            f.write("{")
+        both = leases.Leases([isc, self.fname], state_file)
+        self.assertEquals({}, both.macs(NOW))
+        self.assertEquals(os.path.getsize(isc) + os.path.getsize(self.fname), both.update(NOW))
+        self.assertEquals(self.COUNT + 101, len(both.macs(NOW)))
+
+    def testStateSaved(self):
+        '''
+        The state is only rewritten when a lease or an offset changed, without the
+        leases that ended
+        '''
+        data = "".join(dnsmasq_line(i) for i in range(10)) + "".join(dnsmasq_line(i, NOW + 60) for i in range(10, 20))
+        self.write(data)
+        state_file = self.path('state')
+        lease_set = leases.Leases([self.fname], state_file)
+        lease_set.update(NOW)
+        self.assertEquals(20, len(lease_set.macs(NOW)))
+
+        # Rewritten the same: parsed, but nothing to save
+        os.utime(state_file, (NOW, NOW))
+        self.write(data)
+        os.utime(self.fname, (NOW + 120, NOW + 120))
+        self.assertEquals(len(data), lease_set.update(NOW + 120))
+        self.assertEquals(NOW, os.path.getmtime(state_file))
+
+        self.write(data + dnsmasq_line(20))
+        lease_set.update(NOW + 120)
+        with open(state_file) as f:
+            self.assertEquals(11, len(json.load(f)[self.fname]['leases']))
+        self.assertEquals(11, len(leases.Leases([self.fname], state_file).macs(NOW + 120)))
+
+if __name__ == "__main__":
+    unittest.main()
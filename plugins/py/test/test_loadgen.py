@@ -0,0 +1,137 @@
+#!/usr/bin/env python2.7
+'''
+Test the load generator
+
+This source is provided under the MIT License (see LICENSE.txt)
+Copyright (c) 2014 Ryan C. Catherman
+'''
+
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+import unittest
+
+import check_random
+import fixtures
+import nagios.loadgen as loadgen
+import nagios.plugins as plugins
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'src')
+
+REGISTRY = {'check_random': check_random.CheckRandom}
+
+class SlowTarget(object):
+    '''
+    Takes seconds for every check, one at a time
+    '''
+
+    name = 'slow'
+    children = False
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.calls = []
+
+    def start(self):
+        self.calls.append('start')
+
+    def stop(self):
+        self.calls.append('stop')
+
+    def run(self, argv):
+        time.sleep(self.seconds)
+        return plugins.RESULT_OK
+
+class MixTests(unittest.TestCase):
+
+    def testFromStrings(self):
+        mix = loadgen.Mix.from_strings(["3:check_random -x 50", "check_random", "0.5:check_random -n 5"])
+        self.assertEquals(
+            [['check_random', '-x', '50'], ['check_random'], ['check_random', '-n', '5']], mix.argvs())
+        for bad in ["0:check_random", "x:check_random", "2:", ""]:
+            self.assertRaises(ValueError, loadgen.Mix.from_strings, [bad])
+
+    def testChoose(self):
+        mix = loadgen.Mix([(3, ['a']), (1, ['b'])])
+        rng = random.Random(7)
+        chosen = [mix.choose(rng)[0] for _ in range(4000)]
+        self.assertTrue(2800 < chosen.count('a') < 3200)
+
+    def testResultsMix(self):
+        mix = loadgen.results_mix({plugins.RESULT_OK: 1, plugins.RESULT_WARNING: 1,
+            plugins.RESULT_CRITICAL: 1, plugins.RESULT_UNKNOWN: 1})
+        target = loadgen.RunnerTarget(REGISTRY)
+        self.assertEquals([0, 1, 2, 3], [target.run(argv) for argv in mix.argvs()])
+
+class GenerateTests(unittest.TestCase):
+
+    def testRate(self):
+        mix = loadgen.results_mix({plugins.RESULT_OK: 3, plugins.RESULT_CRITICAL: 1})
+        report = loadgen.generate(loadgen.RunnerTarget(REGISTRY), mix, 1, rate=200, seed=3)
+        self.assertEquals('runner', report['target'])
+        self.assertEquals(200, report['checks'])
+        self.assertTrue(180 < report['throughput'] <= 200, report)
+        self.assertEquals(200, report['codes']['OK'] + report['codes']['CRITICAL'])
+        self.assertTrue(report['codes']['CRITICAL'] > 20, report)
+        self.assertTrue(report['latency_ms']['p50'] <= report['latency_ms']['p99'] <= report['latency_ms']['max'])
+        self.assertEquals(0, report['child_rss_kb'])
+        self.assertFalse(report['child_rss_upper_bound'])
+        self.assertTrue(report['rss_kb'] > 0)
+        # A report is plain values
+        self.assertEquals(report, json.loads(json.dumps(report)))
+
+    def testSaturated(self):
+        '''
+        A target that cannot keep up falls behind the schedule, which shows in the
+        latency and the throughput
+        '''
+        target = SlowTarget(0.05)
+        report = loadgen.generate(target, loadgen.Mix([(1, ['x'])]), 1, rate=100, concurrency=1)
+        self.assertEquals(['start', 'stop'], target.calls)
+        self.assertTrue(report['throughput'] < 25, report)
+        self.assertTrue(report['latency_ms']['max'] > 500, report)
+        self.assertTrue(report['service_ms']['p99'] < 100, report)
+
+    def testClosedLoop(self):
+        report = loadgen.generate(SlowTarget(0.05), loadgen.Mix([(1, ['x'])]), 0.5, concurrency=4)
+        self.assertTrue(30 <= report['checks'] <= 44, report)
+        self.assertTrue(report['latency_ms']['p50'] < 100, report)
+
+    def testProcesses(self):
+        mix = loadgen.results_mix({plugins.RESULT_OK: 1, plugins.RESULT_WARNING: 1})
+        for target in [loadgen.ExecTarget(), loadgen.ForkTarget(REGISTRY)]:
+            report = loadgen.generate(target, mix, 1, rate=10, concurrency=4)
+            self.assertEquals(10, report['checks'], report)
+            self.assertEquals(10, report['codes']['OK'] + report['codes']['WARNING'], report)
+            self.assertTrue(report['child_rss_kb'] > 0, report)
+            self.assertTrue(report['cpu_seconds'] > 0, report)
+
+class CommandLineTests(fixtures.TempDirTestCase):
+
+    def testReport(self):
+        output = self.path('reports')
+        out = subprocess.check_output([
+            sys.executable, os.path.join(SRC, 'loadgen.py'), '-r', '20', '-d', '0.5',
+            '--results', 'ok:1,unknown:1', '-o', output, 'runner', 'fork'])
+        lines = out.splitlines()
+        self.assertEquals(3, len(lines))
+        self.assertTrue(lines[1].startswith('runner'))
+        self.assertTrue(lines[2].startswith('fork'))
+
+        reports = [json.loads(line) for line in open(output)]
+        self.assertEquals(['runner', 'fork'], [r['target'] for r in reports])
+        self.assertEquals(2, len(reports[0]['mix']))
+        self.assertEquals(10, sum(reports[1]['codes'].values()))
+
+    def testBadResults(self):
+        p = subprocess.Popen(
+            [sys.executable, os.path.join(SRC, 'loadgen.py'), '--results', 'fine:1'],
+            stderr=subprocess.PIPE)
+        self.assertTrue("Unknown result 'fine'" in p.communicate()[1])
+        self.assertEquals(2, p.returncode)
+
+if __name__ == "__main__":
+    unittest.main()
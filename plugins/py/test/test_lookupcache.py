@@ -0,0 +1,269 @@
+#!/usr/bin/env python2.7
+'''
+Test the shared lookup cache
+
+This source is provided under the MIT License (see LICENSE.txt)
+Copyright (c) 2014 Ryan C. Catherman
+'''
+
+import time
+import unittest
+
+import fixtures
+import nagios.lookupcache as lookupcache
+
+class FakeClock(object):
+    '''
+    Stands in for the time module in nagios.lookupcache
+    '''
+
+    def __init__(self, now):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+class Resolver(object):
+    '''
+    A fetch that answers from names, counting the calls
+    '''
+
+    def __init__(self, names, seconds=0):
+        self.names = names
+        self.seconds = seconds
+        self.calls = []
+
+    def __call__(self, keys):
+        self.calls.append(sorted(keys))
+        if self.seconds:
+            time.sleep(self.seconds)
+        if self.names is None:
+            raise Exception("Resolver is down")
+        return dict((k, self.names[k]) for k in keys if k in self.names)
+
+class LookupCacheTests(fixtures.TempDirTestCase):
+
+    def setUp(self):
+        super(LookupCacheTests, self).setUp()
+        self.fname = self.path('cache')
+        self.clock = FakeClock(time.time())
+        lookupcache.time = self.clock
+        self.resolver = Resolver({'a': '10.0.0.1', 'b': '10.0.0.2', 'c': '10.0.0.3'})
+
+    def tearDown(self):
+        lookupcache.time = time
+        super(LookupCacheTests, self).tearDown()
+
+    def cache(self, fetch=None, **kwargs):
+        return lookupcache.LookupCache(self.fname, fetch or self.resolver, **kwargs)
+
+    def testBulk(self):
+        cache = self.cache(ttl=60)
+        self.assertEquals({'a': '10.0.0.1', 'b': '10.0.0.2'}, cache.lookup_many(['a', 'b', 'x']))
+        self.assertEquals([['a', 'b', 'x']], self.resolver.calls)
+
+        # Fresh, and x is backing off: no fetch at all
+        self.assertEquals({'a': '10.0.0.1'}, cache.lookup_many(['a', 'x']))
+        self.assertEquals('10.0.0.2', cache.lookup('b'))
+        self.assertRaises(KeyError, cache.lookup, 'x')
+        self.assertEquals(1, len(self.resolver.calls))
+        self.assertEquals({'hits': 4, 'misses': 1, 'negative_hits': 2, 'fetches': 1}, cache.stats)
+
+        # Only what is missing is fetched, and merged with what is there
+        self.assertEquals('10.0.0.3', cache.lookup('c'))
+        self.assertEquals(['c'], self.resolver.calls[-1])
+        self.assertEquals({'a': '10.0.0.1', 'b': '10.0.0.2', 'c': '10.0.0.3'}, cache.read())
+
+    def testTtl(self):
+        cache = self.cache(ttl=60)
+        cache.lookup('a')
+        self.clock.now += 59
+        cache.lookup('a')
+        self.assertEquals(1, len(self.resolver.calls))
+
+        self.resolver.names['a'] = '10.0.0.9'
+        self.clock.now += 1
+        self.assertEquals('10.0.0.9', cache.lookup('a'))
+        self.assertEquals(1, cache.read_history()['a']['changes'])
+
+        # Or per lookup
+        self.assertEquals('10.0.0.9', cache.lookup('a', ttl=0))
+        self.assertEquals(3, len(self.resolver.calls))
+
+    def testGone(self):
+        '''
+        A key the fetch no longer knows is dropped, not answered stale
+        '''
+        cache = self.cache(ttl=60)
+        cache.lookup_many(['a', 'b'])
+        del self.resolver.names['a']
+        self.clock.now += 61
+        self.assertEquals({'b': '10.0.0.2'}, cache.lookup_many(['a', 'b']))
+        self.assertEquals({'b': '10.0.0.2'}, cache.read())
+
+    def testComplete(self):
+        sweeps = []
+        def sweep(keys):
+            sweeps.append(keys)
+            return {'a': 1, 'b': 2} if len(sweeps) == 1 else {'b': 3, 'c': 4}
+        cache = self.cache(sweep, complete=True, ttl=60)
+        self.assertEquals(2, cache.lookup('b'))
+        self.assertEquals(1, cache.lookup('a'))
+        self.clock.now += 61
+        self.assertEquals({'b': 3}, cache.lookup_many(['a', 'b']))
+        self.assertEquals({'b': 3, 'c': 4}, cache.read())
+
+        cache.refresh()
+        self.assertEquals(3, len(sweeps))
+
+    def testFailedFetch(self):
+        cache = self.cache(ttl=60)
+        cache.lookup('a')
+        self.resolver.names = None
+        self.clock.now += 61
+        self.assertRaises(Exception, cache.lookup, 'a')
+        self.assertEquals({'a': '10.0.0.1'}, cache.read())
+
+    def testShared(self):
+        self.cache(ttl=60).lookup_many(['a', 'b'])
+        other = self.cache(Resolver({}), ttl=60)
+        self.assertEquals({'a': '10.0.0.1', 'b': '10.0.0.2'}, other.lookup_many(['a', 'b']))
+        self.assertEquals(0, other.stats['fetches'])
+
+    def testAdaptive(self):
+        cache = self.cache(ttl=60, max_ttl=3600)
+        entry = {'value': 'x', 'first': 0, 'checked': 10000, 'changes': 1}
+        self.assertEquals(1000, cache.entry_ttl(entry, 60))
+        self.assertEquals(60, self.cache(ttl=60).entry_ttl(entry, 60))
+
+        cache.lookup('a')
+        self.clock.now += 10000
+        cache.lookup('a')
+        self.clock.now += 1000
+        # Unchanged for 10000s, trusted for 2000
+        cache.lookup('a')
+        self.assertEquals(2, len(self.resolver.calls))
+
+    def testLru(self):
+        names = dict(('k%d' % i, i) for i in range(10))
+        cache = self.cache(Resolver(names), ttl=3600, max_entries=4)
+        for i in range(4):
+            self.clock.now += 1
+            cache.lookup('k%d' % i)
+        # k0 is used again, so k1 is the least recently used
+        self.clock.now += 1
+        cache.lookup('k0')
+        self.clock.now += 1
+        cache.lookup('k4')
+        self.assertEquals(['k0', 'k2', 'k3', 'k4'], sorted(cache.read()))
+        self.assertEquals(['k0', 'k2', 'k3', 'k4'], sorted(cache.read_history()))
+        self.assertEquals(1, cache.statistics()['evictions'])
+
+        # One bulk lookup bigger than the bound keeps the most recently fetched
+        self.clock.now += 1
+        self.assertEquals(6, len(cache.lookup_many(['k%d' % i for i in range(4, 10)])))
+        self.assertEquals(4, len(cache.read()))
+
+    def testLruShared(self):
+        '''
+        A key another process used is not evicted for one it only fetched
+        '''
+        names = dict(('k%d' % i, i) for i in range(10))
+        first = self.cache(Resolver(names), ttl=3600, max_entries=4)
+        for i in range(4):
+            self.clock.now += 1
+            first.lookup('k%d' % i)
+
+        self.clock.now += lookupcache.LookupCache.USED_RESOLUTION
+        other = self.cache(Resolver({}), ttl=3600, max_entries=4)
+        self.assertEquals(0, other.lookup('k0'))
+        self.assertEquals(0, other.stats['fetches'])
+
+        self.clock.now += 1
+        self.cache(Resolver(names), ttl=3600, max_entries=4).lookup('k4')
+        self.assertEquals(['k0', 'k2', 'k3', 'k4'], sorted(first.read()))
+        self.assertEquals(['k0', 'k2', 'k3', 'k4'], sorted(first.read_history()))
+
+    def testStatistics(self):
+        lookupcache.time = time
+        cache = self.cache(Resolver(self.resolver.names, seconds=0.05), ttl=60)
+        self.assertEquals(None, cache.statistics()['hit_ratio'])
+        cache.lookup_many(['a', 'b'])
+        cache.lookup_many(['a', 'b'])
+        cache.lookup_many(['a', 'b'])
+        statistics = cache.statistics()
+        self.assertEquals(6, statistics['lookups'])
+        self.assertAlmostEqual(4 / 6.0, statistics['hit_ratio'])
+        self.assertEquals(1, statistics['fetches'])
+        self.assertTrue(0.05 <= statistics['fetch_seconds_mean'] == statistics['fetch_seconds_max'] < 0.5)
+
+    def testProbe(self):
+        probes = []
+        def probe(keys):
+            probes.append(sorted(keys))
+            if 'c' in keys:
+                raise Exception("No route to c")
+            return dict((k, 'probed ' + k) for k in keys if k != 'b')
+        cache = self.cache(lambda keys: dict(self.resolver.names), complete=True, ttl=60)
+        cache._probe = probe
+
+        # refresh does not probe
+        cache.refresh()
+        self.clock.now += 61
+        self.assertEquals('probed a', cache.lookup('a'))
+        # Merged, not a sweep
+        self.assertEquals({'a': 'probed a', 'b': '10.0.0.2', 'c': '10.0.0.3'}, cache.read())
+
+        # Not all found, or the probe failed: the complete fetch runs
+        self.clock.now += 61
+        self.assertEquals({'a': '10.0.0.1', 'b': '10.0.0.2'}, cache.lookup_many(['a', 'b']))
+        self.clock.now += 61
+        self.assertEquals('10.0.0.3', cache.lookup('c'))
+        self.assertEquals([['a'], ['a', 'b'], ['c']], probes)
+
+        statistics = cache.statistics()
+        self.assertEquals((3, 3, 1), (statistics['fetches'], statistics['probes'], statistics['probes_found']))
+
+    def testBetween(self):
+        cache = self.cache(lambda keys: dict(self.resolver.names), complete=True, ttl=60)
+        cache.lookup('a')
+        self.assertEquals([('b', '10.0.0.2'), ('c', '10.0.0.3')], list(cache._between('b', 'z')))
+        self.assertEquals([], list(cache._between('d', 'z')))
+
+class SqliteLookupCacheTests(LookupCacheTests):
+
+    def cache(self, fetch=None, **kwargs):
+        return lookupcache.SqliteLookupCache(self.fname, fetch=fetch or self.resolver, **kwargs)
+
+    def testValues(self):
+        cache = self.cache(lambda keys: {'a': {'ifIndex': [1, 2]}, 'b': 2.5}, complete=True)
+        self.assertEquals({'ifIndex': [1, 2]}, cache.lookup('a'))
+        self.assertEquals(2.5, self.cache(Resolver({})).lookup('b'))
+
+    def testChangedRows(self):
+        '''
+        Writing the history or the negative entries only writes the rows that changed
+        '''
+        names = dict(('k%d' % i, i) for i in range(1000))
+        cache = self.cache(Resolver(names), ttl=3600)
+        cache.lookup_many(sorted(names) + ['x', 'y'])
+        db = cache._SqliteLookupCache__db
+
+        history = cache.read_history()
+        history['k1']['used'] = self.clock.now
+        del history['k2']
+        changes = db.total_changes
+        cache.write_history(history)
+        self.assertEquals(2, db.total_changes - changes)
+        self.assertEquals(history, self.cache().read_history())
+
+        negative = cache.read_negative()
+        del negative['x']
+        changes = db.total_changes
+        cache.write_negative(negative)
+        cache.write_negative(negative)
+        self.assertEquals(1, db.total_changes - changes)
+        self.assertEquals(['y'], self.cache().read_negative().keys())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -7,11 +7,18 @@ Copyright (c) 2014 Ryan C. Catherman
 '''
 
 import os
+import stat
 import subprocess
+import sys
 import tempfile
+import threading
+import time
 import unittest
 
+import fixtures
 import mac_to_ip
+import nagios.leases as leases
+import nagios.lookupcache as lookupcache
 
 class TestCheckCritical(unittest.TestCase):
     '''
@@ -65,6 +72,39 @@ class TestMac(unittest.TestCase):
         self.assertEquals(mac_to_ip.Mac('001122334455'), mac_to_ip.Mac('001122334455'))
         self.assertNotEquals(mac_to_ip.Mac('aa1122334455'), mac_to_ip.Mac('001122334455'))
 
+    def testValue(self):
+        self.assertEquals(0x001122334455, mac_to_ip.Mac('00:11:22:33:44:55').value())
+        self.assertEquals(0xffffffffffff, mac_to_ip.Mac('ff:ff:ff:ff:ff:ff').value())
+
+class TestMacPattern(unittest.TestCase):
+
+    def parse(self, pattern):
+        p = mac_to_ip.MacPattern.from_string(pattern)
+        return p.value, p.mask
+
+    def testParse(self):
+        self.assertEquals((0x001122000000, 0xffffff000000), self.parse('00:11:22'))
+        self.assertEquals((0x001122a00000, 0xfffffff00000), self.parse('00-11-22-a'))
+        self.assertEquals((0x001122a00000, 0xfffffff00000), self.parse('00:11:22:af/28'))
+        self.assertEquals((0x001122000001, 0xffffff0000ff), self.parse('00:11:22:*:*:01'))
+        self.assertEquals((0x001122000001, 0xffffff0000ff), self.parse('00:11:22:33:44:01/ff:ff:ff:00:00:ff'))
+        self.assertEquals((0, 0), self.parse('00/0'))
+        for bad in ['', '00:11:*', '00:11:22:33:44:55:66', '0011/49', 'xx:11', '00:11/ff:ff']:
+            with self.assertRaises(ValueError):
+                mac_to_ip.MacPattern.from_string(bad)
+
+    def testRange(self):
+        pattern = mac_to_ip.MacPattern.from_string('00:11:22:*:*:01')
+        self.assertEquals((0x001122000000, 0x001122ffffff), pattern.range())
+        self.assertTrue(pattern.matches(0x001122abcd01))
+        self.assertFalse(pattern.matches(0x001122abcd02))
+        self.assertFalse(pattern.matches(0x001123000001))
+
+        # Nothing leading: the whole range is filtered
+        pattern = mac_to_ip.MacPattern.from_string('*:*:*:*:*:01')
+        self.assertEquals((0, 0xffffffffffff), pattern.range())
+        self.assertEquals('00:00:00:00:00:01/00:00:00:00:00:ff', str(pattern))
+
 class TestIsIp(unittest.TestCase):
 
     def testMe(self):
@@ -130,6 +170,654 @@ Ending arp-scan 1.8.1: 256 hosts scanned in 1.441 seconds (177.65 hosts/sec). 22
         self.assertFalse(parsed.has_key('a002dcb3f9e6'))
 
 
+class StubScannerTestCase(fixtures.TempDirTestCase):
+    '''
+    Drive the cache with a stub scanner instead of arp-scan
+    '''
+
+    # Answers for the interface given with -I. "bad" fails and "slow" hangs. "lan" answers
+    # from the file lan next to the scanner, for the hosts given or all of it, and
+    # appends the arguments to calls.
+    STUB = '''#!/bin/bash
+case "$2" in
+    eth0) echo "10.0.0.1    00:00:00:00:00:01    Stub";;
+    eth1) echo "10.1.0.1    00:00:00:00:01:01    Stub"; echo "10.1.0.2    00:00:00:00:01:02    Stub";;
+    bad) exit 1;;
+    slow) sleep 1; echo "10.2.0.1    00:00:00:00:02:01    Stub";;
+    file) cat "$3";;
+    lan) shift 2; echo "$*" >> "$(dirname "$0")/calls"
+        case "$1" in
+            -l|*/*) cat "$(dirname "$0")/lan";;
+            *) for ip in "$@"; do awk -v ip="$ip" '$1 == ip' "$(dirname "$0")/lan"; done;;
+        esac;;
+esac
+'''
+
+    def setUp(self):
+        super(StubScannerTestCase, self).setUp()
+        self.scanner = self.path('scanner')
+        with open(self.scanner, 'w') as f:
+            f.write(self.STUB)
+        os.chmod(self.scanner, stat.S_IRWXU)
+        self.cache_file = self.path('cache')
+
+    def cache(self, targets, **kwargs):
+        return mac_to_ip.MacLookupCache(
+            self.cache_file, targets=targets, scanner=[self.scanner], **kwargs)
+
+class TestScanTargets(StubScannerTestCase):
+
+    def testTargetArgs(self):
+        self.assertEquals(['-l'], mac_to_ip.ScanTarget().args())
+        self.assertEquals(['-I', 'eth0', '10.0.0.0/24'],
+            mac_to_ip.ScanTarget('eth0', '10.0.0.0/24').args())
+
+        target = mac_to_ip.ScanTarget.from_string('eth1,,5')
+        self.assertEquals(['-I', 'eth1', '-l'], target.args())
+        self.assertEquals(5, target.timeout)
+
+        with self.assertRaises(ValueError):
+            mac_to_ip.ScanTarget.from_string('eth0,10.0.0.0/24,5,x')
+
+    def testProbeArgs(self):
+        target = mac_to_ip.ScanTarget('eth0', '10.0.0.0/22', timeout=5)
+        probe = target.probe(['10.0.1.1', '10.0.1.2'])
+        self.assertEquals(['-I', 'eth0', '10.0.1.1', '10.0.1.2'], probe.args())
+        self.assertEquals(5, probe.timeout)
+        self.assertEquals('eth0:10.0.1.1,10.0.1.2', str(probe))
+
+        self.assertTrue(target.contains('10.0.3.255'))
+        self.assertFalse(target.contains('10.0.4.0'))
+        self.assertEquals(None, mac_to_ip.ScanTarget('eth0').contains('10.0.0.1'))
+        self.assertTrue(mac_to_ip.ScanTarget(network='10.0.0.9').contains('10.0.0.9'))
+
+        self.assertEquals(['10.0.0.255', '10.0.1.0', '10.0.1.1'], mac_to_ip.neighbours('10.0.1.0', 1))
+        self.assertEquals(['10.0.0.5'], mac_to_ip.neighbours('10.0.0.5', 0))
+
+    def testMerge(self):
+        cache = self.cache([
+            mac_to_ip.ScanTarget('eth0'),
+            mac_to_ip.ScanTarget('eth1'),
+        ])
+        self.assertEquals('10.0.0.1', cache.lookup(mac_to_ip.Mac('000000000001')))
+        self.assertEquals('10.1.0.2', cache.lookup(mac_to_ip.Mac('000000000102')))
+        self.assertEquals([], cache.failures)
+
+    def testFailedSegmentKeepsOthers(self):
+        cache = self.cache([
+            mac_to_ip.ScanTarget('bad'),
+            mac_to_ip.ScanTarget('eth1'),
+            mac_to_ip.ScanTarget('slow', timeout=0.2),
+        ])
+        self.assertEquals('10.1.0.1', cache.lookup(mac_to_ip.Mac('000000000101')))
+        self.assertEquals(
+            ['bad', 'slow'], sorted(t.interface for t, _ in cache.failures))
+        self.assertEquals('10.1.0.1', cache.read()['000000000101'])
+
+    def testFailedSegmentKeepsCached(self):
+        self.cache([
+            mac_to_ip.ScanTarget('eth0', '10.0.0.0/24'),
+            mac_to_ip.ScanTarget('eth1', '10.1.0.0/24'),
+        ]).lookup(mac_to_ip.Mac('000000000001'))
+
+        cache = self.cache([
+            mac_to_ip.ScanTarget('bad', '10.0.0.0/24'),
+            mac_to_ip.ScanTarget('eth1', '10.1.0.0/24'),
+        ])
+        self.assertRaises(KeyError, cache.lookup, mac_to_ip.Mac('000000000001'), 0)
+        self.assertEquals(1, len(cache.failures))
+        self.assertEquals(
+            {'000000000001': '10.0.0.1', '000000000101': '10.1.0.1', '000000000102': '10.1.0.2'}, cache.read())
+        self.assertEquals({}, cache.read_negative())
+
+        # A mac of a segment that worked is still backed off
+        self.assertRaises(KeyError, cache.lookup, mac_to_ip.Mac('000000000103'), 0)
+        self.assertEquals(['000000000103'], cache.read_negative().keys())
+
+    def testAllFailed(self):
+        cache = self.cache([mac_to_ip.ScanTarget('bad')])
+        with self.assertRaises(Exception):
+            cache.lookup(mac_to_ip.Mac('000000000001'))
+
+    def testParallel(self):
+        '''
+        Four slow segments with room for all of them should take about as
+        long as one.
+        '''
+        targets = [mac_to_ip.ScanTarget('slow') for _ in range(4)]
+
+        start = time.time()
+        self.cache(targets, max_parallel=4).lookup(mac_to_ip.Mac('000000000201'))
+        self.assertTrue(time.time() - start < 3)
+
+        os.unlink(self.cache_file)
+        start = time.time()
+        self.cache(targets, max_parallel=2).lookup(mac_to_ip.Mac('000000000201'))
+        self.assertTrue(time.time() - start >= 2)
+
+class TestNegativeCache(StubScannerTestCase):
+
+    MISSING = mac_to_ip.Mac('0000000000ff')
+
+    def testBackoff(self):
+        cache = self.cache([mac_to_ip.ScanTarget('eth0')], negative_ttl=60, max_backoff=200)
+
+        with self.assertRaises(KeyError):
+            cache.lookup(self.MISSING)
+        self.assertEquals(1, cache.stats['scans'])
+        self.assertEquals(1, cache.stats['misses'])
+
+        # Inside the backoff window there is no scan, even with a fresh reading due
+        with self.assertRaises(KeyError):
+            cache.lookup(self.MISSING, freshness=0)
+        self.assertEquals(1, cache.stats['scans'])
+        self.assertEquals(1, cache.stats['negative_hits'])
+
+        # Shared with other processes through the file
+        entry = cache.read_negative()[self.MISSING.simple()]
+        self.assertEquals(1, entry['misses'])
+        self.assertTrue(55 < entry['until'] - time.time() <= 60)
+
+        # Expire the window: the next miss scans and doubles the backoff
+        entry['until'] = time.time() - 1
+        cache.write_negative({self.MISSING.simple(): entry})
+        cache = self.cache([mac_to_ip.ScanTarget('eth0')], negative_ttl=60, max_backoff=200)
+        with self.assertRaises(KeyError):
+            cache.lookup(self.MISSING)
+        self.assertEquals(1, cache.stats['scans'])
+        entry = cache.read_negative()[self.MISSING.simple()]
+        self.assertEquals(2, entry['misses'])
+        self.assertTrue(115 < entry['until'] - time.time() <= 120)
+
+        # ...and is capped
+        for expected in [200, 200]:
+            entry['until'] = time.time() - 1
+            cache.write_negative({self.MISSING.simple(): entry})
+            cache = self.cache([mac_to_ip.ScanTarget('eth0')], negative_ttl=60, max_backoff=200)
+            with self.assertRaises(KeyError):
+                cache.lookup(self.MISSING)
+            entry = cache.read_negative()[self.MISSING.simple()]
+            self.assertTrue(expected - 5 < entry['until'] - time.time() <= expected)
+
+    def testFoundClearsNegative(self):
+        present = mac_to_ip.Mac('000000000001')
+        cache = self.cache([mac_to_ip.ScanTarget('eth0')])
+        cache.write_negative({present.simple(): {'misses': 3, 'until': time.time() - 1}})
+
+        self.assertEquals('10.0.0.1', cache.lookup(present))
+        self.assertEquals({}, cache.read_negative())
+        self.assertEquals(1, cache.stats['hits'])
+
+        self.assertEquals('10.0.0.1', cache.lookup(present))
+        self.assertEquals(2, cache.stats['hits'])
+        self.assertEquals(1, cache.stats['scans'])
+
+    def testCorruptNegativeFile(self):
+        with open(self.cache_file + '.negative', 'w') as f:
+            f.write('{"truncat')
+        cache = self.cache([mac_to_ip.ScanTarget('eth0')])
+        self.assertEquals({}, cache.read_negative())
+
+    def testUnreadableCacheFile(self):
+        with open(self.cache_file, 'w') as f:
+            f.write('{"0000000')
+        self.assertEquals(None, self.cache([]).read())
+
+class FakeClock(object):
+    '''
+    Stands in for the time module in mac_to_ip
+    '''
+
+    def __init__(self, now):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+class TestAdaptiveFreshness(StubScannerTestCase):
+
+    STABLE = ['00000000000a', '00000000000b']
+    CHURNY = '00000000000c'
+
+    def setUp(self):
+        super(TestAdaptiveFreshness, self).setUp()
+        self.answers = self.path('answers')
+        self.clock = FakeClock(time.time())
+        mac_to_ip.time = lookupcache.time = self.clock
+
+    def tearDown(self):
+        mac_to_ip.time = lookupcache.time = time
+        super(TestAdaptiveFreshness, self).tearDown()
+
+    def scan_finds(self, table):
+        with open(self.answers, 'w') as f:
+            for mac, ip in table.items():
+                f.write("%s    %s    Stub\n" % (ip, mac_to_ip.Mac(mac)))
+
+    def cache(self, **kwargs):
+        return super(TestAdaptiveFreshness, self).cache(
+            [mac_to_ip.ScanTarget('file', self.answers)], **kwargs)
+
+    def testHistory(self):
+        cache = self.cache(max_freshness=3600)
+        start = self.clock.now
+        self.scan_finds({self.CHURNY: '10.0.0.1'})
+        self.assertEquals('10.0.0.1', cache.lookup(mac_to_ip.Mac(self.CHURNY), freshness=60))
+
+        self.clock.now += 100
+        self.scan_finds({self.CHURNY: '10.0.0.2'})
+        self.assertEquals('10.0.0.2', cache.lookup(mac_to_ip.Mac(self.CHURNY), freshness=60))
+        self.assertEquals(
+            {'value': '10.0.0.2', 'first': start, 'checked': start + 100, 'changes': 1, 'used': start},
+            cache.read_history()[self.CHURNY])
+
+        # Never less than asked for, adapted in between, never more than the maximum
+        entry = {'value': '10.0.0.2', 'first': 0, 'checked': 500, 'changes': 1}
+        self.assertEquals(60, cache.entry_ttl(entry, 60))
+        entry['checked'] = 10000
+        self.assertEquals(1000, cache.entry_ttl(entry, 60))
+        entry['changes'] = 0
+        self.assertEquals(2000, cache.entry_ttl(entry, 60))
+        entry['checked'] = 100000
+        self.assertEquals(3600, cache.entry_ttl(entry, 60))
+        self.assertEquals(60, self.cache().entry_ttl(entry, 60))
+
+    def replay(self, cache):
+        '''
+        Twelve hours of a poller looking up two macs that never move every minute,
+        and every half hour one whose ip changes every quarter of an hour. Return
+        the number of lookups that answered an ip the mac no longer had.
+        '''
+        stale = 0
+        for minute in range(12 * 60):
+            truth = dict((mac, '10.0.0.%d' % (i + 1)) for i, mac in enumerate(self.STABLE))
+            truth[self.CHURNY] = '10.0.1.%d' % (minute / 15)
+            self.scan_finds(truth)
+
+            asked = list(self.STABLE)
+            if minute % 30 == 0:
+                asked.append(self.CHURNY)
+            for mac in asked:
+                if cache.lookup(mac_to_ip.Mac(mac), freshness=300) != truth[mac]:
+                    stale += 1
+            self.clock.now += 60
+        return stale
+
+    def testReplayedTrace(self):
+        fixed = self.cache()
+        fixed_stale = self.replay(fixed)
+
+        for name in ['', '.history']:
+            os.unlink(self.cache_file + name)
+        self.clock.now = time.time()
+        adaptive = self.cache(max_freshness=3600)
+        adaptive_stale = self.replay(adaptive)
+
+        self.assertEquals(fixed.stats['hits'], adaptive.stats['hits'])
+        self.assertTrue(adaptive.stats['scans'] * 2 < fixed.stats['scans'])
+        # The moving mac is still trusted for no longer than freshness, so it is only
+        # stale when it moved within that long of a scan, as much as with a fixed freshness
+        self.assertTrue(adaptive_stale <= fixed_stale + 2)
+
+class TestQuery(StubScannerTestCase):
+
+    def setUp(self):
+        super(TestQuery, self).setUp()
+        answers = self.path('answers')
+        self.table = {}
+        with open(answers, 'w') as f:
+            for i in range(3000):
+                mac = mac_to_ip.Mac("%012x" % ((i % 3) << 40 | (i * 7919) & 0xffffff | (i % 5) << 24))
+                ip = "10.%d.%d.%d" % (i / 65536, i / 256 % 256, i % 256)
+                self.table[mac] = ip
+                f.write("%s    %s    Stub\n" % (ip, mac))
+        self.target = mac_to_ip.ScanTarget('file', answers)
+
+    def expected(self, pattern):
+        return sorted((m, ip) for m, ip in self.table.items() if pattern.matches(m.value()))
+
+    def testQuery(self):
+        cache = self.cache([self.target])
+        self.assertEquals([], list(cache.query(mac_to_ip.MacPattern.from_string('00'))))
+
+        # Scans first, when asked for fresh results
+        for text in ['01', '01:00:00', '02:00:04:*:*:9e', '*:*:*:00:00:*', '00/8', '01:00:00:00:00:00/ff:00:01:00:00:01']:
+            pattern = mac_to_ip.MacPattern.from_string(text)
+            found = list(cache.query(pattern, freshness=3600))
+            self.assertEquals(self.expected(pattern), found, text)
+            self.assertTrue(found, text)
+        self.assertEquals(1, cache.stats['scans'])
+        self.assertEquals(1000, len(list(cache.query(mac_to_ip.MacPattern.from_string('02')))))
+
+    def testCommandLine(self):
+        self.cache([self.target]).lookup(self.table.keys()[0])
+        args = [sys.executable, os.path.join(os.path.dirname(__file__), os.pardir, 'src', 'mac_to_ip.py'),
+            '--cache', self.cache_file, '-f', '3600']
+        if isinstance(self.cache([]), mac_to_ip.SqliteMacLookupCache):
+            args.append('--sqlite')
+
+        pattern = mac_to_ip.MacPattern.from_string('02:00:04')
+        self.assertEquals(
+            "".join("%s %s\n" % found for found in self.expected(pattern)),
+            subprocess.check_output(args + ['-q', '02:00:04']))
+        self.assertEquals("notfound\n", subprocess.check_output(args + ['-q', '03']))
+
+        # Bad arguments still exit 0 with "failed" (check_output raises otherwise)
+        with open(os.devnull, 'w') as devnull:
+            for bad in [['-p', 'x', '00:11:22:33:44:55'], ['--no-such-option'], []]:
+                self.assertEquals("failed\n", subprocess.check_output(args + bad, stderr=devnull))
+
+    def testVendorIndexUnreadable(self):
+        mac = self.table.keys()[0]
+        self.cache([self.target]).lookup(mac)
+        corrupt = self.path('corrupt.index')
+        with open(corrupt, 'w') as f:
+            f.write('not an index')
+        args = [sys.executable, os.path.join(os.path.dirname(__file__), os.pardir, 'src', 'mac_to_ip.py'),
+            '--cache', self.cache_file, '-f', '3600', '-V']
+        if isinstance(self.cache([]), mac_to_ip.SqliteMacLookupCache):
+            args.append('--sqlite')
+
+        # The ip is resolved all the same
+        for index in [self.path('missing.index'), corrupt]:
+            p = subprocess.Popen(args + ['--oui-index', index, str(mac)], stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE)
+            out, err = p.communicate()
+            self.assertEquals((0, "%s unknown\n" % self.table[mac]), (p.returncode, out))
+            self.assertTrue(err.startswith("Cannot read the oui index"), err)
+
+            p = subprocess.Popen(args + ['--oui-index', index, '-q', '02:00:04'], stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE)
+            out, err = p.communicate()
+            pattern = mac_to_ip.MacPattern.from_string('02:00:04')
+            self.assertEquals("".join("%s %s unknown\n" % found for found in self.expected(pattern)), out)
+            self.assertEquals(1, len(err.splitlines()), err)
+
+class TestSqliteQuery(TestQuery):
+
+    def cache(self, targets, **kwargs):
+        return mac_to_ip.SqliteMacLookupCache(
+            self.cache_file, targets=targets, scanner=[self.scanner], **kwargs)
+
+class TestProbe(StubScannerTestCase):
+    '''
+    A lan of a thousand hosts, 10.0.0.1 to 10.0.3.232
+    '''
+
+    def setUp(self):
+        super(TestProbe, self).setUp()
+        self.clock = FakeClock(time.time())
+        mac_to_ip.time = lookupcache.time = self.clock
+        self.hosts = dict(
+            (mac_to_ip.Mac("%012x" % (i + 1)), "10.0.%d.%d" % ((i + 1) / 256, (i + 1) % 256))
+            for i in range(1000))
+        self.write_lan()
+
+    def tearDown(self):
+        mac_to_ip.time = lookupcache.time = time
+        super(TestProbe, self).tearDown()
+
+    def write_lan(self):
+        with open(self.path('lan'), 'w') as f:
+            for mac, ip in self.hosts.items():
+                f.write("%s    %s    Stub\n" % (ip, mac))
+
+    def calls(self):
+        with open(self.path('calls')) as f:
+            return f.read().splitlines()
+
+    def cache(self, **kwargs):
+        return super(TestProbe, self).cache([mac_to_ip.ScanTarget('lan')], **kwargs)
+
+    def testProbe(self):
+        cache = self.cache(probe_radius=2)
+        mac = mac_to_ip.Mac('0000000003e8')
+        self.assertEquals('10.0.3.232', cache.lookup(mac))
+        self.assertEquals(['-l'], self.calls())
+
+        # Stale: the last known ip and its neighbours are scanned, not the lan
+        self.clock.now += 31
+        self.assertEquals('10.0.3.232', cache.lookup(mac))
+        self.assertEquals('10.0.3.230 10.0.3.231 10.0.3.232 10.0.3.233 10.0.3.234', self.calls()[-1])
+        self.assertEquals(1000, len(cache.read()))
+
+        # Moved next door
+        self.hosts[mac] = '10.0.3.234'
+        self.write_lan()
+        self.clock.now += 31
+        self.assertEquals('10.0.3.234', cache.lookup(mac))
+
+        # Moved away: the probe misses and the lan is swept
+        self.hosts[mac] = '10.0.3.250'
+        self.write_lan()
+        self.clock.now += 31
+        self.assertEquals('10.0.3.250', cache.lookup(mac))
+        self.assertEquals('-l', self.calls()[-1])
+
+        statistics = cache.statistics()
+        self.assertEquals(2, statistics['scans'])
+        self.assertEquals(3, statistics['probes'])
+        self.assertEquals(2, statistics['probes_found'])
+        self.assertTrue(statistics['probe_seconds_max'] is not None)
+
+    def testGone(self):
+        cache = self.cache(probe_radius=2, negative_ttl=60)
+        mac = mac_to_ip.Mac('000000000010')
+        cache.lookup(mac)
+        ip = self.hosts.pop(mac)
+        self.write_lan()
+        self.clock.now += 31
+        self.assertRaises(KeyError, cache.lookup, mac)
+        self.assertEquals(['-l', '10.0.0.14 10.0.0.15 10.0.0.16 10.0.0.17 10.0.0.18', '-l'], self.calls())
+
+        # Back where it was once the backoff is over: found by a probe of its last ip
+        self.hosts[mac] = ip
+        self.write_lan()
+        self.clock.now += 61
+        self.assertEquals(ip, cache.lookup(mac))
+        self.assertEquals(4, len(self.calls()))
+        self.assertEquals(self.calls()[1], self.calls()[-1])
+
+    def testMany(self):
+        cache = self.cache(probe_radius=1)
+        macs = [mac_to_ip.Mac('000000000001'), mac_to_ip.Mac('000000000100')]
+        cache.lookup_many(macs)
+        self.clock.now += 31
+        self.assertEquals(2, len(cache.lookup_many(macs)))
+        self.assertEquals('10.0.0.0 10.0.0.1 10.0.0.2 10.0.0.255 10.0.1.0 10.0.1.1', self.calls()[-1])
+        self.assertEquals(2, len(self.calls()))
+
+    def testNoProbe(self):
+        cache = self.cache()
+        mac = mac_to_ip.Mac('000000000001')
+        cache.lookup(mac)
+        self.clock.now += 31
+        cache.lookup(mac)
+        self.assertEquals(['-l', '-l'], self.calls())
+        self.assertEquals(0, cache.statistics()['probes'])
+
+class TestSqliteProbe(TestProbe):
+
+    def cache(self, **kwargs):
+        return mac_to_ip.SqliteMacLookupCache(
+            self.cache_file, targets=[mac_to_ip.ScanTarget('lan')], scanner=[self.scanner], **kwargs)
+
+class TestLeases(TestProbe):
+    '''
+    The lan of TestProbe, its first 900 hosts leased by dnsmasq, and 5000 leases more
+    of hosts that are not up
+    '''
+
+    def setUp(self):
+        super(TestLeases, self).setUp()
+        leases.time = self.clock
+        self.leases = self.path('dnsmasq.leases')
+        expiry = int(self.clock.now) + 3600
+        with open(self.leases, 'w') as f:
+            for mac, ip in sorted(self.hosts.items())[:900]:
+                f.write("%d %s %s host *\n" % (expiry, mac, ip))
+            for i in range(5000):
+                f.write("%d 02:00:00:00:%02x:%02x 10.1.%d.%d * *\n" % (expiry, i / 256, i % 256, i / 256, i % 256))
+
+    def tearDown(self):
+        leases.time = time
+        super(TestLeases, self).tearDown()
+
+    def testLeased(self):
+        cache = self.cache(lease_files=[self.leases])
+        self.assertEquals('10.0.0.5', cache.lookup(mac_to_ip.Mac('000000000005')))
+        self.assertEquals('10.1.1.1', cache.lookup(mac_to_ip.Mac('020000000101')))
+        self.assertFalse(os.path.exists(self.path('calls')))
+        self.assertEquals(0, cache.statistics()['scans'])
+        self.assertTrue(os.path.exists(self.cache_file + ".leases"))
+
+        # Not leased: swept, and the sweep keeps the leases of hosts that did not answer
+        self.assertEquals('10.0.3.232', cache.lookup(mac_to_ip.Mac('0000000003e8')))
+        self.assertEquals(['-l'], self.calls())
+        self.assertEquals(6000, len(cache.read()))
+
+        # A new lease is read from where the last run left off
+        with open(self.leases, 'a') as f:
+            f.write("%d 02:00:00:01:00:00 10.2.0.1 * *\n" % (self.clock.now + 3600))
+        self.assertEquals('10.2.0.1', self.cache(lease_files=[self.leases]).lookup(mac_to_ip.Mac('020000010000')))
+        self.assertEquals(1, len(self.calls()))
+
+    def testLeasedAfterMiss(self):
+        cache = self.cache(lease_files=[self.leases])
+        mac = mac_to_ip.Mac('020000010000')
+        self.assertRaises(KeyError, cache.lookup, mac)
+        self.assertEquals(['-l'], self.calls())
+        self.assertRaises(KeyError, cache.lookup, mac)
+        self.assertEquals(1, cache.stats['negative_hits'])
+
+        # Leased while backing off: answered from the lease, without a sweep
+        with open(self.leases, 'a') as f:
+            f.write("%d 02:00:00:01:00:00 10.2.0.1 * *\n" % (self.clock.now + 3600))
+        self.assertEquals('10.2.0.1', cache.lookup(mac))
+        self.assertEquals(1, len(self.calls()))
+        self.assertFalse(mac.simple() in cache.read_negative())
+
+    def testExpired(self):
+        cache = self.cache(lease_files=[self.leases], probe_radius=2)
+        mac = mac_to_ip.Mac('000000000005')
+        cache.lookup(mac)
+        self.clock.now += 3601
+        self.assertEquals('10.0.0.5', cache.lookup(mac))
+        self.assertEquals(['10.0.0.3 10.0.0.4 10.0.0.5 10.0.0.6 10.0.0.7'], self.calls())
+
+    def testScanFailed(self):
+        cache = mac_to_ip.MacLookupCache(self.cache_file, targets=[mac_to_ip.ScanTarget('bad')],
+            scanner=[self.scanner], lease_files=[self.leases])
+        self.assertRaises(KeyError, cache.lookup, mac_to_ip.Mac('0000000003e8'))
+        self.assertEquals('10.1.0.1', cache.lookup(mac_to_ip.Mac('020000000001')))
+
+    def testCommandLine(self):
+        args = [sys.executable, os.path.join(os.path.dirname(__file__), os.pardir, 'src', 'mac_to_ip.py'),
+            '--cache', self.cache_file, '-t', 'bad', '-l', self.leases]
+        self.assertEquals("10.1.0.9\n", subprocess.check_output(args + ['02:00:00:00:00:09']))
+
+class TestSqliteLeases(TestLeases):
+
+    def cache(self, **kwargs):
+        return mac_to_ip.SqliteMacLookupCache(
+            self.cache_file, targets=[mac_to_ip.ScanTarget('lan')], scanner=[self.scanner], **kwargs)
+
+class TestSqliteCache(StubScannerTestCase):
+
+    def cache(self, targets, **kwargs):
+        return mac_to_ip.SqliteMacLookupCache(
+            self.cache_file, targets=targets, scanner=[self.scanner], **kwargs)
+
+    def testBasics(self):
+        cache = self.cache([], batch_size=2)
+        self.assertEquals(0, cache.mtime())
+        self.assertEquals({}, cache.read())
+
+        cache.write({'001122334455': '1.1.1.1', 'aabbccddeeff': '1.1.1.2', '000000000001': '1.1.1.3'})
+        self.assertTrue(cache.mtime())
+        self.assertEquals('1.1.1.2', cache._get('aabbccddeeff'))
+
+        # A later scan replaces the table
+        cache.write({'001122334455': '1.1.1.9'})
+        self.assertEquals({'001122334455': '1.1.1.9'}, cache.read())
+
+        cache.write_negative({'000000000001': {'misses': 2, 'until': 5.0}})
+        self.assertEquals({'000000000001': {'misses': 2, 'until': 5.0}}, cache.read_negative())
+
+        history = {'001122334455': {'value': '1.1.1.9', 'first': 1.0, 'checked': 7.0, 'changes': 1, 'used': 3.0}}
+        cache.write_history(history)
+        self.assertEquals(history, cache.read_history())
+        self.assertEquals(history['001122334455'], cache._get_history('001122334455'))
+
+    def testLookup(self):
+        cache = self.cache([mac_to_ip.ScanTarget('eth0'), mac_to_ip.ScanTarget('eth1')])
+        self.assertEquals('10.1.0.2', cache.lookup(mac_to_ip.Mac('000000000102')))
+
+        # Another poller sharing the database does not scan
+        other = self.cache([mac_to_ip.ScanTarget('eth0')])
+        self.assertEquals('10.0.0.1', other.lookup(mac_to_ip.Mac('000000000001')))
+        self.assertEquals(0, other.stats['scans'])
+
+        with self.assertRaises(KeyError):
+            other.lookup(mac_to_ip.Mac('0000000000ff'))
+        with self.assertRaises(KeyError):
+            cache.lookup(mac_to_ip.Mac('0000000000ff'))
+        self.assertEquals(1, cache.stats['negative_hits'])
+
+    def testConcurrentReadersAndWriter(self):
+        '''
+        Readers looking up every mac while a writer keeps replacing the table
+        should always get an answer from a whole row.
+        '''
+        macs = ['%.12x' % i for i in range(2000)]
+
+        def table(generation):
+            return dict((mac, '10.%d.%d.%d' % (generation, i / 256, i % 256)) for i, mac in enumerate(macs))
+
+        self.cache([], batch_size=250).write(table(0))
+
+        stop = threading.Event()
+        errors = []
+        lookups = []
+
+        def writer():
+            try:
+                cache = self.cache([], batch_size=250)
+                generation = 1
+                while not stop.is_set():
+                    cache.write(table(generation % 200))
+                    generation += 1
+            except Exception, e:
+                errors.append(e)
+
+        def reader(offset):
+            try:
+                cache = self.cache([])
+                count = 0
+                while not stop.is_set():
+                    i = (offset + count * 7) % len(macs)
+                    ip = cache.lookup(mac_to_ip.Mac(macs[i]), freshness=3600)
+                    if not ip.startswith('10.') or not ip.endswith('.%d.%d' % (i / 256, i % 256)):
+                        errors.append(AssertionError("%s -> %s" % (macs[i], ip)))
+                    count += 1
+                lookups.append(count)
+            except Exception, e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=writer)] + [
+            threading.Thread(target=reader, args=(n * 100,)) for n in range(8)
+        ]
+        for t in threads:
+            t.start()
+        time.sleep(2)
+        stop.set()
+        for t in threads:
+            t.join()
+
+        self.assertEquals([], errors)
+        self.assertEquals(8, len(lookups))
+        self.assertTrue(all(lookups))
+
 
 if __name__ == "__main__":
     unittest.main()
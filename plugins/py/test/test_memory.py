@@ -0,0 +1,148 @@
+#!/usr/bin/env python2.7
+'''
+Test the nagios.memory module and PluginBase's --memory
+
+This source is provided under the MIT License (see LICENSE.txt)
+Copyright (c) 2014 Ryan C. Catherman
+'''
+
+import json
+import time
+import unittest
+
+import fixtures
+import nagios.memory as memory
+import nagios.plugins as plugins
+import nagios.runner as runner
+
+MB = 1 << 20
+
+def grow(megabytes):
+    '''
+    Take megabytes of memory a few at a time, slowly enough to be sampled
+    '''
+    chunks = []
+    for _ in range(megabytes / 4):
+        chunks.append(bytearray(4 * MB))
+        time.sleep(0.005)
+    return chunks
+
+class GreedyPlugin(plugins.PluginBase):
+    '''
+    Holds --megabytes of memory while it runs
+    '''
+
+    def __init__(self, out_file):
+        super(GreedyPlugin, self).__init__(out_file)
+        self._parser.add_option('--megabytes', dest="megabytes", type="int", default=0)
+
+    def _run(self, opts):
+        chunks = grow(opts.megabytes)
+        self._output.set_simple_result("held %d chunks" % len(chunks))
+
+class TestSizes(unittest.TestCase):
+
+    def testParse(self):
+        self.assertEquals(4096, memory.parse_size('4096'))
+        self.assertEquals(512 * 1024, memory.parse_size('512K'))
+        self.assertEquals(256 * MB, memory.parse_size('256mb'))
+        self.assertEquals(3 * 512 * MB, memory.parse_size('1.5G'))
+        for bad in ['', 'M', '0', '-1K', '12X']:
+            self.assertRaises(ValueError, memory.parse_size, bad)
+
+    def testFormat(self):
+        self.assertEquals('100B', memory.format_size(100))
+        self.assertEquals('1.5MB', memory.format_size(3 * 512 * 1024))
+        self.assertEquals('2GB', memory.format_size(2 << 30))
+
+class TestMemoryProfile(unittest.TestCase):
+
+    def testGrowth(self):
+        profile = memory.MemoryProfile().start()
+        chunks = grow(64)
+        profile.stop()
+        self.assertEquals(64 * MB, sum(len(c) for c in chunks))
+
+        self.assertTrue(profile.growth >= 60 * MB, profile.growth)
+        self.assertEquals(profile.start_rss + profile.growth, profile.peak)
+        self.assertTrue(profile.peak >= profile.end_rss)
+        self.assertEquals(profile.growth, sum(size for _, size in profile.sites))
+
+        # Most of it put down to grow
+        site, size = profile.top(1)[0]
+        self.assertTrue(site.startswith('test_memory.py:'), site)
+        self.assertTrue(size >= 32 * MB, profile.sites)
+        self.assertEquals(sorted(profile.samples), profile.samples)
+
+    def testFreed(self):
+        '''
+        The peak is while it was held, not after
+        '''
+        profile = memory.MemoryProfile().start()
+        del grow(32)[:]
+        profile.stop()
+        self.assertTrue(profile.growth >= 28 * MB, profile.growth)
+
+    def testNoProc(self):
+        rss = memory.rss
+        memory.rss = lambda: None
+        try:
+            profile = memory.MemoryProfile().start().stop()
+        finally:
+            memory.rss = rss
+        self.assertEquals(memory.peak_rss(), profile.peak)
+        self.assertEquals((0, []), (profile.growth, profile.sites))
+
+class TestPluginMemory(fixtures.TempDirTestCase):
+
+    def setUp(self):
+        super(TestPluginMemory, self).setUp()
+        self.runner = runner.PluginRunner(GreedyPlugin)
+
+    def perf_data(self, result):
+        return dict((p.label, p) for p in result.perf_data)
+
+    def testPerfData(self):
+        result = self.runner.run(['--memory', '--megabytes', '32', '--memory-sites', '2'])
+        self.assertEquals(plugins.RESULT_OK, result.code, result.output)
+        perf_data = self.perf_data(result)
+        self.assertTrue(perf_data['memory_growth'].value >= 28 * MB)
+        self.assertTrue(perf_data['memory_peak'].value > perf_data['memory_growth'].value)
+        self.assertEquals('B', perf_data['memory_peak'].uom)
+        sites = [label for label in perf_data if label.startswith('memory ')]
+        self.assertTrue(1 <= len(sites) <= 2, sites)
+        self.assertTrue("'memory test_memory.py:" in result.output, result.output)
+
+        # Not unless asked for
+        self.assertEquals([], self.runner.run(['--megabytes', '4']).perf_data)
+
+    def testBudget(self):
+        result = self.runner.run(['--memory-budget', '4M', '--megabytes', '32'])
+        self.assertEquals(plugins.RESULT_WARNING, result.code)
+        self.assertTrue(result.simple.startswith("held 8 chunks; peak memory "), result.simple)
+        self.assertTrue(result.simple.endswith(" is over the budget of 4MB"), result.simple)
+        self.assertEquals(str(4 * MB), self.perf_data(result)['memory_peak'].warning)
+
+        result = self.runner.run(['--memory-budget', '64G', '--megabytes', '4'])
+        self.assertEquals(plugins.RESULT_OK, result.code)
+        self.assertEquals(plugins.RESULT_UNKNOWN, self.runner.run(['--memory-budget', 'lots']).code)
+
+    def testSnapshot(self):
+        path = self.path('snapshot.json')
+        result = self.runner.run(['--memory-snapshot', path, '--megabytes', '16'])
+        self.assertEquals(plugins.RESULT_OK, result.code)
+        with open(path) as f:
+            snapshot = json.load(f)
+        self.assertEquals('GreedyPlugin', snapshot['plugin'])
+        self.assertEquals('OK', snapshot['result'])
+        self.assertEquals(['--memory-snapshot', path, '--megabytes', '16'], snapshot['argv'])
+        self.assertEquals(self.perf_data(result)['memory_peak'].value, snapshot['peak'])
+        self.assertEquals(snapshot['growth'], sum(size for _, size in snapshot['sites']))
+
+    def testDisabled(self):
+        class Plugin(GreedyPlugin):
+            MEMORY = False
+        self.assertEquals(plugins.RESULT_UNKNOWN, runner.PluginRunner(Plugin).run(['--memory']).code)
+
+if __name__ == "__main__":
+    unittest.main()
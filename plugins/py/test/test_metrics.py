@@ -0,0 +1,138 @@
+#!/usr/bin/env python2.7
+'''
+Test the nagios.metrics module
+
+This source is provided under the MIT License (see LICENSE.txt)
+Copyright (c) 2014 Ryan C. Catherman
+'''
+
+import unittest
+import urllib2
+
+import nagios.metrics as metrics
+import nagios.plugins as plugins
+import nagios.runner as runner
+
+def result(code=plugins.RESULT_OK, perf_data=None, seconds=0.5):
+    return runner.PluginResult(code, simple="fine", perf_data=perf_data, seconds=seconds)
+
+class MetricsTests(unittest.TestCase):
+    def testEmpty(self):
+        text = metrics.MetricsExporter().render()
+        for family, _ in metrics.FAMILIES:
+            self.assertIn("# TYPE %s gauge\n" % family, text)
+        self.assertTrue(text.endswith("# EOF\n"))
+
+    def testCheck(self):
+        exporter = metrics.MetricsExporter()
+        exporter.update('web1', 'HTTP', result(plugins.RESULT_WARNING, [
+            plugins.PerfData('time', 1.25, 's', warning="1", critical="2:5"),
+            plugins.PerfData('size', 512, 'B'),
+        ]))
+        lines = exporter.render().splitlines()
+
+        key = 'host="web1",service="HTTP"'
+        self.assertIn('nagios_check_state{%s} 1' % key, lines)
+        self.assertIn('nagios_check_duration_seconds{%s} 0.5' % key, lines)
+        self.assertIn('nagios_perfdata_value{%s,label="time",uom="s"} 1.25' % key, lines)
+        self.assertIn('nagios_perfdata_value{%s,label="size",uom="B"} 512' % key, lines)
+        self.assertIn(
+            'nagios_perfdata_threshold{%s,label="time",uom="s",threshold="warning",bound="lower"} 0' % key, lines)
+        self.assertIn(
+            'nagios_perfdata_threshold{%s,label="time",uom="s",threshold="warning",bound="upper"} 1' % key, lines)
+        self.assertIn(
+            'nagios_perfdata_threshold{%s,label="time",uom="s",threshold="critical",bound="lower"} 2' % key, lines)
+        self.assertIn(
+            'nagios_perfdata_threshold{%s,label="time",uom="s",threshold="critical",bound="upper"} 5' % key, lines)
+        self.assertEquals(4, len([l for l in lines if l.startswith('nagios_perfdata_threshold')]))
+
+    def testGroupedByFamily(self):
+        exporter = metrics.MetricsExporter()
+        exporter.update('a', 'one', result(perf_data=[plugins.PerfData('x', 1)]))
+        exporter.update('b', 'two', result(perf_data=[plugins.PerfData('x', 2)]))
+        families = []
+        for line in exporter.render().splitlines():
+            if not line.startswith('#'):
+                family = line.split('{')[0]
+                if not families or families[-1] != family:
+                    families.append(family)
+        self.assertEquals(['nagios_check_state', 'nagios_check_duration_seconds', 'nagios_perfdata_value'], families)
+
+    def testThresholdsWithoutEnds(self):
+        exporter = metrics.MetricsExporter()
+        exporter.update('h', 's', result(perf_data=[
+            plugins.PerfData('inverted', 1, warning="@10:20", critical=plugins.RangeThreshold("~:")),
+        ]))
+        self.assertNotIn('nagios_perfdata_threshold{', exporter.render())
+
+    def testEscaping(self):
+        exporter = metrics.MetricsExporter()
+        exporter.update('h', 'say "hi"\\now\n', result())
+        self.assertIn('service="say \\"hi\\"\\\\now\\n"', exporter.render())
+
+    def testHostCheck(self):
+        exporter = metrics.MetricsExporter()
+        exporter.update('h', None, result(plugins.RESULT_CRITICAL))
+        self.assertIn('nagios_check_state{host="h",service=""} 2', exporter.render())
+
+    def testNoDuration(self):
+        exporter = metrics.MetricsExporter()
+        exporter.update('h', 's', result(seconds=None))
+        self.assertNotIn('nagios_check_duration_seconds{', exporter.render())
+
+    def testRenderCached(self):
+        exporter = metrics.MetricsExporter()
+        exporter.update('h', 's', result())
+        text = exporter.render()
+        self.assertIs(text, exporter.render())
+        self.assertEquals(1, exporter.renders)
+
+        exporter.update('h', 's', result(plugins.RESULT_CRITICAL))
+        self.assertIn('nagios_check_state{host="h",service="s"} 2', exporter.render())
+        self.assertNotIn('nagios_check_state{host="h",service="s"} 0', exporter.render())
+        self.assertEquals(2, exporter.renders)
+
+        exporter.remove('h', 's')
+        self.assertNotIn('nagios_check_state{', exporter.render())
+        exporter.remove('h', 's')
+        exporter.render()
+        self.assertEquals(3, exporter.renders)
+
+    def testBounded(self):
+        exporter = metrics.MetricsExporter(max_checks=3)
+        for i in range(4):
+            exporter.update('h%d' % i, 's', result())
+        # Updating h1 makes h2 the oldest
+        exporter.update('h1', 's', result())
+        exporter.update('h4', 's', result())
+        self.assertEquals(3, len(exporter))
+        text = exporter.render()
+        for host in ['h0', 'h2']:
+            self.assertNotIn('host="%s"' % host, text)
+        for host in ['h1', 'h3', 'h4']:
+            self.assertIn('host="%s"' % host, text)
+
+    def testRunnerSeconds(self):
+        class Plugin(plugins.PluginBase):
+            def _run(self, opts):
+                self._output.set_simple_result("fine")
+        r = runner.PluginRunner(Plugin).run([])
+        self.assertTrue(r.seconds >= 0)
+
+    def testServe(self):
+        exporter = metrics.MetricsExporter()
+        exporter.update('h', 's', result())
+        server = metrics.serve(exporter, ('127.0.0.1', 0))
+        try:
+            url = "http://127.0.0.1:%d" % server.server_address[1]
+            response = urllib2.urlopen(url + "/metrics")
+            self.assertEquals(metrics.CONTENT_TYPE, response.info()['Content-Type'])
+            self.assertEquals(exporter.render(), response.read())
+            with self.assertRaises(urllib2.HTTPError):
+                urllib2.urlopen(url + "/other")
+        finally:
+            server.shutdown()
+            server.server_close()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -8,11 +8,17 @@ Copyright (c) 2014 Ryan C. Catherman
 
 import optparse
 import os
+import subprocess
+import sys
+import threading
+import time
 import unittest
 import StringIO
 
+import check_random
 import mac_to_ip
 import nagios.plugins as plugins
+import nagios.runner as runner
 
 class OptionTests(unittest.TestCase):
     def setUp(self):
@@ -106,6 +112,21 @@ class OutputTests(unittest.TestCase):
         self.assertEquals(plugins.RESULT_OK, e.exception.code)
         self.assertEquals('short\n', self.__file.getvalue())
 
+    def testPerfData(self):
+        '''
+        Perf data goes after a | on the first line
+        '''
+        plugins.parse_options(self.__parser, ['-v', '-v'], self.__handler)
+
+        self.__handler.set_simple_result('short', 'long')
+        self.__handler.add_multiline('more')
+        self.__handler.add_perf_data('time', 0.25, 's', plugins.RangeThreshold('1'), '~:2', 0)
+        self.__handler.add_perf_data('used space', 80, '%')
+        with self.assertRaises(SystemExit) as e:
+            self.__handler.display_and_exit()
+
+        self.assertEquals("long | time=0.25s;1;~:2;0 'used space'=80%\nmore\n", self.__file.getvalue())
+
 class RangeTests(unittest.TestCase):
 
     def test_simple(self):
@@ -191,6 +212,20 @@ class RangeTests(unittest.TestCase):
             with self.assertRaises(ValueError):
                 plugins.RangeThreshold._parse_range(test)
 
+    def test_floats(self):
+        ranges = plugins.RangeThreshold._parse_range("10:20")
+        self.assertFalse(plugins.RangeThreshold._check_value(ranges, 9.5))
+        self.assertTrue(plugins.RangeThreshold._check_value(ranges, 10.0))
+        self.assertTrue(plugins.RangeThreshold._check_value(ranges, 20.0))
+        self.assertFalse(plugins.RangeThreshold._check_value(ranges, 20.5))
+
+        ranges = plugins.RangeThreshold._parse_range("@10:20")
+        self.assertTrue(plugins.RangeThreshold._check_value(ranges, 9.5))
+        self.assertFalse(plugins.RangeThreshold._check_value(ranges, 10.0))
+        self.assertFalse(plugins.RangeThreshold._check_value(ranges, 15.5))
+        self.assertFalse(plugins.RangeThreshold._check_value(ranges, 20.0))
+        self.assertTrue(plugins.RangeThreshold._check_value(ranges, 20.5))
+
     def test_optparse(self):
         '''
         Test the use case for the warning and critical thresholds.
@@ -214,6 +249,122 @@ class RangeTests(unittest.TestCase):
         self.assertFalse(critical.is_allowed(4))
         self.assertTrue(critical.is_allowed(5))
 
+class SamplesTests(unittest.TestCase):
+
+    def testAggregates(self):
+        samples = plugins.Samples(range(1, 101))
+        self.assertEquals(50.5, samples.aggregate('mean'))
+        self.assertEquals(1, samples.aggregate('min'))
+        self.assertEquals(100, samples.aggregate('max'))
+        self.assertEquals(50, samples.aggregate('p50'))
+        self.assertEquals(95, samples.aggregate('p95'))
+        self.assertEquals(99, samples.aggregate('p99'))
+
+        samples = plugins.Samples()
+        samples.append(7)
+        self.assertEquals(7, samples.aggregate('p99'))
+        samples.append(1)
+        self.assertEquals(1, samples.aggregate('p50'))
+        self.assertEquals(2, len(samples))
+
+class SequencePlugin(plugins.PluginBase):
+    '''
+    Samples 1, 2, 3... taking --delay seconds for each
+    '''
+
+    SAMPLING = True
+    SAMPLE_UOM = 'ms'
+    DEFAULT_WARNING = "~:"
+    DEFAULT_CRITICAL = "~:"
+
+    def __init__(self, out_file=sys.stdout):
+        super(SequencePlugin, self).__init__(out_file)
+        self._parser.add_option('--delay', dest="delay", type="float", default=0)
+        self.__lock = threading.Lock()
+        self.__next = 0
+
+    def _sample(self, opts):
+        time.sleep(opts.delay)
+        with self.__lock:
+            self.__next += 1
+            return self.__next
+
+    def _run(self, opts):
+        self._output.set_simple_result("single %d" % self._sample(opts))
+
+class SamplingTests(unittest.TestCase):
+
+    def setUp(self):
+        self.__runner = runner.PluginRunner(SequencePlugin)
+
+    def testSingle(self):
+        result = self.__runner.run([])
+        self.assertEquals('single 1\n', result.output)
+
+    def testAggregate(self):
+        result = self.__runner.run(['--samples', '20', '--aggregate', 'p95', '-w', '19', '-c', '20'])
+        self.assertEquals(plugins.RESULT_OK, result.code, result.output)
+        self.assertEquals('p95 of 20 samples is 19', result.simple)
+
+        perf = dict((p.label, p) for p in result.perf_data)
+        self.assertEquals(['max', 'mean', 'min', 'p50', 'p95', 'p99', 'samples'], sorted(perf))
+        self.assertEquals(10.5, perf['mean'].value)
+        self.assertEquals('p95=19.0ms;19;20', str(perf['p95']))
+        self.assertEquals('mean=10.5ms', str(perf['mean']))
+        self.assertEquals('samples=20', str(perf['samples']))
+
+        # Not enough for the critical threshold, but the mean is over the warning
+        result = self.__runner.run(['--samples', '20', '-w', '10', '-c', '19'])
+        self.assertEquals(plugins.RESULT_WARNING, result.code, result.output)
+        self.assertTrue(result.output.startswith('mean of 20 samples is 10.5 | '), result.output)
+
+        result = self.__runner.run(['--samples', '20', '--aggregate', 'max', '-c', '19'])
+        self.assertEquals(plugins.RESULT_CRITICAL, result.code, result.output)
+
+    def testBadCount(self):
+        result = self.__runner.run(['--samples', '0'])
+        self.assertEquals(plugins.RESULT_UNKNOWN, result.code)
+
+    def testInterval(self):
+        start = time.time()
+        self.__runner.run(['--samples', '3', '--interval', '0.1'])
+        self.assertTrue(time.time() - start >= 0.2)
+
+    def testConcurrent(self):
+        start = time.time()
+        result = self.__runner.run(['--samples', '10', '--delay', '0.2', '--concurrent', '--aggregate', 'min'])
+        self.assertTrue(time.time() - start < 1)
+        self.assertEquals('min of 10 samples is 1', result.simple)
+
+    def testCheckRandom(self):
+        result = runner.PluginRunner(check_random.CheckRandom).run(
+            ['-n', '5', '-x', '5', '--samples', '5', '--aggregate', 'p99', '-w', '4'])
+        self.assertEquals(plugins.RESULT_WARNING, result.code)
+        self.assertEquals('p99 of 5 samples is 5', result.simple)
+
+
+class ImportTests(unittest.TestCase):
+
+    # Run in a fresh interpreter: other tests import them all
+    SCRIPT = '''
+import sys
+import check_random
+import nagios.runner as runner
+runner.PluginRunner(check_random.CheckRandom).run(["-w", "50:"])
+print " ".join(sorted(m for m in sys.modules if m.startswith("nagios.")))
+'''
+
+    def loaded(self):
+        p = subprocess.Popen([sys.executable, '-c', self.SCRIPT], stdout=subprocess.PIPE)
+        return p.communicate()[0].split()
+
+    def testLazy(self):
+        '''
+        A plugin using no state, history or memory profile pays nothing for them at startup
+        '''
+        loaded = self.loaded()
+        for module in ['nagios.state', 'nagios.tsdb', 'nagios.memory']:
+            self.assertFalse(module in loaded, module)
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,276 @@
+#!/usr/bin/env python2.7
+'''
+Test the nagios.objects module
+
+This source is provided under the MIT License (see LICENSE.txt)
+Copyright (c) 2014 Ryan C. Catherman
+'''
+
+import os
+import shutil
+import StringIO
+import unittest
+
+import check_random
+import fixtures
+import nagios.objects as objects
+import nagios.runner as runner
+
+CONFIG = '''
+# The example of README.txt
+define command {
+    command_name    check-random
+    command_line    /usr/lib/nagios/plugins/check_random --min 0 --max 100 -w 0:90 -c 0:95
+}
+
+define service {
+    hosts       localhost
+    service_description  random
+    check_command check-random
+    use generic-service
+    notification_interval 0
+}
+
+define service {
+    name                    generic-service ; a template
+    register                0
+    check_interval          5
+}
+
+define command{
+    command_name    check-random-args
+    command_line    $USER1$/check_random.py --min $ARG1$ --max $ARG2$ -w '$_SERVICEWARN$'
+}
+
+define command {
+    command_name    check-ping-mac
+    command_line    $USER1$/check_ping -H `$USER1$/mac_to_ip $_HOSTMAC$` -w 5000,100% -c 5000,100%
+}
+
+define host {
+    name            generic-host
+    register        0
+    _mac            00:11:22:33:44:55
+}
+
+define host {
+    use             generic-host
+    host_name       web1
+    address         10.0.0.1
+    hostgroups      web
+}
+
+define host {
+    use             generic-host
+    host_name       web2
+    address         10.0.0.2
+}
+
+define host {
+    host_name       db1
+    address         10.0.1.1
+}
+
+define hostgroup {
+    hostgroup_name  web
+    members         web2
+}
+
+define service {
+    name                    random-template
+    check_command           check-random-args!$HOSTADDRESS$!50
+    register                0
+    _warn                   0:40\\;x
+}
+
+define service {
+    use                     random-template
+    hostgroup_name          web
+    host_name               db1
+    service_description     random args
+}
+
+define service {
+    host_name               *, !db1
+    service_description     ping
+    check_command           check-ping-mac
+}
+
+define service {
+    host_name               db1
+    service_description     bad options
+    check_command           check-random-args!0!x
+    _warn                   0:40
+}
+
+define service {
+    host_name               db1
+    service_description     not ours
+    check_command           check-other
+}
+
+define command {
+    command_name    check-other
+    command_line    /usr/lib/nagios/plugins/check_other -H $HOSTADDRESS$ -t $TIMEOUT$
+}
+'''
+
+class ObjectsTests(fixtures.TempDirTestCase):
+
+    def setUp(self):
+        super(ObjectsTests, self).setUp()
+        self.fname = self.path('objects.cfg')
+        with open(self.fname, 'w') as f:
+            f.write(CONFIG)
+        objects.register_plugin('check_random', check_random.CheckRandom)
+
+    def tearDown(self):
+        super(ObjectsTests, self).tearDown()
+        objects.PLUGINS.clear()
+
+    def services(self, **kwargs):
+        config = objects.ObjectConfig([self.fname], **kwargs)
+        return dict(((s.host_name, s.service_description), s) for s in config.services())
+
+    def testReadObjects(self):
+        blocks = list(objects.read_objects(StringIO.StringIO(CONFIG)))
+        self.assertEquals('command', blocks[0][0])
+        self.assertEquals({
+            'command_name': 'check-random',
+            'command_line': '/usr/lib/nagios/plugins/check_random --min 0 --max 100 -w 0:90 -c 0:95',
+        }, blocks[0][1])
+        self.assertEquals('generic-service', blocks[2][1]['name'])
+        self.assertEquals('command', blocks[3][0])
+        self.assertEquals('0:40;x', [b for k, b in blocks if b.get('name') == 'random-template'][0]['_warn'])
+
+    def testReadmeExample(self):
+        check = self.services()[('localhost', 'random')]
+        self.assertEquals(check_random.CheckRandom, check.factory)
+        self.assertEquals(None, check.error)
+        self.assertEquals(
+            ['/usr/lib/nagios/plugins/check_random', '--min', '0', '--max', '100', '-w', '0:90', '-c', '0:95'],
+            check.argv)
+        self.assertEquals(0, check.options.min)
+        self.assertEquals(100, check.options.max)
+
+        result = runner.PluginRunner(check.factory).run(check.argv)
+        self.assertTrue(result.simple.startswith('value is'))
+
+    def testMacrosTemplatesGroups(self):
+        services = self.services(resources={'USER1': '/opt/plugins'})
+        self.assertEquals(
+            [('db1', 'random args'), ('web1', 'random args'), ('web2', 'random args')],
+            sorted(k for k in services if k[1] == 'random args'))
+
+        check = services[('web2', 'random args')]
+        self.assertEquals("/opt/plugins/check_random.py --min 10.0.0.2 --max 50 -w '0:40;x'", check.command_line)
+        # Parsing the options found the bad --min
+        self.assertEquals(None, check.options)
+        self.assertTrue('--min' in check.error)
+
+        check = services[('db1', 'bad options')]
+        self.assertEquals("/opt/plugins/check_random.py --min 0 --max x -w '0:40'", check.command_line)
+        self.assertTrue(check.error)
+
+    def testNotInProcess(self):
+        services = self.services(resources={'USER1': '/opt/plugins'})
+        self.assertEquals(['web1', 'web2'], sorted(h for h, s in services if s == 'ping'))
+        check = services[('web1', 'ping')]
+        self.assertEquals(
+            "/opt/plugins/check_ping -H `/opt/plugins/mac_to_ip 00:11:22:33:44:55` -w 5000,100% -c 5000,100%",
+            check.command_line)
+        self.assertEquals("Needs a shell", check.error)
+        self.assertEquals(None, check.factory)
+
+        check = services[('db1', 'not ours')]
+        self.assertEquals("Unresolved macro $TIMEOUT$", check.error)
+
+        # Without the resources, $USER1$ stays
+        self.assertTrue(self.services()[('web1', 'ping')].error.startswith("Unresolved macro"))
+
+    def testNoPlugin(self):
+        with open(self.fname, 'a') as f:
+            f.write('''
+define command {
+    command_name    check-disk
+    command_line    /usr/lib/nagios/plugins/check_disk -w 10%
+}
+define service {
+    host_name               db1
+    service_description     disk
+    check_command           check-disk
+}
+''')
+        check = self.services()[('db1', 'disk')]
+        self.assertEquals(['/usr/lib/nagios/plugins/check_disk', '-w', '10%'], check.argv)
+        self.assertEquals("No plugin registered for check_disk", check.error)
+
+    def testThresholds(self):
+        with open(self.fname, 'a') as f:
+            f.write('''
+define command {
+    command_name    check-random-thresholds
+    command_line    /usr/lib/nagios/plugins/check_random -w $ARG1$ -c $ARG2$
+}
+define service {
+    host_name               db1
+    service_description     tight
+    check_command           check-random-thresholds!0:10!0:20
+}
+define service {
+    host_name               web1
+    service_description     loose
+    check_command           check-random-thresholds!0:50!0:60
+}
+define command {
+    command_name    check-random-defaults
+    command_line    /usr/lib/nagios/plugins/check_random --max 10
+}
+define service {
+    host_name               db1
+    service_description     defaults
+    check_command           check-random-defaults
+}
+''')
+        services = self.services()
+        tight = services[('db1', 'tight')].options
+        self.assertEquals(('0:10', '0:20'), (str(tight.warning), str(tight.critical)))
+        self.assertTrue(tight.warning.is_allowed(10))
+        self.assertFalse(tight.warning.is_allowed(11))
+        loose = services[('web1', 'loose')].options
+        self.assertEquals(('0:50', '0:60'), (str(loose.warning), str(loose.critical)))
+
+        # Not given: the plugin's defaults
+        defaults = services[('db1', 'defaults')].options
+        self.assertEquals(('0:90', '0:95'), (str(defaults.warning), str(defaults.critical)))
+
+    def testMainConfig(self):
+        os.mkdir(os.path.join(self.dir, 'conf.d'))
+        shutil.move(self.fname, os.path.join(self.dir, 'conf.d', 'objects.cfg'))
+        with open(os.path.join(self.dir, 'conf.d', 'ignored.txt'), 'w') as f:
+            f.write('define host {\n}\n')
+        with open(os.path.join(self.dir, 'resource.cfg'), 'w') as f:
+            f.write('# Sets $USER1$\n$USER1$=/opt/plugins\n')
+        main = os.path.join(self.dir, 'nagios.cfg')
+        with open(main, 'w') as f:
+            f.write('cfg_dir=conf.d\nresource_file=resource.cfg\nlog_file=/var/log/nagios.log\n')
+
+        files, resources = objects.read_main_config(main)
+        self.assertEquals([os.path.join(self.dir, 'conf.d', 'objects.cfg')], files)
+        self.assertEquals({'USER1': '/opt/plugins'}, resources)
+
+    def testManyObjects(self):
+        with open(self.fname, 'a') as f:
+            for i in range(2000):
+                f.write('define host {\n    host_name h%d\n    address 10.1.%d.%d\n}\n' % (i, i / 256, i % 256))
+                for s in range(5):
+                    f.write('define service {\n    host_name h%d\n    service_description s%d\n'
+                        '    check_command check-random-args!%d!100\n    _warn 0:90\n}\n' % (i, s, s))
+        checks = [c for c in objects.ObjectConfig([self.fname], {'USER1': '/p'}).services()
+            if c.host_name.startswith('h') and c.service_description != 'ping']
+        self.assertEquals(10000, len(checks))
+        self.assertTrue(all(c.error is None for c in checks))
+        self.assertEquals(3, checks[-2].options.min)
+
+if __name__ == "__main__":
+    unittest.main()
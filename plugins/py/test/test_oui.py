@@ -0,0 +1,154 @@
+#!/usr/bin/env python2.7
+'''
+Test the oui vendor index
+
+This source is provided under the MIT License (see LICENSE.txt)
+Copyright (c) 2014 Ryan C. Catherman
+'''
+
+import os
+import StringIO
+import subprocess
+import sys
+import time
+import unittest
+
+import fixtures
+import mac_to_ip
+import nagios.oui as oui
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'src')
+
+MA_L = '''Registry,Assignment,Organization Name,Organization Address
+MA-L,002272,American Micro-Fuel Device Corp.,2181 Buchanan Loop Ferndale WA US 98248
+MA-L,0050C2,IEEE Registration Authority,"445 Hoes Lane Piscataway NJ US 08554 "
+MA-L,70B3D5,IEEE Registration Authority,445 Hoes Lane Piscataway NJ US 08554
+MA-L,FCFFAA,"Vendor, With Comma",Somewhere
+'''
+
+MA_M = '''Registry,Assignment,Organization Name,Organization Address
+MA-M,70B3D5A,Medium Block Inc,Somewhere
+'''
+
+MA_S = '''Registry,Assignment,Organization Name,Organization Address
+MA-S,70B3D5A12,Small Block GmbH,Somewhere
+IAB,0050C2FF0,Old Iab Ltd,Somewhere
+'''
+
+OUI_TXT = '''OUI/MA-L                                                    Organization
+company_id                                                  Organization
+                                                            Address
+
+00-00-0C   (hex)\t\tCisco Systems, Inc
+00000C     (base 16)\t\tCisco Systems, Inc
+\t\t\t\t170 WEST TASMAN DRIVE
+'''
+
+ARP_SCAN = '''# ieee-oui.txt
+000000\tXEROX CORPORATION
+00000C\tCisco Systems, Inc
+'''
+
+class OuiTests(fixtures.TempDirTestCase):
+
+    def setUp(self):
+        super(OuiTests, self).setUp()
+        self.index = self.path('oui.index')
+        entries = []
+        for data in [MA_L, MA_M, MA_S]:
+            entries.extend(oui.read_registry(StringIO.StringIO(data)))
+        oui.compile_index(entries, self.index)
+
+    def tearDown(self):
+        for index in oui._indexes.values():
+            index.close()
+        oui._indexes.clear()
+        super(OuiTests, self).tearDown()
+
+    def vendor(self, mac):
+        return mac_to_ip.Mac(mac).vendor(self.index)
+
+    def testReadRegistry(self):
+        self.assertEquals(
+            [('0050C2FF0', 'Old Iab Ltd')],
+            list(oui.read_registry(StringIO.StringIO(MA_S)))[1:])
+        self.assertEquals(
+            [('00000C', 'Cisco Systems, Inc')],
+            list(oui.read_registry(StringIO.StringIO(OUI_TXT))))
+        self.assertEquals(
+            [('000000', 'XEROX CORPORATION'), ('00000C', 'Cisco Systems, Inc')],
+            list(oui.read_registry(StringIO.StringIO(ARP_SCAN))))
+
+    def testLongestPrefix(self):
+        self.assertEquals('American Micro-Fuel Device Corp.', self.vendor('00:22:72:01:02:03'))
+        self.assertEquals('Vendor, With Comma', self.vendor('fc:ff:aa:ff:ff:ff'))
+        self.assertEquals('Small Block GmbH', self.vendor('70:b3:d5:a1:20:00'))
+        self.assertEquals('Small Block GmbH', self.vendor('70:b3:d5:a1:2f:ff'))
+        self.assertEquals('Medium Block Inc', self.vendor('70:b3:d5:a1:30:00'))
+        self.assertEquals('Medium Block Inc', self.vendor('70:b3:d5:af:ff:ff'))
+        self.assertEquals('IEEE Registration Authority', self.vendor('70:b3:d5:b0:00:00'))
+        self.assertEquals('Old Iab Ltd', self.vendor('00:50:c2:ff:0a:bc'))
+        self.assertEquals('IEEE Registration Authority', self.vendor('00:50:c2:ff:1a:bc'))
+
+    def testUnknown(self):
+        self.assertEquals(None, self.vendor('00:00:00:00:00:00'))
+        self.assertEquals(None, self.vendor('ff:ff:ff:ff:ff:ff'))
+        self.assertEquals(None, self.vendor('00:22:71:ff:ff:ff'))
+        self.assertEquals(None, self.vendor('00:22:73:00:00:00'))
+
+        empty = self.path('empty')
+        oui.compile_index([], empty)
+        self.assertEquals(0, len(oui.OuiIndex(empty)))
+        self.assertEquals(None, mac_to_ip.Mac('00:22:72:01:02:03').vendor(empty))
+
+    def testNotAnIndex(self):
+        with open(self.path('other'), 'w') as f:
+            f.write('x' * 64)
+        self.assertRaises(ValueError, oui.OuiIndex, self.path('other'))
+        self.assertRaises(IOError, mac_to_ip.Mac('00:22:72:01:02:03').vendor, self.path('nothing'))
+
+    def testLaterEntriesWin(self):
+        oui.compile_index([('002272', 'Old Name'), ('002272', 'New Name')], self.index)
+        self.assertEquals('New Name', oui.OuiIndex(self.index).vendor(0x002272000000))
+
+    def testFast(self):
+        '''
+        Microseconds per lookup, even through a full size index
+        '''
+        big = self.path('big')
+        oui.compile_index(
+            [("%06X" % (i * 331), "Vendor %d" % i) for i in range(40000)] +
+            [("%07X" % (i * 4099), "Medium %d" % i) for i in range(5000)] +
+            [("%09X" % (i * 1048573), "Small %d" % i) for i in range(6000)],
+            big)
+        index = oui.OuiIndex(big)
+        self.assertEquals(51000, len(index))
+        self.assertEquals('Vendor 7', index.vendor((7 * 331) << 24 | 0x123456))
+        self.assertEquals('Small 9', index.vendor((9 * 1048573) << 12 | 0xabc))
+
+        start = time.time()
+        for i in range(10000):
+            index.vendor(i * 0x9e3779b97f4a7c15 & 0xffffffffffff)
+        self.assertTrue((time.time() - start) / 10000 < 0.0002)
+
+    def testLazy(self):
+        script = (
+            "import sys, mac_to_ip; mac = mac_to_ip.Mac('00:22:72:01:02:03');"
+            "print 'nagios.oui' in sys.modules, mac.vendor(sys.argv[1]), 'nagios.oui' in sys.modules")
+        out = subprocess.check_output(
+            [sys.executable, '-c', script, self.index], env=dict(os.environ, PYTHONPATH=SRC))
+        self.assertEquals("False American Micro-Fuel Device Corp. True\n", out)
+
+    def testOuiIndex(self):
+        registries = []
+        for name, data in [('oui.csv', MA_L), ('mam.csv', MA_M), ('ieee-oui.txt', ARP_SCAN)]:
+            registries.append(self.path(name))
+            with open(registries[-1], 'w') as f:
+                f.write(data)
+        out = subprocess.check_output(
+            [sys.executable, os.path.join(SRC, 'oui_index.py'), '-o', self.index] + registries)
+        self.assertEquals("7 prefixes in %s\n" % self.index, out)
+        self.assertEquals('XEROX CORPORATION', self.vendor('00:00:00:12:34:56'))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,173 @@
+#!/usr/bin/env python2.7
+'''
+Test the nagios.runner module
+
+This source is provided under the MIT License (see LICENSE.txt)
+Copyright (c) 2014 Ryan C. Catherman
+'''
+
+import sys
+import time
+import unittest
+
+import check_random
+import nagios.plugins as plugins
+import nagios.runner as runner
+
+class ThresholdPlugin(plugins.PluginBase):
+    '''
+    Reports --value against the thresholds, with perfdata
+    '''
+
+    DEFAULT_WARNING = "~:"
+    DEFAULT_CRITICAL = "~:"
+
+    def __init__(self, out_file=sys.stdout):
+        super(ThresholdPlugin, self).__init__(out_file)
+        self._parser.add_option('--value', dest="value", type="int", default=0)
+        self._parser.add_option('--fail', dest="fail", action="store_true", default=False)
+        self._parser.add_option('--silent', dest="silent", action="store_true", default=False)
+
+    def _run(self, opts):
+        if opts.fail:
+            raise Exception("asked to")
+        if opts.silent:
+            return
+        self._output.add_perf_data('value', opts.value,
+            warning=self._warning, critical=self._critical, minimum=-20)
+        self._output.add_multiline('checked %d' % opts.value)
+        if not self._critical.is_allowed(opts.value):
+            raise plugins.NagiosCritical("value %d" % opts.value)
+        if not self._warning.is_allowed(opts.value):
+            raise plugins.NagiosWarning("value %d" % opts.value)
+        self._output.set_simple_result("value %d" % opts.value, "value %d is fine" % opts.value)
+
+def reference_allowed(range_, value):
+    '''
+    The range format as the plugin guidelines describe it, written independently of
+    RangeThreshold. Return whether value is allowed, or None for an invalid range.
+    '''
+    invert = range_.startswith('@')
+    if invert:
+        range_ = range_[1:]
+    try:
+        if ':' not in range_:
+            start, end = 0, (int(range_) if range_ else float('inf'))
+        else:
+            left, right = range_.split(':', 1)
+            start = float('-inf') if left == '~' else int(left or 0)
+            end = int(right) if right else float('inf')
+    except ValueError:
+        return None
+    if start > end:
+        return None
+    if invert and float('inf') in (abs(start), abs(end)):
+        # RangeThreshold insists on both ends with @
+        return None
+    inside = start <= value <= end
+    return not inside if invert else inside
+
+class TestRunner(unittest.TestCase):
+
+    def setUp(self):
+        self.__runner = runner.PluginRunner(ThresholdPlugin)
+
+    def testOk(self):
+        result = self.__runner.run(['--value', '5', '-vv'])
+        self.assertEquals(plugins.RESULT_OK, result.code)
+        self.assertEquals('value 5', result.simple)
+        self.assertEquals('value 5 is fine', result.long)
+        self.assertEquals(['checked 5'], result.multilines)
+        self.assertEquals(['value=5;~:;~:;-20'], [str(p) for p in result.perf_data])
+        self.assertEquals('value 5 is fine | value=5;~:;~:;-20\nchecked 5\n', result.output)
+
+    def testThresholds(self):
+        result = self.__runner.run(['--value', '5', '-w', '3', '-c', '10'])
+        self.assertEquals(plugins.RESULT_WARNING, result.code)
+        self.assertEquals('value=5;3;10;-20', str(result.perf_data[0]))
+
+        # Nothing leaks into the next run
+        result = self.__runner.run(['--value', '5'])
+        self.assertEquals(plugins.RESULT_OK, result.code)
+
+        result = self.__runner.run(['--value', '50', '-c', '10'])
+        self.assertEquals(plugins.RESULT_CRITICAL, result.code)
+        self.assertEquals('value 50 | value=50;~:;10;-20\n', result.output)
+
+    def testFailures(self):
+        result = self.__runner.run(['--fail'])
+        self.assertEquals(plugins.RESULT_UNKNOWN, result.code)
+        self.assertEquals('Unexpected failure: asked to\n', result.output)
+
+        result = self.__runner.run(['--silent'])
+        self.assertEquals(plugins.RESULT_UNKNOWN, result.code)
+
+        result = self.__runner.run(['-w', 'x'])
+        self.assertEquals(plugins.RESULT_UNKNOWN, result.code)
+        self.assertTrue('Invalid range' in result.output)
+
+        result = self.__runner.run(['--version'])
+        self.assertEquals(plugins.RESULT_UNKNOWN, result.code)
+
+    def testStdoutUntouched(self):
+        stdout = sys.stdout
+        try:
+            sys.stdout = None
+            results = list(runner.PluginRunner(check_random.CheckRandom).run_many(
+                [['-n', '1', '-x', '1']] * 10))
+        finally:
+            sys.stdout = stdout
+        self.assertEquals(['value is 1\n'] * 10, [r.output for r in results])
+
+    def testVolume(self):
+        start = time.time()
+        results = list(self.__runner.run_many(
+            ['--value', str(i % 30), '-w', '10', '-c', '20'] for i in xrange(5000)))
+        self.assertTrue(time.time() - start < 5)
+        self.assertEquals([0] * 11 + [1] * 10 + [2] * 9, [r.code for r in results[:30]])
+
+class TestFuzz(unittest.TestCase):
+
+    def testRandomRange(self):
+        '''
+        RangeThreshold agrees with the reference on random ranges and values
+        '''
+        import random
+        rng = random.Random(1)
+        for _ in xrange(100000):
+            range_ = runner.random_range(rng)
+            value = rng.randint(-25, 25)
+            expected = reference_allowed(range_, value)
+            try:
+                allowed = plugins.RangeThreshold(range_).is_allowed(value)
+            except ValueError:
+                allowed = None
+            self.assertEquals(expected, allowed, "%r with %d" % (range_, value))
+
+    def testPlugin(self):
+        '''
+        The plugin exits with what the reference says for random -w and -c
+        '''
+        def make_argv(rng):
+            return ['--value', str(rng.randint(-25, 25)),
+                '-w', runner.random_range(rng), '-c', runner.random_range(rng)]
+
+        def check(argv, result):
+            value = int(argv[1])
+            warning = reference_allowed(argv[3], value)
+            critical = reference_allowed(argv[5], value)
+            if warning is None or critical is None:
+                return result.code == plugins.RESULT_UNKNOWN
+            if not critical:
+                return result.code == plugins.RESULT_CRITICAL
+            if not warning:
+                return result.code == plugins.RESULT_WARNING
+            return result.code == plugins.RESULT_OK and result.perf_data[0].value == value
+
+        failures = runner.fuzz(runner.PluginRunner(ThresholdPlugin), make_argv, check,
+            iterations=10000, seed=2)
+        self.assertEquals([], failures[:5])
+
+
+if __name__ == "__main__":
+    unittest.main()
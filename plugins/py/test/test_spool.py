@@ -0,0 +1,104 @@
+#!/usr/bin/env python2.7
+'''
+Test the nagios.spool module
+
+This source is provided under the MIT License (see LICENSE.txt)
+Copyright (c) 2014 Ryan C. Catherman
+'''
+
+import os
+import StringIO
+import time
+import unittest
+
+import check_random
+import fixtures
+import nagios.plugins as plugins
+import nagios.spool as spool
+
+class TestCheckResult(unittest.TestCase):
+
+    def testServiceRecord(self):
+        result = spool.CheckResult('web1', 'http', 1, 'slow|time=5s\nline two\n',
+            start_time=100.5, finish_time=101.25)
+        record = result.spool_record()
+
+        self.assertTrue(record.endswith('\n\n'))
+        fields = dict(l.split('=', 1) for l in record.splitlines() if '=' in l)
+        self.assertEquals('web1', fields['host_name'])
+        self.assertEquals('http', fields['service_description'])
+        self.assertEquals('1', fields['check_type'])
+        self.assertEquals('1', fields['return_code'])
+        self.assertEquals('100.500000', fields['start_time'])
+        self.assertEquals('101.250000', fields['finish_time'])
+        self.assertEquals('slow|time=5s\\nline two', fields['output'])
+
+    def testHostRecord(self):
+        record = spool.CheckResult('web1', None, 0, 'up').spool_record()
+        self.assertFalse('service_description' in record)
+        self.assertTrue('Host Check Result' in record)
+
+    def testCommand(self):
+        self.assertEquals('[101] PROCESS_SERVICE_CHECK_RESULT;web1;http;2;down\n',
+            spool.CheckResult('web1', 'http', 2, 'down\n', finish_time=101.9).command())
+        self.assertEquals('[101] PROCESS_HOST_CHECK_RESULT;web1;0;up\n',
+            spool.CheckResult('web1', None, 0, 'up', finish_time=101).command())
+
+    def testFromPlugin(self):
+        plugin = check_random.CheckRandom(StringIO.StringIO())
+        result = spool.CheckResult.from_plugin(
+            plugin, ['check_random', '-n', '5', '-x', '5'], 'localhost', 'random')
+        self.assertEquals(plugins.RESULT_OK, result.return_code)
+        self.assertEquals('value is 5\n', result.output)
+        self.assertTrue(result.start_time <= result.finish_time)
+
+class TestSpoolWriter(fixtures.TempDirTestCase):
+
+    def __spooled(self):
+        '''
+        The files nagios would read, as a list of lists of host names
+        '''
+        batches = []
+        for name in sorted(os.listdir(self.dir)):
+            if name.endswith('.ok'):
+                self.assertTrue(os.path.exists(self.path(name[:-3])))
+                continue
+            self.assertTrue(name.startswith('c') and len(name) == 7, name)
+            self.assertTrue(os.path.exists(self.path(name + '.ok')), name)
+            with open(self.path(name)) as f:
+                batches.append([l.split('=', 1)[1] for l in f.read().splitlines() if l.startswith('host_name=')])
+        return batches
+
+    def __results(self, count):
+        return [spool.CheckResult('host%d' % i, 'svc', 0, 'ok') for i in range(count)]
+
+    def testBatches(self):
+        with spool.SpoolWriter(self.dir, batch_size=10, flush_interval=60) as writer:
+            writer.extend(self.__results(25))
+            self.assertEquals(2, writer.files_written)
+        self.assertEquals(3, writer.files_written)
+        self.assertEquals(25, writer.results_written)
+
+        batches = self.__spooled()
+        self.assertEquals([10, 10, 5], sorted([len(b) for b in batches], reverse=True))
+        self.assertEquals(25, len(set(sum(batches, []))))
+
+    def testFlushInterval(self):
+        writer = spool.SpoolWriter(self.dir, batch_size=100, flush_interval=0.1)
+        writer.extend(self.__results(3))
+        self.assertEquals([], self.__spooled())
+
+        time.sleep(0.5)
+        self.assertEquals([['host0', 'host1', 'host2']], self.__spooled())
+
+        writer.close()
+        self.assertEquals(1, writer.files_written)
+
+    def testNothingPending(self):
+        with spool.SpoolWriter(self.dir) as writer:
+            pass
+        self.assertEquals([], os.listdir(self.dir))
+
+
+if __name__ == "__main__":
+    unittest.main()
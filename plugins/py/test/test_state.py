@@ -0,0 +1,172 @@
+#!/usr/bin/env python2.7
+'''
+Test the nagios.state module
+
+This source is provided under the MIT License (see LICENSE.txt)
+Copyright (c) 2014 Ryan C. Catherman
+'''
+
+import os
+import StringIO
+import time
+import unittest
+
+import fixtures
+import nagios.plugins as plugins
+import nagios.state as state
+
+class TestCounterDelta(unittest.TestCase):
+
+    def testFirstSample(self):
+        self.assertEquals(None, state.counter_delta(None, 10, 5))
+
+    def testIncrease(self):
+        self.assertEquals((50, 10), state.counter_delta((100, 50), 110, 100))
+
+    def testNoTimePassed(self):
+        self.assertEquals(None, state.counter_delta((100, 50), 100, 60))
+
+    def testWrap(self):
+        self.assertEquals((20, 10), state.counter_delta((100, 2 ** 32 - 10), 110, 10))
+        self.assertEquals((20, 10), state.counter_delta((100, 2 ** 64 - 10), 110, 10, wrap=2 ** 64))
+
+    def testReset(self):
+        # Went back from the bottom half: the device restarted
+        self.assertEquals(None, state.counter_delta((100, 1000), 110, 10))
+        # Without a wrap every decrease is a reset
+        self.assertEquals(None, state.counter_delta((100, 2 ** 32 - 10), 110, 10, wrap=None))
+
+class TestStateStore(fixtures.TempDirTestCase):
+
+    def setUp(self):
+        super(TestStateStore, self).setUp()
+        self.__fname = self.path('state')
+
+    def testBasics(self):
+        store = state.StateStore(self.__fname)
+        self.assertEquals(None, store.get('one'))
+        store.set('one', 1, timestamp=100.5)
+        store.set('two', 2 ** 64 - 1, timestamp=200)
+        self.assertEquals((100.5, 1), store.get('one'))
+
+        # Another instance (another run) sees the same
+        other = state.StateStore(self.__fname)
+        self.assertEquals((200, 2 ** 64 - 1), other.get('two'))
+        self.assertEquals(2, len(other))
+
+        store.set('one', 11, timestamp=101)
+        self.assertEquals((101, 11), other.get('one'))
+        self.assertEquals(2, len(other))
+
+    def testUpdate(self):
+        store = state.StateStore(self.__fname)
+        self.assertEquals((1, 1), store.update('n', lambda p: (1, 1) if p is None else None))
+        self.assertEquals(None, store.update('n', lambda p: None))
+        self.assertEquals((2, 2), store.update('n', lambda p: (p[0] + 1, p[1] + 1)))
+        self.assertEquals((2, 2), store.get('n'))
+
+    def testGrow(self):
+        store = state.StateStore(self.__fname, capacity=8)
+        other = state.StateStore(self.__fname, capacity=8)
+        other.get('warm up the mapping')
+
+        for i in range(1000):
+            store.set('key%d' % i, i, timestamp=i + 1)
+        self.assertEquals(1000, len(store))
+
+        # The other instance had the small table mapped
+        for i in range(0, 1000, 7):
+            self.assertEquals((i + 1, i), other.get('key%d' % i))
+        self.assertEquals(None, other.get('key1000'))
+
+    def testNotAStateFile(self):
+        with open(self.__fname, 'w') as f:
+            f.write('x' * 100)
+        with self.assertRaises(ValueError):
+            state.StateStore(self.__fname).get('one')
+
+    def testConcurrentUpdates(self):
+        '''
+        Processes incrementing the same entry should not lose any increment
+        '''
+        state.StateStore(self.__fname).set('n', 0, timestamp=1)
+
+        children = []
+        for _ in range(4):
+            pid = os.fork()
+            if pid == 0:
+                try:
+                    store = state.StateStore(self.__fname, capacity=8)
+                    for i in range(250):
+                        store.update('n', lambda p: (p[0], p[1] + 1))
+                        # and grow the table under the others' feet
+                        store.set('%d-%d' % (os.getpid(), i), i)
+                finally:
+                    os._exit(0)
+            children.append(pid)
+        for pid in children:
+            os.waitpid(pid, 0)
+
+        store = state.StateStore(self.__fname)
+        self.assertEquals(1000, store.get('n')[1])
+        self.assertEquals(1001, len(store))
+
+    def testConstantCost(self):
+        '''
+        A lookup in a store of many series costs about what it does in a small one
+        '''
+        def cost(store):
+            start = time.time()
+            for i in range(500):
+                store.get('key%d' % i)
+            return time.time() - start
+
+        small = state.StateStore(self.__fname + '.small')
+        for i in range(100):
+            small.set('key%d' % i, i)
+
+        big = state.StateStore(self.__fname + '.big', capacity=2 ** 19)
+        for i in range(200000):
+            big.set('key%d' % i, i)
+
+        self.assertTrue(cost(big) < 5 * cost(small) + 0.01)
+
+class CountingPlugin(plugins.PluginBase):
+
+    def __init__(self, fname):
+        self.STATE_FILE = fname
+        super(CountingPlugin, self).__init__(StringIO.StringIO())
+
+    def _run(self, opts):
+        rate = self._state.counter_rate('eth0', 1000 + int(opts.verbosity) * 500, timestamp=100 + opts.verbosity * 10)
+        self._output.set_simple_result("rate %s" % rate)
+
+class TestPluginState(fixtures.TempDirTestCase):
+
+    def setUp(self):
+        super(TestPluginState, self).setUp()
+        self.__fname = self.path('state')
+
+    def testCounterRate(self):
+        plugin_state = state.PluginState(state.StateStore(self.__fname), 'check_if')
+        self.assertEquals(None, plugin_state.counter_rate('eth0', 1000, timestamp=100))
+        self.assertEquals(50.0, plugin_state.counter_rate('eth0', 1500, timestamp=110))
+        self.assertEquals((110, 1500), plugin_state.get('eth0'))
+
+        # Instances and plugins do not collide
+        other = state.PluginState(state.StateStore(self.__fname), 'check_disk')
+        self.assertEquals(None, other.get('eth0'))
+        self.assertEquals(None, plugin_state.get('eth1'))
+
+    def testPluginBase(self):
+        plugin = CountingPlugin(self.__fname)
+        with self.assertRaises(SystemExit):
+            plugin([])
+        plugin = CountingPlugin(self.__fname)
+        with self.assertRaises(SystemExit):
+            plugin(['-v'])
+        self.assertEquals('rate 50.0\n', plugin._output.file().getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main()
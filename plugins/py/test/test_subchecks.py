@@ -0,0 +1,135 @@
+#!/usr/bin/env python2.7
+'''
+Test the nagios.subchecks module
+
+This source is provided under the MIT License (see LICENSE.txt)
+Copyright (c) 2014 Ryan C. Catherman
+'''
+
+import sys
+import time
+import unittest
+
+import nagios.plugins as plugins
+import nagios.runner as runner
+import nagios.subchecks as subchecks
+
+class WebPlugin(subchecks.SubCheckPlugin):
+    '''
+    reachable -> port -> http, and reachable -> dns, with --fail naming the
+    sub-check that should go critical
+    '''
+
+    def __init__(self, out_file=sys.stdout):
+        super(WebPlugin, self).__init__(out_file)
+        self._parser.add_option('--fail', dest="fail", action="append", default=[])
+        self._parser.add_option('--delay', dest="delay", type="float", default=0)
+
+    def _subchecks(self, opts):
+        def node(name):
+            def check(opts):
+                time.sleep(opts.delay)
+                if name in opts.fail:
+                    raise plugins.NagiosCritical("%s is down" % name)
+                if name == 'dns':
+                    return plugins.RESULT_WARNING, "slow answer"
+                return "%s is up" % name
+            return check
+
+        return [
+            subchecks.SubCheck('reachable', node('reachable')),
+            subchecks.SubCheck('port', node('port'), depends=['reachable']),
+            subchecks.SubCheck('http', node('http'), depends=['port']),
+            subchecks.SubCheck('dns', node('dns'), depends=['reachable']),
+            subchecks.SubCheck('tls', node('tls'), depends=['port']),
+        ]
+
+class TestRunSubchecks(unittest.TestCase):
+
+    def testParallelBranches(self):
+        '''
+        Independent sub-checks run at the same time, dependents wait
+        '''
+        started = {}
+        def node(name):
+            def check(opts):
+                started[name] = time.time()
+                time.sleep(0.2)
+            return check
+
+        start = time.time()
+        results = subchecks.run_subchecks([
+            subchecks.SubCheck('a', node('a')),
+            subchecks.SubCheck('b', node('b')),
+            subchecks.SubCheck('c', node('c')),
+            subchecks.SubCheck('d', node('d'), depends=['a', 'b', 'c']),
+        ], None)
+        elapsed = time.time() - start
+
+        self.assertTrue(0.4 <= elapsed < 0.6, elapsed)
+        self.assertTrue(started['d'] - start >= 0.2)
+        self.assertEquals(['a', 'b', 'c', 'd'], [r.name for r in results])
+        self.assertTrue(all(r.result == plugins.RESULT_OK for r in results))
+
+    def testSkipCascades(self):
+        def fail(opts):
+            raise Exception("boom")
+        ran = []
+        results = subchecks.run_subchecks([
+            subchecks.SubCheck('c', lambda opts: ran.append('c'), depends=['b']),
+            subchecks.SubCheck('b', lambda opts: ran.append('b'), depends=['a']),
+            subchecks.SubCheck('a', fail),
+            subchecks.SubCheck('x', lambda opts: ran.append('x')),
+        ], None)
+        self.assertEquals(['x'], ran)
+        self.assertEquals([None, None, plugins.RESULT_UNKNOWN, plugins.RESULT_OK],
+            [r.result for r in results])
+        self.assertEquals('c SKIPPED - b did not pass', str(results[0]))
+
+    def testBadGraphs(self):
+        with self.assertRaises(ValueError):
+            subchecks.run_subchecks([subchecks.SubCheck('a', None, depends=['b'])], None)
+        with self.assertRaises(ValueError):
+            subchecks.run_subchecks([
+                subchecks.SubCheck('a', None, depends=['b']),
+                subchecks.SubCheck('b', None, depends=['a']),
+            ], None)
+        with self.assertRaises(ValueError):
+            subchecks.run_subchecks([
+                subchecks.SubCheck('a', None), subchecks.SubCheck('a', None),
+            ], None)
+
+class TestSubCheckPlugin(unittest.TestCase):
+
+    def setUp(self):
+        self.__runner = runner.PluginRunner(WebPlugin)
+
+    def testWarning(self):
+        result = self.__runner.run(['-vv'])
+        self.assertEquals(plugins.RESULT_WARNING, result.code, result.output)
+        self.assertEquals('1 WARNING, 4 OK: dns WARNING - slow answer', result.simple)
+        self.assertEquals(5, len(result.multilines))
+        self.assertTrue(result.multilines[0].startswith('reachable OK - reachable is up ('))
+        self.assertEquals(['reachable', 'port', 'http', 'dns', 'tls', 'total'],
+            [p.label for p in result.perf_data])
+
+    def testFailedBranch(self):
+        result = self.__runner.run(['--fail', 'port', '-vv'])
+        self.assertEquals(plugins.RESULT_CRITICAL, result.code, result.output)
+        self.assertEquals(
+            '1 CRITICAL, 1 WARNING, 2 SKIPPED, 1 OK: port CRITICAL - port is down', result.simple)
+        self.assertTrue('http SKIPPED - port did not pass' in result.multilines)
+        # Skipped sub-checks have no time to report
+        self.assertEquals(['reachable', 'port', 'dns', 'total'], [p.label for p in result.perf_data])
+
+    def testLatency(self):
+        '''
+        Two levels of dependencies take two steps, not one per sub-check
+        '''
+        start = time.time()
+        result = self.__runner.run(['--delay', '0.2'])
+        self.assertTrue(time.time() - start < 0.9, result.output)
+
+
+if __name__ == "__main__":
+    unittest.main()
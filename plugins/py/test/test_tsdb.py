@@ -0,0 +1,278 @@
+#!/usr/bin/env python2.7
+'''
+Test the nagios.tsdb module
+
+This source is provided under the MIT License (see LICENSE.txt)
+Copyright (c) 2014 Ryan C. Catherman
+'''
+
+import array
+import os
+import StringIO
+import time
+import unittest
+
+import fixtures
+import nagios.plugins as plugins
+import nagios.runner as runner
+import nagios.tsdb as tsdb
+
+class FakeClock(object):
+    '''
+    Stands in for the time module in nagios.tsdb
+    '''
+
+    def __init__(self, now):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+def points(timestamps, values):
+    values = array.array('d', values)
+    return tsdb.Points(0, array.array('d', timestamps), array.array('d', [1.0]) * len(values),
+        values, values, values)
+
+class TestPoints(unittest.TestCase):
+
+    def testAggregates(self):
+        p = points([0, 60, 120, 180], [10, 12, 14, 16])
+        self.assertEquals(13, p.aggregate('mean'))
+        self.assertEquals(10, p.aggregate('min'))
+        self.assertEquals(16, p.aggregate('max'))
+        self.assertEquals(16, p.aggregate('last'))
+        self.assertEquals(4, p.aggregate('count'))
+        self.assertAlmostEquals(2 / 60.0, p.aggregate('slope'))
+        self.assertAlmostEquals(120, p.aggregate('slope:3600'))
+        # 16 at 180, 100 is 84 * 30 seconds later
+        self.assertAlmostEquals(84 * 30 - 20, p.aggregate('time_to:100', now=200))
+        # Moving away
+        self.assertEquals(None, p.aggregate('time_to:0', now=200))
+
+    def testTooFew(self):
+        self.assertEquals(None, points([], []).aggregate('mean'))
+        self.assertEquals(None, points([5], [1]).aggregate('slope'))
+        self.assertEquals(1, points([5], [1]).aggregate('last'))
+        self.assertEquals(None, points([5, 6], [1, 1]).aggregate('time_to:2'))
+
+    def testParse(self):
+        self.assertEquals(('time_to', 90.0), tsdb.parse_aggregate('time_to:90'))
+        self.assertEquals(('slope', None), tsdb.parse_aggregate('slope'))
+        self.assertEquals(('slope', 60.0), tsdb.parse_aggregate('slope:60'))
+        for bad in ['median', 'time_to', 'slope:0', 'time_to:x', 'mean:5']:
+            self.assertRaises(ValueError, tsdb.parse_aggregate, bad)
+
+class TestTimeSeriesStore(fixtures.TempDirTestCase):
+
+    def setUp(self):
+        super(TestTimeSeriesStore, self).setUp()
+        self.now = 1400000000
+
+    def testAppend(self):
+        store = tsdb.TimeSeriesStore(self.dir)
+        for i in range(10):
+            self.assertTrue(store.append('disk', i, self.now + i * 60))
+        p = store.points('disk', self.now + 60, self.now + 180)
+        self.assertEquals([self.now + 60, self.now + 120, self.now + 180], list(p.timestamps))
+        self.assertEquals([1, 2, 3], list(p.values()))
+
+        # Out of order is dropped, the same time is not
+        self.assertFalse(store.append('disk', 100, self.now))
+        self.assertTrue(store.append('disk', 100, self.now + 540))
+        self.assertEquals(11, len(store.points('disk', self.now, self.now + 540)))
+
+        # Nothing stored is no points
+        self.assertEquals(0, len(store.points('other', self.now, self.now + 540)))
+        self.assertEquals(['disk'], store.series())
+
+    def testDownsampling(self):
+        store = tsdb.TimeSeriesStore(self.dir)
+        start = self.now - self.now % 3600
+        for i in range(120):
+            store.append('load', i % 7, start + i * 60)
+
+        buckets = store.points('load', start, start + 7200, resolution=300)
+        self.assertEquals(24, len(buckets))
+        self.assertEquals([0, 1, 2, 3, 4], list(store.points('load', start, start + 240).values()))
+        self.assertEquals([0, 5, 10, 0, 4], [buckets.timestamps[0] - start, buckets.counts[0],
+            buckets.sums[0], buckets.mins[0], buckets.maxs[0]])
+        self.assertEquals(
+            store.points('load', start, start + 7200, resolution=0).aggregate('mean'),
+            buckets.aggregate('mean'))
+        self.assertEquals(2, len(store.points('load', start, start + 7200, resolution=3600)))
+
+        # The finest level holding the start of the range
+        self.assertEquals(0, store.points('load', start, start + 86400).resolution)
+        self.assertEquals(300, store.points('load', start, start + 86400 * 3).resolution)
+        self.assertEquals(3600, store.points('load', start, start + 86400 * 60).resolution)
+
+    def testRetention(self):
+        store = tsdb.TimeSeriesStore(self.dir, levels=[(0, 1000), (100, 10000)])
+        for i in range(2000):
+            store.append('x', i, self.now + i * 10)
+        end = self.now + 19990
+
+        raw = store.points('x', self.now, end, resolution=0)
+        # Trimmed once more than 1250 seconds old, to 1000 seconds
+        self.assertTrue(101 <= len(raw) <= 126, len(raw))
+        self.assertEquals(1999, raw.aggregate('last'))
+        self.assertTrue(101 <= len(store.points('x', self.now, end, resolution=100)) <= 126)
+
+    def testLevels(self):
+        self.assertRaises(AssertionError, tsdb.TimeSeriesStore, self.dir, [(300, 10), (0, 10)])
+        store = tsdb.TimeSeriesStore(self.dir)
+        store.append('x', 1, self.now)
+        with open(self.path([n for n in os.listdir(self.dir) if n.endswith('.0')][0]), 'r+b') as f:
+            f.write('garbage!')
+        self.assertRaises(ValueError, store.series)
+
+    def testRangeCost(self):
+        '''
+        A query of a few points costs about the same however long the series
+        '''
+        def fill(name, count):
+            store = tsdb.TimeSeriesStore(self.path(name), levels=[(0, 10 ** 9)])
+            for i in range(count):
+                store.append(name, i, self.now + i)
+            return store
+
+        def cost(store, name, count):
+            start = time.time()
+            for _ in range(100):
+                self.assertEquals(10, len(store.points(name, self.now + count / 2, self.now + count / 2 + 9)))
+            return time.time() - start
+
+        small = fill('small', 100)
+        big = fill('big', 20000)
+        self.assertTrue(cost(big, 'big', 20000) < 3 * cost(small, 'small', 100) + 0.01)
+
+class DiskPlugin(plugins.PluginBase):
+    '''
+    Reports its only argument as the perf data "used"
+    '''
+
+    def __init__(self, out_file, path):
+        self.HISTORY_PATH = path
+        super(DiskPlugin, self).__init__(out_file)
+
+    def _run(self, opts):
+        used = float(opts.used)
+        self._output.add_perf_data('used', used, '%')
+        self._output.set_simple_result("%g%% used" % used)
+
+class TestPluginHistory(fixtures.TempDirTestCase):
+
+    def setUp(self):
+        super(TestPluginHistory, self).setUp()
+        self.clock = FakeClock(1400000000)
+        tsdb.time = self.clock
+
+        dir = self.dir
+        class Plugin(DiskPlugin):
+            def __init__(self, out_file):
+                super(Plugin, self).__init__(out_file, dir)
+                self._parser.add_option('--used', dest="used", default=0)
+        self.runner = runner.PluginRunner(Plugin)
+
+    def tearDown(self):
+        tsdb.time = time
+        super(TestPluginHistory, self).tearDown()
+
+    def fill(self, rate, minutes, host='db1', args=()):
+        '''
+        Run every minute with used growing by rate a minute, return the last result
+        '''
+        for i in range(minutes):
+            result = self.runner.run(['--history', host, '--used', str(50 + rate * i)] + list(args))
+            self.clock.now += 60
+        return result
+
+    def testRecorded(self):
+        self.fill(0.5, 10)
+        self.fill(0, 3, host='db2')
+        store = tsdb.TimeSeriesStore(self.dir)
+        self.assertEquals(['Plugin/db1/used', 'Plugin/db2/used'], store.series())
+        p = store.points('Plugin/db1/used', self.clock.now - 3600, self.clock.now)
+        self.assertEquals([50 + 0.5 * i for i in range(10)], list(p.values()))
+
+        # Not without --history
+        self.runner.run(['--used', '1'])
+        self.assertEquals(2, len(store.series()))
+
+    def testTrend(self):
+        args = ['--history', 'db1', '--trend', 'time_to:100', '--trend-window', '1800',
+            '--trend-warning', '86400:', '--trend-critical', '3600:']
+
+        # Too little history to tell
+        result = self.runner.run(args + ['--used', '50'])
+        self.assertEquals(plugins.RESULT_OK, result.code)
+        self.assertEquals("50% used | used=50.0%", result.output.strip())
+
+        # Filling 0.3% a minute: full in about two hours
+        self.fill(0.3, 30)
+        result = self.runner.run(args + ['--used', '59'])
+        self.assertEquals(plugins.RESULT_WARNING, result.code, result.output)
+        self.assertTrue(result.simple.startswith("59% used; time_to:100 of used over 1800s is 8"), result.simple)
+        self.assertEquals('used_time_to', result.perf_data[-1].label)
+
+        self.assertEquals(plugins.RESULT_CRITICAL, self.fill(1.5, 30, args=args).code)
+        self.assertEquals(plugins.RESULT_OK, self.fill(0, 30, args=args).code)
+
+        # Only the trend
+        result = self.runner.run(['--history', 'db1', '--trend', 'mean', '--trend-window', '60', '--used', '50'])
+        self.assertEquals(plugins.RESULT_OK, result.code)
+        self.assertEquals(('used_mean', 50.0), (result.perf_data[-1].label, result.perf_data[-1].value))
+
+    def testTrendAggregatedOnce(self):
+        self.fill(0.3, 30)
+        calls = []
+        aggregate = tsdb.TimeSeriesStore.aggregate
+        def counted(store, *args, **kwargs):
+            calls.append(args)
+            return aggregate(store, *args, **kwargs)
+        tsdb.TimeSeriesStore.aggregate = counted
+        try:
+            result = self.runner.run(['--history', 'db1', '--trend', 'time_to:100', '--trend-window', '1800',
+                '--trend-warning', '86400:', '--trend-critical', '3600:', '--used', '59'])
+        finally:
+            tsdb.TimeSeriesStore.aggregate = aggregate
+        self.assertEquals(plugins.RESULT_WARNING, result.code, result.output)
+        self.assertEquals(1, len(calls))
+
+    def testTrendHelp(self):
+        help = DiskPlugin(StringIO.StringIO(), self.dir)._parser.get_option('--trend').help
+        for name in tsdb.AGGREGATES:
+            self.assertTrue(name in help, name)
+
+    def testBadTrend(self):
+        self.assertEquals(plugins.RESULT_UNKNOWN, self.runner.run(['--trend', 'slope']).code)
+        self.assertEquals(plugins.RESULT_UNKNOWN, self.runner.run(['--history', 'a', '--trend', 'median']).code)
+        self.assertEquals(plugins.RESULT_UNKNOWN,
+            self.runner.run(['--history', 'a', '--trend', 'slope', '--trend-warning', 'x']).code)
+
+    def testCheckHistory(self):
+        store = tsdb.TimeSeriesStore(self.dir)
+        # Growing by at most 30 an hour
+        threshold = plugins.RangeThreshold('~:30')
+        self.assertEquals((None, True), threshold.check_history(store, 'x', 'slope:3600', 600))
+        for i in range(10):
+            store.append('x', i, self.clock.now - 600 + i * 60)
+        value, allowed = threshold.check_history(store, 'x', 'slope:3600', 600)
+        self.assertAlmostEquals(60, value)
+        self.assertFalse(allowed)
+
+    def testOutputHandler(self):
+        store = tsdb.TimeSeriesStore(self.dir)
+        output = plugins.OutputHandler(StringIO.StringIO())
+        output.set_history(store, 'check_load/')
+        output.add_perf_data('load1', 0.5)
+        output.add_perf_data('state', 'up')
+        output.set_simple_result("fine")
+        with self.assertRaises(SystemExit):
+            output.display_and_exit()
+        output.record_history()
+        self.assertEquals(['check_load/load1'], store.series())
+        self.assertEquals(1, len(store.points('check_load/load1', self.clock.now - 1)))
+
+if __name__ == "__main__":
+    unittest.main()